@@ -6,43 +6,46 @@ tabletop game rulebooks.
 It supports multiple query strategies and vector backends, and logs
 metrics/artifacts for each run.
 """
+import os
 import argparse
+import asyncio
 import json
+from typing import TYPE_CHECKING, Optional, Union
 
-from langchain_openai import ChatOpenAI
-from rag.indexing import load_vectorstore
-from rag.query_translation import QueryTranslator
-from rag.query_construction import get_prompt
-from langsmith import traceable
-from rag.tracing import (
-    traced_translate,
-    traced_retrieve,
-    traced_construct_prompt,
-    traced_generate,
-)
-from rag.langchain_callback import UsageTrackingCallback
-from rag.config_schema import RulebookConfig
-
-import mlflow
-from rag.ml_tracking import (
-    start_experiment,
-    log_pipeline_params,
-    log_pipeline_metrics,
-    log_artifacts
-)
-
-from pydantic import SecretStr
+from rag import instrumentation
+from rag.answer_cache import AnswerCache
 
 from config.config import load_config_from_file
 
-
-@traceable(name="RAG End-to-End")
-def run_pipeline(question: str, strategy: str, use_pinecone: bool,
-                 namespace: str, supported_games: dict,
-                 openai_api_key: str) -> str:
+# The pipeline, LLM clients, vectorstore backends and MLflow are imported
+#   only once the arguments ask for them, so `--help` and argument errors
+#   return immediately and a run loads just the backend it uses
+if TYPE_CHECKING:
+    from rag.ml_tracking import MLflowLogger, NullLogger
+    from rag.server import PipelineRegistry
+
+
+async def arun_pipeline(question: str, strategy: str, use_pinecone: bool,
+                        namespace: str, supported_games: dict,
+                        openai_api_key: str,
+                        answer_cache: Optional[AnswerCache] = None,
+                        target: Optional[str] = None,
+                        fetch_k: Optional[int] = None,
+                        retrieval: str = "vector",
+                        lexical_threshold: float = 0.8,
+                        stream: bool = False,
+                        context_tokens: int = 2000,
+                        tracker: Optional["MLflowLogger"] = None,
+                        adaptive_fallback: str = "multi_query",
+                        adaptive_min_score: float = 0.5,
+                        adaptive_min_spread: float = 0.02) -> str:
     """
     Runs the full RAG pipeline: query translation, retrieval, prompt
-        construction, and response generation.
+        construction, and response generation, overlapping the stages
+        where possible. The vectorstore is opened and the original
+        question retrieved while the query is translated, and each
+        translated query is retrieved as soon as its line of the LLM output
+        arrives.
     Logs metrics and artifacts for each run.
 
     Args:
@@ -54,72 +57,161 @@ def run_pipeline(question: str, strategy: str, use_pinecone: bool,
             retrieval.
         supported_games (dict): Mapping of supported games and their
             abbreviations.
+        answer_cache (AnswerCache): Optional cache for answers to repeated
+            or near-duplicate questions.
+        target (str): Vectorstore backend ("pinecone", "chroma" or
+            "local"). Overrides `use_pinecone` when given.
+        fetch_k (int): Hits fetched per translated query before the result
+            lists are fused.
+        retrieval (str): "vector", "hybrid" (vector + BM25) or "lexical"
+            (BM25 only when its top hit is confident, else hybrid).
+        lexical_threshold (float): Minimum normalized BM25 score of the top
+            hit for the lexical fast path.
+        stream (bool): Print the answer's tokens to stdout as they are
+            generated.
+        context_tokens (int): Token budget of the context passed to the
+            LLM.
+        tracker (MLflowLogger): Logger for the run's metrics and artifacts
+            (NullLogger to skip tracking). Defaults to the process-wide
+            MLflowLogger.
+        adaptive_fallback (str): Strategy the "adaptive" strategy escalates
+            to when the untranslated question retrieves weak hits.
+        adaptive_min_score (float): Top relevance score below which the
+            adaptive strategy escalates.
+        adaptive_min_spread (float): Gap between the best and worst hit
+            below which the adaptive strategy escalates.
+
+    Returns:
+        str: The generated answer from the LLM.
+    """
+    from rag.pipeline import RAGPipeline
+
+    pipeline = RAGPipeline(namespace=namespace,
+                           supported_games=supported_games,
+                           openai_api_key=openai_api_key,
+                           target=target or ("pinecone" if use_pinecone
+                                             else "chroma"),
+                           strategy=strategy,
+                           answer_cache=answer_cache,
+                           fetch_k=fetch_k,
+                           retrieval=retrieval,
+                           lexical_threshold=lexical_threshold,
+                           context_tokens=context_tokens,
+                           lazy=True,
+                           tracker=tracker,
+                           adaptive_fallback=adaptive_fallback,
+                           adaptive_min_score=adaptive_min_score,
+                           adaptive_min_spread=adaptive_min_spread)
+    if not stream:
+        return (await pipeline.aanswer(question))["answer"]
+
+    answer = pipeline.astream(question)
+    async for token in answer:
+        print(token, end="", flush=True)
+    print()
+    return answer.result["answer"]
+
+
+def run_pipeline(question: str, strategy: str, use_pinecone: bool,
+                 namespace: str, supported_games: dict,
+                 openai_api_key: str, **kwargs) -> str:
+    """
+    Synchronous wrapper around `arun_pipeline`, which documents the
+        arguments.
 
     Returns:
         str: The generated answer from the LLM.
     """
-    # Get the full name of the game being queried
-    game = "N/A"
-    for _game, details in supported_games.items():
-        if details['abbr'] == namespace:
-            game = _game
-            break
-    # Add game context to the question for LLM, but instruct not to mention
-    #   the game name
-    game_context = (f"\n[The query is pertaining to the game '{game}'. "
-                    f"Do not mention the game name.]\n")
-
-    start_experiment()
-    with mlflow.start_run():
-        callback = UsageTrackingCallback()
-        model = "gpt-4o-mini"
-        # Initialize LLM with callback for usage tracking
-        llm = ChatOpenAI(model=model, temperature=0, callbacks=[callback],
-                         api_key=SecretStr(openai_api_key))
-        translator = QueryTranslator(llm, strategy=strategy)
-        prompt = get_prompt()
-        # Load the appropriate vectorstore (Pinecone or Chroma)
-        vectorstore = load_vectorstore(namespace=namespace,
-                                       persist_dir="data/vectorstore",
-                                       use_pinecone=use_pinecone)
-        retriever = vectorstore.as_retriever()
-
-        # Log pipeline parameters to MLflow
-        log_pipeline_params({
-            "question": question,
-            "strategy": strategy,
-            "vectorstore": "pinecone" if use_pinecone else "chroma",
-            "namespace": namespace,
-            "llm_model": model
-        })
-
-        # Translate the question according to the chosen strategy
-        queries = traced_translate(translator, question + game_context)
-        if isinstance(queries, str):
-            queries = [queries]
-
-        # Retrieve relevant documents
-        docs = traced_retrieve(retriever, queries)
-        # Construct the context for the prompt
-        context = traced_construct_prompt(docs)
-        # Generate the final response
-        response = traced_generate(prompt, llm, context, question)
-
-        # Log metrics to MLflow
-        log_pipeline_metrics({
-            "num_queries": len(queries),
-            "num_docs": len(docs),
-            "response_length": len(response),
-            "prompt_tokens": callback.prompt_tokens,
-            "completion_tokens": callback.completion_tokens,
-            "total_tokens": callback.total_tokens,
-            "llm_calls": callback.calls
-        })
-
-        # Log artifacts (response, context, token details)
-        log_artifacts(response, context, callback.completion_token_details)
-
-        return response
+    return asyncio.run(arun_pipeline(question, strategy, use_pinecone,
+                                     namespace, supported_games,
+                                     openai_api_key, **kwargs))
+
+
+def get_answer_cache(args) -> Optional[AnswerCache]:
+    if args.no_answer_cache:
+        return None
+    return AnswerCache(threshold=args.cache_threshold)
+
+
+def get_tracker(args) -> Union["MLflowLogger", "NullLogger"]:
+    if args.no_tracking:
+        from rag.ml_tracking import NullLogger
+
+        return NullLogger()
+    from rag.ml_tracking import get_logger
+
+    return get_logger(policy=args.tracking_queue)
+
+
+def build_registry(args, supported_games: dict,
+                   openai_api_key: str) -> "PipelineRegistry":
+    """
+    Creates a registry that builds one pipeline per namespace on first use.
+    """
+    from rag.pipeline import STRATEGIES, RAGPipeline
+    from rag.server import PipelineRegistry
+    from rag.vectorstore_pool import VectorStorePool
+
+    namespaces = {game["abbr"] for game in supported_games.values()}
+    answer_cache = get_answer_cache(args)
+    tracker = get_tracker(args)
+    # One embeddings client and backend connection for every namespace
+    pool = VectorStorePool(target=args.target,
+                           max_open=args.max_open_namespaces,
+                           max_mb=args.max_vectorstore_mb,
+                           warm=args.warm_namespaces or ())
+
+    def build_pipeline(namespace: str) -> RAGPipeline:
+        if namespace not in namespaces:
+            raise ValueError(f"Unsupported namespace: {namespace}")
+        return RAGPipeline(namespace=namespace,
+                           supported_games=supported_games,
+                           openai_api_key=openai_api_key,
+                           target=args.target,
+                           strategy=args.strategy,
+                           answer_cache=answer_cache,
+                           fetch_k=args.fetch_k,
+                           retrieval=args.retrieval,
+                           lexical_threshold=args.lexical_threshold,
+                           context_tokens=args.context_tokens,
+                           tracker=tracker,
+                           pool=pool,
+                           adaptive_fallback=args.adaptive_fallback,
+                           adaptive_min_score=args.adaptive_min_score,
+                           adaptive_min_spread=args.adaptive_min_spread)
+
+    return PipelineRegistry(build_pipeline, strategies=STRATEGIES)
+
+
+def serve(args, supported_games: dict, openai_api_key: str):
+    """
+    Runs the long-lived query server. Pipelines are built once per
+        namespace and shared by every request.
+    """
+    from rag.server import serve_http, serve_stdio
+
+    registry = build_registry(args, supported_games, openai_api_key)
+    if args.serve == "http":
+        asyncio.run(serve_http(registry, args.namespace, host=args.host,
+                               port=args.port,
+                               max_concurrency=args.max_concurrency))
+    else:
+        asyncio.run(serve_stdio(registry, args.namespace,
+                                max_concurrency=args.max_concurrency))
+
+
+def batch(args, supported_games: dict, openai_api_key: str):
+    """
+    Answers every question in a JSONL file, streaming results to
+        --output in completion order.
+    """
+    from rag.batch import run_batch
+
+    registry = build_registry(args, supported_games, openai_api_key)
+    summary = asyncio.run(run_batch(registry, args.batch, args.output,
+                                    concurrency=args.max_concurrency,
+                                    default_namespace=args.namespace))
+    print(json.dumps(summary))
 
 
 def create_parser(supported_games):
@@ -137,32 +229,203 @@ def create_parser(supported_games):
 
     parser.add_argument(
         "-q", "--question",
-        required=True,
-        help="The user question to answer."
+        help=("The user question to answer. Required unless --serve or "
+              "--batch is used.")
     )
 
     parser.add_argument(
         "-s", "--strategy",
         default="passthrough",
         choices=["passthrough", "multi_query", "rag_fusion", "hyde",
-                 "step_back", "decompose"],
-        help="Query translation strategy to use."
+                 "step_back", "decompose", "adaptive"],
+        help=("Query translation strategy to use. `adaptive` retrieves the "
+              "question as is and only translates it (with "
+              "--adaptive_fallback) when the hits score poorly.")
+    )
+
+    parser.add_argument(
+        "--adaptive_fallback",
+        default="multi_query",
+        choices=["multi_query", "rag_fusion", "hyde", "step_back",
+                 "decompose"],
+        help="Strategy `adaptive` escalates to (default: multi_query)."
+    )
+
+    parser.add_argument(
+        "--adaptive_min_score",
+        type=float,
+        default=0.5,
+        help=("Top relevance score below which `adaptive` escalates "
+              "(default: 0.5).")
+    )
+
+    parser.add_argument(
+        "--adaptive_min_spread",
+        type=float,
+        default=0.02,
+        help=("Score gap between the best and worst hit below which "
+              "`adaptive` escalates (default: 0.02).")
     )
 
     parser.add_argument(
         "-t", "--target",
         default="pinecone",
-        choices=["pinecone", "chroma"],
+        choices=["pinecone", "chroma", "local"],
         help="Vectorstore backend to use."
     )
 
     parser.add_argument(
         "-n", "--namespace",
-        required=True,
         choices=supported_games,
         help=("The namespace (game name) for document retrieval. "
               "See `config/supported_games.json` for supported "
-              "game/namespace names.")
+              "game/namespace names. Required unless --serve or --batch "
+              "is used, where it is the default for requests without one.")
+    )
+
+    parser.add_argument(
+        "--fetch_k",
+        type=int,
+        help=("Hits fetched per translated query before reciprocal rank "
+              "fusion (default: 4).")
+    )
+
+    parser.add_argument(
+        "--retrieval",
+        default="vector",
+        choices=["vector", "hybrid", "lexical"],
+        help=("Retrieval mode: vector search, vector search fused with "
+              "BM25, or BM25 alone when its top hit is confident "
+              "(falling back to hybrid).")
+    )
+
+    parser.add_argument(
+        "--lexical_threshold",
+        type=float,
+        default=0.8,
+        help=("Minimum normalized BM25 score of the top hit for "
+              "--retrieval lexical to skip the embedding call.")
+    )
+
+    parser.add_argument(
+        "--context_tokens",
+        type=int,
+        default=2000,
+        help=("Token budget of the retrieved context. Overlapping chunks "
+              "are merged and near-duplicates dropped before packing.")
+    )
+
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Print the answer token by token as it is generated."
+    )
+
+    parser.add_argument(
+        "--no_answer_cache",
+        action="store_true",
+        help="Always generate a fresh answer instead of reusing cached ones."
+    )
+
+    parser.add_argument(
+        "--cache_threshold",
+        type=float,
+        default=0.95,
+        help=("Minimum cosine similarity for a previously answered question "
+              "to be treated as a near-duplicate.")
+    )
+
+    parser.add_argument(
+        "--instrument",
+        metavar="PATH",
+        help=("Time each pipeline stage and attribute tokens/cost per model "
+              "and stage, writing p50/p95/p99 summaries to PATH (.json or "
+              ".csv) on exit.")
+    )
+
+    parser.add_argument(
+        "--tracking_queue",
+        default="drop",
+        choices=["drop", "block"],
+        help=("What to do with a run when the background MLflow logging "
+              "queue is full: drop it, or wait for room.")
+    )
+
+    parser.add_argument(
+        "--no_tracking",
+        action="store_true",
+        help="Do not log runs to MLflow (mlflow is then never imported)."
+    )
+
+    parser.add_argument(
+        "--no_tracing",
+        action="store_true",
+        help="Disable LangSmith tracing of the pipeline stages."
+    )
+
+    parser.add_argument(
+        "--serve",
+        choices=["stdio", "http"],
+        help=("Run as a long-lived query server answering JSON requests "
+              "over stdin/stdout lines or local HTTP (POST /ask).")
+    )
+
+    parser.add_argument(
+        "--batch",
+        metavar="INPUT_JSONL",
+        help=("Answer every {question, namespace, strategy} record in a "
+              "JSONL file instead of a single --question.")
+    )
+
+    parser.add_argument(
+        "--output",
+        default="answers.jsonl",
+        help="Output JSONL file for --batch results."
+    )
+
+    parser.add_argument(
+        "--max_open_namespaces",
+        type=int,
+        default=8,
+        help=("Vectorstores kept open at once in serve and batch modes; the "
+              "least recently used namespace is closed beyond this.")
+    )
+
+    parser.add_argument(
+        "--max_vectorstore_mb",
+        type=float,
+        help=("Also close the least recently used vectorstores once the "
+              "open ones exceed this estimated size (serve and batch "
+              "modes).")
+    )
+
+    parser.add_argument(
+        "--warm_namespaces",
+        nargs="+",
+        choices=supported_games,
+        metavar="NAMESPACE",
+        help="Open these namespaces' vectorstores before serving."
+    )
+
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="Host for --serve http."
+    )
+
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8000,
+        help="Port for --serve http."
+    )
+
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        default=8,
+        help=("Maximum number of questions answered at once in serve and "
+              "batch modes.")
     )
 
     return parser
@@ -182,22 +445,49 @@ def get_supported_games():
 
 
 if __name__ == "__main__":
-    config = load_config_from_file()
-
     # Load supported games from config
     supported_games = get_supported_games()
     # Create CLI parser with supported game abbreviations
     parser = create_parser(
         [game["abbr"] for _, game in supported_games.items()])
     args = parser.parse_args()
-
-    # Run the pipeline and print the answer
-    answer = run_pipeline(
-        question=args.question,
-        strategy=args.strategy,
-        use_pinecone=(args.target == "pinecone"),
-        namespace=args.namespace,
-        supported_games=supported_games,
-        openai_api_key=config.openai_api_key
-    )
-    print(answer)
+    # Checked before the config is read, so a usage error stays cheap
+    if not (args.serve or args.batch) and not (args.question
+                                                and args.namespace):
+        parser.error("--question and --namespace are required "
+                     "unless --serve or --batch is used")
+    config = load_config_from_file()
+    if args.instrument:
+        instrumentation.enable(args.instrument)
+    if args.no_tracing:
+        # Read when rag.tracing is first imported, and by LangChain's tracer
+        os.environ["LANGSMITH_TRACING"] = "false"
+        os.environ["LANGCHAIN_TRACING_V2"] = "false"
+
+    if args.serve:
+        serve(args, supported_games, config.openai_api_key)
+    elif args.batch:
+        batch(args, supported_games, config.openai_api_key)
+    else:
+        # Run the pipeline and print the answer
+        answer = run_pipeline(
+            question=args.question,
+            strategy=args.strategy,
+            use_pinecone=(args.target == "pinecone"),
+            namespace=args.namespace,
+            supported_games=supported_games,
+            openai_api_key=config.openai_api_key,
+            answer_cache=get_answer_cache(args),
+            target=args.target,
+            fetch_k=args.fetch_k,
+            retrieval=args.retrieval,
+            lexical_threshold=args.lexical_threshold,
+            stream=args.stream,
+            context_tokens=args.context_tokens,
+            tracker=get_tracker(args),
+            adaptive_fallback=args.adaptive_fallback,
+            adaptive_min_score=args.adaptive_min_score,
+            adaptive_min_spread=args.adaptive_min_spread
+        )
+        if not args.stream:
+            print(answer)
@@ -0,0 +1,467 @@
+"""
+bench.py - Offline benchmark of ingestion, indexing, retrieval and answering
+
+Runs the pipeline end to end with no API keys or network access: the
+embedding and chat models are the deterministic fakes of rag.fakes (with
+optional simulated latency), the vectorstore is the local backend in a
+temporary directory, and the corpus is a plain-text file split into
+pseudo-pages standing in for a rulebook (by default the repo's
+input.txt). Queries come from a JSONL file of titles and bodies (the
+backlog's requests.jsonl), or from lines of the corpus when it is missing.
+
+Reports cleaning and splitting throughput (of the pages, and of the
+corpus file streamed by iter_text_chunks), indexing docs/sec, retrieval,
+context construction and end-to-end latency percentiles, and peak memory.
+With a baseline (see --save_baseline), every metric that is worse than the
+baseline by more than --tolerance is reported and the script exits with
+status 1.
+
+Examples:
+    python scripts/bench.py --save_baseline
+    python scripts/bench.py
+    python scripts/bench.py --strategy multi_query --retrieval hybrid
+    python scripts/bench.py --llm_latency 0.3 --token_latency 0.01 --stream
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from typing import Callable, Dict, List
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from rag import query_construction
+from rag.embedding_cache import CachedEmbeddings, EmbeddingCache
+from rag.fakes import FakeChatModel, FakeEmbeddings
+from rag.indexing import local_store_path, with_chunk_ids
+from rag.ingestion import (
+    batched,
+    clean_text,
+    iter_chunks,
+    iter_text_chunks,
+)
+from rag.langchain_callback import ContextUsageCallback
+from rag.lexical import BM25Index, lexical_index_path
+from rag.local_store import LocalVectorStore
+from rag.ml_tracking import NullLogger
+from rag.pipeline import RAGPipeline
+from rag.query_construction import build_context
+from rag.query_translation import TranslationCache
+from rag.retrieval import retrieve_documents
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+NAMESPACE = "bench"
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules that importing the pipeline must not load; they are imported only
+#   when a run uses the matching backend, LLM client or tracking
+LAZY_MODULES = ("mlflow", "langchain_openai", "langchain_chroma",
+                "langchain_pinecone", "chromadb", "pinecone",
+                "langchain_community")
+DEFAULT_BASELINE = os.path.join("data", "bench", "baseline.json")
+# Settings that change what is measured; baselines only compare runs that
+#   agree on all of them
+CONFIG_KEYS = ("corpus", "lines_per_page", "repeat", "queries", "dim",
+               "embed_latency", "embed_latency_per_text", "llm_latency",
+               "token_latency", "strategy", "retrieval", "top_k",
+               "context_tokens", "stream", "concurrency", "tokenizer")
+
+
+def load_corpus(path: str, lines_per_page: int,
+                repeat: int) -> List[Document]:
+    """Groups the lines of a text file into pages, `repeat` times over."""
+    with open(path, encoding="utf-8") as f:
+        lines = f.read().split("\n")
+    pages = []
+    for copy in range(repeat):
+        source = os.path.basename(path) if repeat == 1 \
+            else f"{copy}/{os.path.basename(path)}"
+        for page, start in enumerate(range(0, len(lines), lines_per_page)):
+            text = "\n".join(lines[start:start + lines_per_page])
+            pages.append(Document(page_content=text,
+                                  metadata={"source": source,
+                                            "page": page}))
+    return pages
+
+
+def load_queries(path: str, limit: int, pages: List[Document]) -> List[str]:
+    queries = []
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                queries.append(request["title"])
+                # First sentence of the body, as a longer question
+                queries.append(request["body"].split(". ")[0][:300])
+    else:
+        print(f"No queries at '{path}'; sampling lines of the corpus.")
+        lines = [line.strip() for page in pages
+                 for line in page.page_content.split("\n")
+                 if len(line.split()) >= 6]
+        step = max(len(lines) // max(limit, 1), 1)
+        queries = lines[::step]
+    return queries[:limit]
+
+
+def word_encoding(model: str):
+    """Whitespace "encoding" for machines without the tiktoken files."""
+    class Words:
+        @staticmethod
+        def encode(text: str, disallowed_special=()) -> List[str]:
+            return text.split()
+    return Words()
+
+
+def select_tokenizer(name: str, model: str) -> str:
+    if name in ("auto", "tiktoken"):
+        try:
+            query_construction.get_encoding(model)
+            return "tiktoken"
+        except Exception as e:
+            if name == "tiktoken":
+                raise
+            print(f"tiktoken encoding unavailable ({type(e).__name__}); "
+                  f"counting whitespace tokens instead.")
+    # Token counts only size the context; the speed of counting differs
+    query_construction.get_encoding = word_encoding
+    return "words"
+
+
+def percentiles(samples: List[float], prefix: str) -> Dict[str, float]:
+    p50, p95, p99 = np.percentile(np.asarray(samples) * 1000, [50, 95, 99])
+    return {f"{prefix}_p50_ms": float(p50), f"{prefix}_p95_ms": float(p95),
+            f"{prefix}_p99_ms": float(p99)}
+
+
+def timed(fn: Callable, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def best_of(runs: int, fn: Callable, *args):
+    """Result and fastest time of `runs` calls, damping noise."""
+    times = []
+    for _ in range(runs):
+        result, elapsed = timed(fn, *args)
+        times.append(elapsed)
+    return result, min(times)
+
+
+def peak_rss_mb() -> float:
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def bench_startup(metrics: dict) -> List[str]:
+    """
+    Times a cold `main.py --help` and `import rag.pipeline` in fresh
+    interpreters (best of 3), returning the lazy modules that were loaded
+    eagerly.
+    """
+    def run(*command) -> str:
+        return subprocess.run([sys.executable, *command], cwd=ROOT,
+                              check=True, capture_output=True,
+                              text=True).stdout
+
+    help_s = best_of(3, run, "main.py", "--help")[1]
+    probe = ("import sys, time; start = time.perf_counter(); "
+             "import rag.pipeline; print(time.perf_counter() - start); "
+             f"print(','.join(m for m in {LAZY_MODULES!r} "
+             "if m in sys.modules))")
+    samples = [run("-c", probe).split("\n") for _ in range(3)]
+    metrics.update({"cli_help_ms": help_s * 1000,
+                    "import_pipeline_ms": min(float(s[0])
+                                              for s in samples) * 1000})
+    return [m for m in samples[0][1].split(",") if m]
+
+
+def bench_ingestion(pages: List[Document], corpus: str,
+                    metrics: dict) -> List[Document]:
+    size_mb = sum(len(page.page_content.encode("utf-8"))
+                  for page in pages) / 2**20
+    cleaned, clean_s = best_of(3, lambda: [
+        Document(page_content=clean_text(page.page_content),
+                 metadata=page.metadata) for page in pages])
+
+    # Same settings as index_pdfs
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000,
+                                              chunk_overlap=200,
+                                              add_start_index=True)
+    chunks, split_s = best_of(3, lambda: list(iter_chunks(cleaned,
+                                                          splitter)))
+    # Cleaning and splitting in one pass over the mapped file
+    _, stream_s = best_of(3, lambda: sum(
+        1 for _ in iter_text_chunks(corpus, splitter)))
+    metrics.update({"clean_mb_per_s": size_mb / clean_s,
+                    "split_chunks_per_s": len(chunks) / split_s,
+                    "stream_mb_per_s":
+                        os.path.getsize(corpus) / 2**20 / stream_s})
+    print(f"Corpus: {len(pages)} pages, {size_mb:.2f} MB, "
+          f"{len(chunks)} chunks")
+    return chunks
+
+
+def bench_indexing(chunks: List[Document], persist_dir: str, args,
+                   metrics: dict) -> LocalVectorStore:
+    embeddings = CachedEmbeddings(
+        FakeEmbeddings(args.dim, args.embed_latency,
+                       args.embed_latency_per_text),
+        EmbeddingCache(":memory:"))
+    store = LocalVectorStore(local_store_path(persist_dir, NAMESPACE),
+                             embeddings, autopersist=False)
+    lexical = BM25Index(lexical_index_path(persist_dir, NAMESPACE, "local"))
+    ids_by_source = {}
+    for chunk in chunks:
+        ids_by_source.setdefault(chunk.metadata["source"], []).append(chunk)
+    ids, docs = [], []
+    for source, source_chunks in ids_by_source.items():
+        for _id, chunk in with_chunk_ids(source_chunks, NAMESPACE, source):
+            ids.append(_id)
+            docs.append(chunk)
+
+    start = time.perf_counter()
+    for batch_ids, batch in zip(batched(ids, args.batch_size),
+                                batched(docs, args.batch_size)):
+        store.add_documents(batch, ids=batch_ids)
+    store.persist()
+    vector_s = time.perf_counter() - start
+    start = time.perf_counter()
+    lexical.add(ids, docs)
+    lexical.save()
+    lexical_s = time.perf_counter() - start
+    metrics.update({"index_docs_per_s": len(docs) / vector_s,
+                    "lexical_index_docs_per_s": len(docs) / lexical_s,
+                    "index_peak_rss_mb": peak_rss_mb()})
+    return store
+
+
+def bench_retrieval(store: LocalVectorStore, queries: List[str], args,
+                    metrics: dict):
+    retriever = store.as_retriever()
+    retrieve_s, context_s = [], []
+    for query in queries:
+        docs, elapsed = timed(retrieve_documents, retriever, [query],
+                              args.top_k)
+        retrieve_s.append(elapsed)
+        _, elapsed = timed(build_context, docs, args.context_tokens)
+        context_s.append(elapsed)
+    metrics.update(percentiles(retrieve_s, "retrieve"))
+    metrics.update(percentiles(context_s, "build_context"))
+
+
+def make_pipeline(store: LocalVectorStore, persist_dir: str,
+                  args) -> RAGPipeline:
+    llm = FakeChatModel(latency=args.llm_latency,
+                        token_latency=args.token_latency,
+                        callbacks=[ContextUsageCallback()])
+    return RAGPipeline(NAMESPACE, {}, openai_api_key="", target="local",
+                       strategy=args.strategy, persist_dir=persist_dir,
+                       top_k=args.top_k, retrieval=args.retrieval,
+                       context_tokens=args.context_tokens,
+                       tracker=NullLogger(), llm=llm, vectorstore=store,
+                       translation_cache=TranslationCache())
+
+
+def answer_once(pipeline: RAGPipeline, question: str, stream: bool) -> dict:
+    if not stream:
+        return pipeline.answer(question)
+    answer = pipeline.stream(question)
+    for _ in answer:
+        pass
+    return answer.result
+
+
+async def answer_concurrently(pipeline: RAGPipeline, queries: List[str],
+                              args) -> List[float]:
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def answer(question: str):
+        async with semaphore:
+            start = time.perf_counter()
+            if args.stream:
+                async for _ in pipeline.astream(question):
+                    pass
+            else:
+                await pipeline.aanswer(question)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(answer(question) for question in queries))
+    return latencies
+
+
+def bench_end_to_end(pipeline: RAGPipeline, queries: List[str], args,
+                     metrics: dict):
+    for question in queries[:args.warmup]:
+        answer_once(pipeline, question, args.stream)
+    start = time.perf_counter()
+    if args.concurrency > 1:
+        latencies = asyncio.run(answer_concurrently(pipeline, queries, args))
+    else:
+        latencies, first_tokens = [], []
+        for question in queries:
+            result, elapsed = timed(answer_once, pipeline, question,
+                                    args.stream)
+            latencies.append(elapsed)
+            if "time_to_first_token_s" in result["metrics"]:
+                first_tokens.append(result["metrics"]["time_to_first_token_s"])
+        if first_tokens:
+            metrics.update(percentiles(first_tokens, "first_token"))
+    metrics["end_to_end_qps"] = len(queries) / (time.perf_counter() - start)
+    metrics.update(percentiles(latencies, "end_to_end"))
+    metrics["peak_rss_mb"] = peak_rss_mb()
+
+
+def higher_is_better(name: str) -> bool:
+    return name.endswith("_per_s") or name.endswith("_qps")
+
+
+def compare(results: dict, baseline: dict, tolerance: float,
+            min_delta_ms: float) -> List[str]:
+    """Metrics worse than the baseline by more than `tolerance`."""
+    regressions = []
+    for name, value in results["metrics"].items():
+        base = baseline["metrics"].get(name)
+        if not base:
+            continue
+        if higher_is_better(name):
+            worse = value < base * (1 - tolerance)
+        else:
+            worse = value > base * (1 + tolerance)
+            # Ignore jitter in sub-millisecond latencies
+            if name.endswith("_ms") and value - base < min_delta_ms:
+                worse = False
+        if worse:
+            regressions.append(f"{name}: {value:.3f} vs. baseline "
+                               f"{base:.3f} ({value / base - 1:+.0%})")
+    return regressions
+
+
+def print_report(results: dict, baseline: dict = None):
+    print(f"\n{'metric':<28}{'value':>12}{'baseline':>12}{'change':>9}")
+    for name, value in results["metrics"].items():
+        base = (baseline or {}).get("metrics", {}).get(name)
+        change = f"{value / base - 1:+.0%}" if base else ""
+        base = f"{base:.3f}" if base is not None else "-"
+        print(f"{name:<28}{value:>12.3f}{base:>12}{change:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline offline with fake models.")
+    parser.add_argument("--corpus", default="input.txt",
+                        help="Plain-text corpus split into pseudo-pages")
+    parser.add_argument("--lines_per_page", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Index this many copies of the corpus")
+    parser.add_argument("--queries", default="requests.jsonl",
+                        help="JSONL file of {title, body} queries")
+    parser.add_argument("--num_queries", type=int, default=48)
+    parser.add_argument("--warmup", type=int, default=2,
+                        help="Untimed questions answered first")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--batch_size", type=int, default=200)
+    parser.add_argument("--embed_latency", type=float, default=0.0,
+                        help="Simulated seconds per embedding call")
+    parser.add_argument("--embed_latency_per_text", type=float, default=0.0)
+    parser.add_argument("--llm_latency", type=float, default=0.0,
+                        help="Simulated seconds to the first LLM token")
+    parser.add_argument("--token_latency", type=float, default=0.0,
+                        help="Simulated seconds per further LLM token")
+    parser.add_argument("--strategy", default="passthrough",
+                        choices=["passthrough", "multi_query", "rag_fusion",
+                                 "decompose", "step_back", "hyde",
+                                 "adaptive"])
+    parser.add_argument("--retrieval", default="vector",
+                        choices=["vector", "hybrid", "lexical"])
+    parser.add_argument("--top_k", type=int, default=4)
+    parser.add_argument("--context_tokens", type=int, default=2000)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="Questions answered concurrently (async path)")
+    parser.add_argument("--tokenizer", default="auto",
+                        choices=["auto", "tiktoken", "words"],
+                        help="Token counter for context packing")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save_baseline", action="store_true",
+                        help="Store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.3,
+                        help="Allowed relative regression per metric")
+    parser.add_argument("--min_delta_ms", type=float, default=2.0,
+                        help="Latency increases below this never count")
+    parser.add_argument("--output", help="Also write the results here")
+    args = parser.parse_args()
+    args.tokenizer = select_tokenizer(args.tokenizer, "gpt-4o-mini")
+
+    metrics = {}
+    eager = bench_startup(metrics)
+    pages = load_corpus(args.corpus, args.lines_per_page, args.repeat)
+    queries = load_queries(args.queries, args.num_queries, pages)
+    chunks = bench_ingestion(pages, args.corpus, metrics)
+    with tempfile.TemporaryDirectory() as persist_dir:
+        store = bench_indexing(chunks, persist_dir, args, metrics)
+        bench_retrieval(store, queries, args, metrics)
+        pipeline = make_pipeline(store, persist_dir, args)
+        bench_end_to_end(pipeline, queries, args, metrics)
+        del pipeline, store
+
+    results = {"config": {key: getattr(args, key) for key in CONFIG_KEYS},
+               "metrics": metrics}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    baseline = None
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    # Eagerly imported backends are a regression whatever the baseline
+    regressions = [f"import rag.pipeline loads {module}"
+                   for module in eager]
+    if args.save_baseline:
+        print(f"\nSaved baseline to '{args.baseline}'.")
+    elif baseline is None:
+        print(f"\nNo baseline at '{args.baseline}'; store one with "
+              f"--save_baseline.")
+    else:
+        mismatched = [key for key in CONFIG_KEYS if
+                      baseline["config"].get(key) != results["config"][key]]
+        if mismatched:
+            print(f"\nBaseline was run with different settings "
+                  f"({', '.join(mismatched)}); not comparing.")
+            sys.exit(2)
+        regressions += compare(results, baseline, args.tolerance,
+                               args.min_delta_ms)
+    if regressions:
+        print(f"\n{len(regressions)} REGRESSIONS beyond "
+              f"{args.tolerance:.0%}:")
+        for regression in regressions:
+            print(f"\t{regression}")
+        sys.exit(1)
+    if baseline is not None:
+        print(f"\nNo regressions beyond {args.tolerance:.0%}.")
+
+
+if __name__ == "__main__":
+    main()
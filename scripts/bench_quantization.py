@@ -0,0 +1,131 @@
+"""
+bench_quantization.py - Memory vs. recall trade-off of quantized vectors
+
+Compares float16 and int8 vector storage of the local backend against the
+full-precision index, reporting the size of the searched vectors, the
+total size of the store on disk and recall@k with and without
+full-precision rescoring. Quantized stores keep the float32 vectors for
+rescoring, so they save memory searched but take more disk, not less.
+
+Examples:
+    python scripts/bench_quantization.py --game dnd
+    python scripts/bench_quantization.py --synthetic 20000 --dim 1536
+"""
+import os
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+from rag.indexing import local_store_path
+from rag.local_store import LocalVectorStore
+
+
+def load_vectors(args) -> np.ndarray:
+    if args.synthetic:
+        rng = np.random.default_rng(args.seed)
+        return rng.standard_normal((args.synthetic, args.dim),
+                                   dtype=np.float32)
+    path = os.path.join(local_store_path(args.persist_dir, args.game),
+                        "vectors.npy")
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"No local index at '{path}'. Index the game with "
+            f"--target local first, or use --synthetic.")
+    return np.load(path, mmap_mode="r")
+
+
+def make_queries(vectors: np.ndarray, count: int, noise: float,
+                 seed: int) -> np.ndarray:
+    """Perturbed copies of stored vectors, standing in for paraphrases."""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(vectors), size=min(count, len(vectors)),
+                      replace=False)
+    queries = np.asarray(vectors[np.sort(rows)], dtype=np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return queries + rng.normal(0, noise, queries.shape).astype(np.float32)
+
+
+def disk_bytes(path: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(path)
+               if entry.is_file())
+
+
+def recall(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark quantized vector storage of the local "
+                    "backend against full precision.")
+    parser.add_argument("--game", help="Namespace indexed with "
+                                       "--target local")
+    parser.add_argument("--persist_dir", default=os.path.join(
+        "data", "vectorstore"))
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="Use this many random vectors instead")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.02,
+                        help="Std-dev of the noise added to queries")
+    parser.add_argument("-k", type=int, default=4)
+    parser.add_argument("--rescore_factor", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if not args.game and not args.synthetic:
+        parser.error("one of --game or --synthetic is required")
+
+    vectors = load_vectors(args)
+    queries = make_queries(vectors, args.queries, args.noise, args.seed)
+    print(f"{len(vectors)} vectors x {vectors.shape[1]} dims, "
+          f"{len(queries)} queries, k={args.k}\n")
+    print(f"{'storage':<10}{'searched MB':>13}{'saved':>8}"
+          f"{'disk MB':>10}{'vs f32':>8}"
+          f"{'recall@k':>10}{'rescored':>10}{'ms/query':>10}")
+
+    truth = None
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for quantization in ("none", "float16", "int8"):
+            store = LocalVectorStore(os.path.join(tmp_dir, quantization),
+                                     embedding_function=None,
+                                     autopersist=False,
+                                     quantization=quantization,
+                                     rescore_factor=args.rescore_factor)
+            for start in range(0, len(vectors), 4096):
+                block = np.asarray(vectors[start:start + 4096])
+                store.add_vectors(block, [""] * len(block),
+                                  ids=[str(i) for i in
+                                       range(start, start + len(block))])
+            store.persist()
+
+            searched = store.compact if store.compact is not None \
+                else store.vectors
+            disk = disk_bytes(store.persist_directory)
+            if truth is None:
+                full_bytes, full_disk = searched.nbytes, disk
+            start = time.perf_counter()
+            rescored, _ = store.search_vectors(queries, args.k)
+            elapsed = time.perf_counter() - start
+            approx, _ = store.search_vectors(queries, args.k, rescore=False)
+            if truth is None:
+                truth = rescored
+            extra = store.scales.nbytes if store.scales is not None else 0
+            size = searched.nbytes + extra
+            print(f"{quantization:<10}{size / 2**20:>13.2f}"
+                  f"{1 - size / full_bytes:>8.0%}"
+                  f"{disk / 2**20:>10.2f}{disk / full_disk:>8.0%}"
+                  f"{recall(approx, truth):>10.3f}"
+                  f"{recall(rescored, truth):>10.3f}"
+                  f"{elapsed * 1000 / len(queries):>10.3f}")
+            del store
+
+    print("\nQuantized stores search the compact copy but keep the float32 "
+          "vectors\nfor rescoring, so on disk they grow instead of "
+          "shrinking.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+bench_rate_limit.py - Bulk indexing and interactive queries under rate limits
+
+Runs bulk embedding batches and a stream of interactive queries (a query
+embedding plus a chat call) concurrently against the offline fakes, which
+enforce requests/min and tokens/min limits like the OpenAI endpoints. Each
+mode is compared on the requests sent, the 429s it ran into, the time the
+bulk work took and the latency of the interactive queries:
+
+- independent: every caller retries on its own, as the OpenAI clients do
+- scheduled: every call goes through one RateLimitScheduler per model
+
+A "minute" lasts `--period` seconds so that a run takes seconds.
+
+Examples:
+    python scripts/bench_rate_limit.py
+    python scripts/bench_rate_limit.py --bulk_workers 8 --queries 100
+"""
+import time
+import argparse
+import threading
+
+import numpy as np
+
+from rag.fakes import FakeChatModel, FakeEmbeddings, FakeRateLimits
+from rag.rate_limit import (
+    BULK,
+    INTERACTIVE,
+    RateLimitedChatModel,
+    RateLimitedEmbeddings,
+    RateLimitScheduler,
+)
+
+
+def make_models(args, scheduled: bool):
+    """
+    Returns factories of the bulk embeddings and the interactive
+    (embeddings, chat model) used by each caller, and the fake limits.
+    Scheduled callers share one wrapper per use, as the indexer and the
+    server's pipelines do, so their small batches can be coalesced.
+    """
+    embedding_limits = FakeRateLimits(args.embedding_rpm, args.embedding_tpm,
+                                      period=args.period)
+    chat_limits = FakeRateLimits(args.chat_rpm, args.chat_tpm,
+                                 period=args.period)
+    embeddings = FakeEmbeddings(latency=args.latency, limits=embedding_limits)
+    llm = FakeChatModel(latency=args.latency, answer_words=40,
+                        limits=chat_limits)
+
+    if not scheduled:
+        # Without shared budgets, a scheduler only retries
+        def bulk():
+            return RateLimitedEmbeddings(
+                embeddings, RateLimitScheduler(backoff=args.backoff),
+                priority=BULK, coalesce_ms=0)
+
+        def interactive():
+            return (RateLimitedEmbeddings(
+                        embeddings, RateLimitScheduler(backoff=args.backoff),
+                        coalesce_ms=0),
+                    RateLimitedChatModel(llm=llm, scheduler=RateLimitScheduler(
+                        backoff=args.backoff)))
+
+        return bulk, interactive, (embedding_limits, chat_limits)
+
+    scheduler = RateLimitScheduler(requests_per_min=args.embedding_rpm,
+                                   tokens_per_min=args.embedding_tpm,
+                                   period=args.period, backoff=args.backoff)
+    shared_bulk = RateLimitedEmbeddings(embeddings, scheduler, priority=BULK)
+    shared_interactive = (
+        RateLimitedEmbeddings(embeddings, scheduler, priority=INTERACTIVE),
+        RateLimitedChatModel(llm=llm, scheduler=RateLimitScheduler(
+            requests_per_min=args.chat_rpm, tokens_per_min=args.chat_tpm,
+            period=args.period, backoff=args.backoff)))
+    return (lambda: shared_bulk, lambda: shared_interactive,
+            (embedding_limits, chat_limits))
+
+
+def run(args, scheduled: bool) -> dict:
+    bulk, interactive, limits = make_models(args, scheduled)
+    latencies = []
+    errors = []
+    bulk_done = []
+    start = time.perf_counter()
+
+    def bulk_worker(worker: int):
+        embeddings = bulk()
+        try:
+            for batch in range(args.bulk_batches):
+                embeddings.embed_documents([
+                    f"chunk {worker} {batch} {i} of a rulebook page about "
+                    f"movement, actions and turn order"
+                    for i in range(args.batch_size)])
+        except Exception as e:
+            errors.append(e)
+        bulk_done.append(time.perf_counter() - start)
+
+    def query(i: int):
+        embeddings, llm = interactive()
+        began = time.perf_counter()
+        try:
+            embeddings.embed_query(f"question {i} about grappling rules")
+            llm.invoke(f"Question {i}: how does grappling work?")
+        except Exception as e:
+            errors.append(e)
+            return
+        latencies.append(time.perf_counter() - began)
+
+    threads = [threading.Thread(target=bulk_worker, args=(worker,))
+               for worker in range(args.bulk_workers)]
+    for thread in threads:
+        thread.start()
+    for i in range(args.queries):
+        time.sleep(args.query_interval)
+        thread = threading.Thread(target=query, args=(i,))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    p50, p95 = (np.percentile(latencies, [50, 95]) if latencies
+                else (float("nan"), float("nan")))
+    return {"requests": sum(limit.accepted for limit in limits),
+            "429s": sum(limit.rejected for limit in limits),
+            "errors": len(errors),
+            "bulk_s": max(bulk_done),
+            "total_s": time.perf_counter() - start,
+            "query_p50_ms": p50 * 1000,
+            "query_p95_ms": p95 * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark concurrent bulk and interactive model calls "
+                    "against rate-limited fake endpoints.")
+    parser.add_argument("--period", type=float, default=1.0,
+                        help="Seconds standing in for a minute")
+    parser.add_argument("--embedding_rpm", type=int, default=20)
+    parser.add_argument("--embedding_tpm", type=int, default=100_000)
+    parser.add_argument("--chat_rpm", type=int, default=20)
+    parser.add_argument("--chat_tpm", type=int, default=4_000)
+    parser.add_argument("--bulk_workers", type=int, default=4)
+    parser.add_argument("--bulk_batches", type=int, default=10)
+    parser.add_argument("--batch_size", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("--query_interval", type=float, default=0.1,
+                        help="Seconds between interactive queries")
+    parser.add_argument("--latency", type=float, default=0.01,
+                        help="Simulated latency of each model call")
+    parser.add_argument("--backoff", type=float, default=0.05,
+                        help="Base retry backoff in seconds")
+    args = parser.parse_args()
+
+    print(f"{'mode':<13}{'requests':>10}{'429s':>6}{'errors':>8}"
+          f"{'bulk s':>8}{'total s':>9}{'query p50 ms':>14}{'p95 ms':>8}")
+    for mode in ("independent", "scheduled"):
+        result = run(args, scheduled=mode == "scheduled")
+        print(f"{mode:<13}{result['requests']:>10}{result['429s']:>6}"
+              f"{result['errors']:>8}{result['bulk_s']:>8.2f}"
+              f"{result['total_s']:>9.2f}"
+              f"{result['query_p50_ms']:>14.0f}"
+              f"{result['query_p95_ms']:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+snapshot.py - Export a game's index to a snapshot file, or import one
+
+Moves a namespace between backends, or restores it, without re-parsing the
+PDFs or re-embedding anything (see rag/snapshot.py for the file format).
+
+Examples:
+    python scripts/snapshot.py export --game dnd --target chroma
+    python scripts/snapshot.py import --game dnd --target pinecone \
+        --input data/snapshots/dnd.snapshot
+"""
+import argparse
+import os
+from rag.snapshot import export_namespace, import_namespace
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export or import a snapshot of a game's index.")
+    parser.add_argument(
+        "command", choices=["export", "import"],
+        help="Write the index to a snapshot, or load one into the index")
+    parser.add_argument(
+        "--game",
+        help=("Namespace to export, or to import into (default for import: "
+              "the snapshot's)"))
+    parser.add_argument(
+        "--target", choices=["pinecone", "chroma", "local"],
+        default="pinecone",
+        help="Vectorstore to export from or import into")
+    parser.add_argument(
+        "--input",
+        help="Snapshot to import")
+    parser.add_argument(
+        "--output",
+        help="Snapshot to write (default: data/snapshots/{game}.snapshot)")
+    parser.add_argument(
+        "--batch_size", type=int,
+        help=("Chunks per backend request (default: 4096 local, 1000 "
+              "Chroma, 100 Pinecone)"))
+    parser.add_argument(
+        "--concurrency", type=int, default=4,
+        help="Pinecone upserts kept in flight (default: 4)")
+
+    args = parser.parse_args()
+    if args.command == "export" and not args.game:
+        parser.error("export requires --game")
+    if args.command == "import" and not args.input:
+        parser.error("import requires --input")
+
+    index = None
+    if args.target == "pinecone":
+        from config.config import load_config_from_file
+        from rag.upload import open_pinecone_index
+
+        # Load API keys and settings from config/keys.json
+        config = load_config_from_file()
+        index = open_pinecone_index(config.pinecone_index_name,
+                                    config.pinecone_api_key)
+    persist_path = os.path.join("data", "vectorstore")
+
+    if args.command == "export":
+        export_namespace(
+            args.output or os.path.join("data", "snapshots",
+                                        f"{args.game}.snapshot"),
+            namespace=args.game,
+            target=args.target,
+            persist_dir=persist_path,
+            index=index,
+            batch_size=args.batch_size,
+        )
+    else:
+        import_namespace(
+            args.input,
+            target=args.target,
+            namespace=args.game,
+            persist_dir=persist_path,
+            index=index,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+        )
+
+
+if __name__ == "__main__":
+    main()
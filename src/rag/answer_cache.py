@@ -0,0 +1,202 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+DEFAULT_ANSWER_CACHE_PATH = os.path.join("data", "cache", "answers.sqlite")
+
+# (namespace, strategy, index version)
+CacheKey = Tuple[str, str, str]
+
+
+def normalize_question(question: str) -> str:
+    """Lowercases and strips punctuation and repeated whitespace."""
+    question = re.sub(r"[^\w\s]", " ", question.lower())
+    return " ".join(question.split())
+
+
+class AnswerCache:
+    """
+    Cache of generated answers keyed by namespace, strategy and index
+    version.
+
+    A lookup first tries an exact match on the normalized question, then a
+    nearest-neighbour search over the embeddings of previously answered
+    questions, accepting the best match at or above `threshold` cosine
+    similarity. Entries expire after `ttl` seconds, the least recently used
+    ones are evicted past `max_entries` (down to `evict_to` of it), and
+    entries from an older index version are dropped as soon as a newer
+    version is looked up. Like EmbeddingCache, the table is only counted
+    when an upper bound on its size, kept from the rows written, passes
+    `max_entries`.
+
+    Each lookup counts once: `get_exact` records a miss, which a match from
+    the `get_similar` call that follows it turns into a semantic hit.
+    """
+
+    def __init__(self, path: str = DEFAULT_ANSWER_CACHE_PATH,
+                 threshold: float = 0.95, ttl: float = 7 * 24 * 3600,
+                 max_entries: int = 10_000, evict_to: float = 0.9):
+        self.path = path
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evict_to = evict_to
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> (row ids, unit-normalized embedding matrix)
+        self._vectors = {}
+        # namespace -> (index version, time) of the last purge
+        self._purged = {}
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "id INTEGER PRIMARY KEY, namespace TEXT NOT NULL, "
+            "strategy TEXT NOT NULL, index_version TEXT NOT NULL, "
+            "normalized TEXT NOT NULL, embedding BLOB, answer TEXT NOT NULL, "
+            "created REAL NOT NULL, last_used REAL NOT NULL)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS answers_key ON answers("
+            "namespace, strategy, index_version, normalized)")
+        self._conn.commit()
+        self._size_bound = self._count()
+
+    def _count(self) -> int:
+        (count,) = self._conn.execute(
+            "SELECT COUNT(*) FROM answers").fetchone()
+        return count
+
+    def _invalidate(self, key: CacheKey):
+        """
+        Drops expired entries and entries from other index versions. Runs
+            when a namespace's index version changes, and otherwise once
+            per `ttl`; lookups skip entries that expire in between.
+        """
+        namespace, strategy, version = key
+        now = time.time()
+        purged = self._purged.get(namespace)
+        if purged and purged[0] == version and now - purged[1] < self.ttl:
+            return
+        self._purged[namespace] = (version, now)
+        deleted = self._conn.execute(
+            "DELETE FROM answers WHERE namespace = ? AND "
+            "(index_version != ? OR created < ?)",
+            (namespace, version, now - self.ttl)).rowcount
+        if deleted:
+            self._size_bound -= deleted
+            self._conn.commit()
+            for cached_key in list(self._vectors):
+                if cached_key[0] == namespace:
+                    del self._vectors[cached_key]
+
+    def _matrix(self, key: CacheKey):
+        if key not in self._vectors:
+            rows = self._conn.execute(
+                "SELECT id, embedding FROM answers WHERE namespace = ? AND "
+                "strategy = ? AND index_version = ? AND embedding IS NOT NULL",
+                key).fetchall()
+            ids = [row[0] for row in rows]
+            matrix = (np.vstack([np.frombuffer(row[1], dtype=np.float32)
+                                 for row in rows])
+                      if rows else np.empty((0, 0), dtype=np.float32))
+            self._vectors[key] = (ids, matrix)
+        return self._vectors[key]
+
+    def _touch(self, row_id: int, answer: str) -> str:
+        self._conn.execute("UPDATE answers SET last_used = ? WHERE id = ?",
+                           (time.time(), row_id))
+        self._conn.commit()
+        return answer
+
+    def get_exact(self, key: CacheKey, question: str) -> Optional[str]:
+        with self._lock:
+            self._invalidate(key)
+            row = self._conn.execute(
+                "SELECT id, answer FROM answers WHERE namespace = ? AND "
+                "strategy = ? AND index_version = ? AND normalized = ? "
+                "AND created >= ?",
+                (*key, normalize_question(question),
+                 time.time() - self.ttl)).fetchone()
+            if row:
+                self.hits += 1
+                return self._touch(*row)
+            self.misses += 1
+        return None
+
+    def get_similar(self, key: CacheKey,
+                    embedding: List[float]) -> Tuple[Optional[str], float]:
+        """
+        Returns the answer of the most similar cached question and its
+        similarity, or (None, best similarity) below the threshold. Called
+        after a `get_exact` miss.
+        """
+        with self._lock:
+            ids, matrix = self._matrix(key)
+            if not ids:
+                return None, 0.0
+            query = np.asarray(embedding, dtype=np.float32)
+            scores = matrix @ (query / (np.linalg.norm(query) or 1.0))
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+            if similarity < self.threshold:
+                return None, similarity
+            row = self._conn.execute(
+                "SELECT id, answer FROM answers WHERE id = ? AND created >= ?",
+                (ids[best], time.time() - self.ttl)).fetchone()
+            if not row:
+                return None, similarity
+            self.misses -= 1
+            self.hits += 1
+            self.semantic_hits += 1
+            return self._touch(*row), similarity
+
+    def put(self, key: CacheKey, question: str,
+            embedding: Optional[List[float]], answer: str):
+        now = time.time()
+        vector = None
+        if embedding is not None:
+            vector = np.asarray(embedding, dtype=np.float32)
+            vector = vector / (np.linalg.norm(vector) or 1.0)
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO answers (namespace, strategy, index_version, "
+                "normalized, embedding, answer, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (*key, normalize_question(question),
+                 vector.tobytes() if vector is not None else None,
+                 answer, now, now))
+            if vector is not None and key in self._vectors:
+                ids, matrix = self._vectors[key]
+                matrix = (np.vstack([matrix, vector]) if ids
+                          else vector[np.newaxis, :])
+                self._vectors[key] = (ids + [cursor.lastrowid], matrix)
+            self._size_bound += 1
+            if self._size_bound > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count = self._count()
+        if count > self.max_entries:
+            excess = count - int(self.max_entries * self.evict_to)
+            self._conn.execute(
+                "DELETE FROM answers WHERE id IN (SELECT id FROM answers "
+                "ORDER BY last_used ASC LIMIT ?)", (excess,))
+            count -= excess
+            # Evicted rows may back cached matrices; rebuild them lazily
+            self._vectors.clear()
+        self._size_bound = count
+
+    def stats(self) -> dict:
+        return {"answer_cache_hits": self.hits,
+                "answer_cache_semantic_hits": self.semantic_hits,
+                "answer_cache_misses": self.misses}
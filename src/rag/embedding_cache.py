@@ -0,0 +1,207 @@
+import os
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from array import array
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from rag import instrumentation
+from rag.instrumentation import compute_cost, record_usage, stage
+from rag.rate_limit import estimate_tokens
+
+
+DEFAULT_CACHE_PATH = os.path.join("data", "cache", "embeddings.sqlite")
+
+
+def _cache_key(model: str, text: str) -> str:
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return f"{model}|{digest}"
+
+
+class EmbeddingCache:
+    """
+    On-disk embedding store keyed by (embedding model, text hash).
+
+    Vectors are kept as float32 blobs in SQLite. Every lookup refreshes an
+    entry's access time, and once the cache holds more than `max_entries`
+    vectors the least recently used ones are evicted, down to
+    `evict_to` of `max_entries` so the next eviction is some way off. The
+    table is only counted when an upper bound on its size, kept from the
+    rows written, passes `max_entries`.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH,
+                 max_entries: int = 500_000, evict_to: float = 0.9):
+        self.path = path
+        self.max_entries = max_entries
+        self.evict_to = evict_to
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, "
+            "last_used REAL NOT NULL)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used "
+            "ON embeddings(last_used)")
+        self._conn.commit()
+        # Rows written since the last count are added, including ones that
+        #   replaced an existing key, so this never undercounts
+        self._size_bound = self._count()
+
+    def _count(self) -> int:
+        (count,) = self._conn.execute(
+            "SELECT COUNT(*) FROM embeddings").fetchone()
+        return count
+
+    def get_many(self, model: str,
+                 texts: List[str]) -> List[Optional[List[float]]]:
+        keys = [_cache_key(model, text) for text in texts]
+        found = {}
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for i in range(0, len(keys), 500):
+                part = list(set(keys[i:i+500]))
+                rows = self._conn.execute(
+                    "SELECT key, vector FROM embeddings WHERE key IN "
+                    f"({','.join('?' * len(part))})", part).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found])
+                self._conn.commit()
+
+        vectors = []
+        for key in keys:
+            blob = found.get(key)
+            vectors.append(array("f", blob).tolist() if blob else None)
+        return vectors
+
+    def put_many(self, model: str, texts: List[str],
+                 vectors: List[List[float]]):
+        now = time.time()
+        rows = [(_cache_key(model, text), array("f", vector).tobytes(), now)
+                for text, vector in zip(texts, vectors)]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) "
+                "VALUES (?, ?, ?)", rows)
+            self._size_bound += len(rows)
+            if self._size_bound > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count = self._count()
+        if count > self.max_entries:
+            excess = count - int(self.max_entries * self.evict_to)
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM "
+                "embeddings ORDER BY last_used ASC LIMIT ?)", (excess,))
+            count -= excess
+        self._size_bound = count
+
+    def __len__(self):
+        with self._lock:
+            return self._count()
+
+    def close(self):
+        self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that serves repeated texts from an EmbeddingCache and
+    only sends cache misses to the underlying model. Used for both document
+    and query embeddings; the async methods run the SQLite lookups and
+    writes in a worker thread. Hits and misses count texts, including
+    repeats within a request. With instrumentation on, the estimated tokens and
+    cost of every miss are attributed to the stage that requested it.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache,
+                 model: Optional[str] = None):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model or getattr(embeddings, "model",
+                                      type(embeddings).__name__)
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def _split(self, texts: List[str]):
+        vectors = self.cache.get_many(self.model, texts)
+        missing = {}
+        for i, (text, vector) in enumerate(zip(texts, vectors)):
+            if vector is None:
+                missing.setdefault(text, []).append(i)
+        misses = sum(len(v) for v in missing.values())
+        with self._stats_lock:
+            self.hits += len(texts) - misses
+            self.misses += misses
+        return vectors, missing
+
+    def _record_usage(self, texts: List[str]):
+        if instrumentation.current() is None:
+            return
+        tokens = estimate_tokens(texts, self.model)
+        record_usage(self.model, tokens, 0,
+                     compute_cost(self.model, tokens, 0))
+
+    def _merge(self, vectors, missing, computed):
+        texts = list(missing)
+        self._record_usage(texts)
+        self.cache.put_many(self.model, texts, computed)
+        for text, vector in zip(texts, computed):
+            for i in missing[text]:
+                vectors[i] = vector
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors, missing = self._split(texts)
+        if missing:
+            with stage("embed"):
+                computed = self.embeddings.embed_documents(list(missing))
+            vectors = self._merge(vectors, missing, computed)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        vectors, missing = self._split([text])
+        if missing:
+            with stage("embed"):
+                computed = [self.embeddings.embed_query(text)]
+            vectors = self._merge(vectors, missing, computed)
+        return vectors[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors, missing = await asyncio.to_thread(self._split, texts)
+        if missing:
+            with stage("embed"):
+                computed = await self.embeddings.aembed_documents(
+                    list(missing))
+            vectors = await asyncio.to_thread(self._merge, vectors, missing,
+                                              computed)
+        return vectors
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vectors, missing = await asyncio.to_thread(self._split, [text])
+        if missing:
+            with stage("embed"):
+                computed = [await self.embeddings.aembed_query(text)]
+            vectors = await asyncio.to_thread(self._merge, vectors, missing,
+                                              computed)
+        return vectors[0]
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {"embedding_cache_hits": self.hits,
+                    "embedding_cache_misses": self.misses}
@@ -0,0 +1,242 @@
+"""
+fakes.py - Deterministic offline stand-ins for the OpenAI models
+
+FakeEmbeddings hashes word tokens into a fixed-size bag-of-words vector, so
+texts sharing words are near each other and retrieval behaves sensibly.
+FakeChatModel answers with words taken from its prompt and follows the
+"N ..., line by line" instruction of the line-based query translation
+prompts. Both can sleep to simulate API latency, and neither needs a key
+or network access, so benchmarks and smoke runs work anywhere. Given a
+FakeRateLimits, they also reject calls over its requests/min or tokens/min
+with a 429 error, like the OpenAI endpoints.
+"""
+import re
+import time
+import zlib
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import (
+    ChatGeneration,
+    ChatGenerationChunk,
+    ChatResult,
+)
+
+from rag.lexical import tokenize
+
+
+LINES_RE = re.compile(r"(\d+) [\w-]+, line by line")
+WORD_RE = re.compile(r"\S+")
+
+
+def count_tokens(texts: List[str]) -> int:
+    return sum(len(WORD_RE.findall(text)) for text in texts)
+
+
+class FakeRateLimitError(Exception):
+    """A 429 response, with the seconds to wait before retrying."""
+
+    status_code = 429
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class FakeRateLimits:
+    """
+    Requests and (whitespace) tokens allowed per `period` seconds. As with
+    the OpenAI limits, each budget is replenished continuously rather than
+    reset every period; a call that would overdraw either one is rejected
+    with a FakeRateLimitError and not counted. Can be shared by several
+    fakes, as an API key's limits are.
+    """
+
+    def __init__(self, requests_per_min: Optional[int] = None,
+                 tokens_per_min: Optional[int] = None,
+                 period: float = 60.0):
+        self.limits = {"requests": requests_per_min,
+                       "tokens": tokens_per_min}
+        self.period = period
+        self.accepted = 0
+        self.rejected = 0
+        self._left = {name: limit for name, limit in self.limits.items()
+                      if limit is not None}
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def check(self, tokens: int):
+        with self._lock:
+            now = time.monotonic()
+            elapsed, self._updated = now - self._updated, now
+            for name in self._left:
+                limit = self.limits[name]
+                self._left[name] = min(
+                    limit, self._left[name] + elapsed * limit / self.period)
+            cost = {"requests": 1, "tokens": tokens}
+            for name, left in self._left.items():
+                if cost[name] > left:
+                    self.rejected += 1
+                    raise FakeRateLimitError(
+                        f"Rate limit reached for {name}",
+                        (cost[name] - left) * self.period / self.limits[name])
+            for name in self._left:
+                self._left[name] -= cost[name]
+            self.accepted += 1
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Hashed bag-of-words embeddings of `dim` dimensions. Every call sleeps
+    `latency` seconds plus `latency_per_text` per embedded text, and counts
+    against `limits` if given.
+    """
+
+    def __init__(self, dim: int = 256, latency: float = 0.0,
+                 latency_per_text: float = 0.0,
+                 limits: Optional[FakeRateLimits] = None):
+        self.dim = dim
+        self.latency = latency
+        self.latency_per_text = latency_per_text
+        self.limits = limits
+        self.model = f"fake-embedding-{dim}"
+        self.calls = 0
+
+    def _delay(self, texts: List[str]) -> float:
+        if self.limits is not None:
+            self.limits.check(count_tokens(texts))
+        self.calls += 1
+        return self.latency + self.latency_per_text * len(texts)
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in tokenize(text):
+            # crc32 rather than hash(), which is salted per process
+            h = zlib.crc32(token.encode("utf-8"))
+            vector[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self._delay(texts))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self._delay([text]))
+        return self._embed(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self._delay(texts))
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        await asyncio.sleep(self._delay([text]))
+        return self._embed(text)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model answering with `answer_words` words of its prompt. The first
+    token arrives after `latency` seconds and each further one after
+    `token_latency` seconds; usage is reported as whitespace token counts
+    and, with `limits`, counted against them when the call is made.
+    """
+
+    latency: float = 0.0
+    token_latency: float = 0.0
+    answer_words: int = 60
+    model_name: str = "fake-chat"
+    limits: Optional[Any] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _respond(self, messages: List[BaseMessage]) -> List[str]:
+        prompt = messages[-1].content if messages else ""
+        words = WORD_RE.findall(prompt) or ["..."]
+        lines = LINES_RE.search(prompt)
+        if lines:
+            # One rotation of the question per requested line
+            question = words[:24]
+            text = "\n".join(
+                " ".join(question[i:] + question[:i])
+                for i in range(int(lines.group(1))))
+        else:
+            start = zlib.crc32(prompt.encode("utf-8")) % len(words)
+            text = " ".join((words[start:] + words[:start])
+                            [:self.answer_words])
+        tokens = [token for token in re.findall(r"\S+\s*", text) if token]
+        if self.limits is not None:
+            self.limits.check(self._usage(messages, tokens)["total_tokens"])
+        return tokens
+
+    def _usage(self, messages: List[BaseMessage], tokens: List[str]):
+        prompt_tokens = count_tokens([str(m.content) for m in messages])
+        return {"input_tokens": prompt_tokens,
+                "output_tokens": len(tokens),
+                "total_tokens": prompt_tokens + len(tokens)}
+
+    def _result(self, messages, tokens) -> ChatResult:
+        usage = self._usage(messages, tokens)
+        message = AIMessage(content="".join(tokens), usage_metadata=usage,
+                            response_metadata={
+                                "model_name": self.model_name})
+        return ChatResult(generations=[ChatGeneration(message=message)],
+                          llm_output={"model_name": self.model_name})
+
+    def _delays(self, tokens: List[str]) -> Iterator[float]:
+        for i in range(len(tokens)):
+            yield self.latency if i == 0 else self.token_latency
+
+    def _generate(self, messages: List[BaseMessage],
+                  stop: Optional[List[str]] = None, run_manager=None,
+                  **kwargs: Any) -> ChatResult:
+        tokens = self._respond(messages)
+        time.sleep(sum(self._delays(tokens)))
+        return self._result(messages, tokens)
+
+    async def _agenerate(self, messages: List[BaseMessage],
+                         stop: Optional[List[str]] = None, run_manager=None,
+                         **kwargs: Any) -> ChatResult:
+        tokens = self._respond(messages)
+        await asyncio.sleep(sum(self._delays(tokens)))
+        return self._result(messages, tokens)
+
+    def _chunk(self, messages, tokens, i) -> ChatGenerationChunk:
+        # Usage is attached to the last chunk, as OpenAI streams it
+        last = i == len(tokens) - 1
+        return ChatGenerationChunk(message=AIMessageChunk(
+            content=tokens[i],
+            usage_metadata=self._usage(messages, tokens) if last else None,
+            response_metadata={"model_name": self.model_name}
+            if last else {}))
+
+    def _stream(self, messages: List[BaseMessage],
+                stop: Optional[List[str]] = None, run_manager=None,
+                **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        tokens = self._respond(messages)
+        for i, delay in enumerate(self._delays(tokens)):
+            time.sleep(delay)
+            chunk = self._chunk(messages, tokens, i)
+            if run_manager:
+                run_manager.on_llm_new_token(tokens[i], chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: List[BaseMessage],
+                       stop: Optional[List[str]] = None, run_manager=None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        tokens = self._respond(messages)
+        for i, delay in enumerate(self._delays(tokens)):
+            await asyncio.sleep(delay)
+            chunk = self._chunk(messages, tokens, i)
+            if run_manager:
+                await run_manager.on_llm_new_token(tokens[i], chunk=chunk)
+            yield chunk
@@ -1,7 +1,79 @@
+import time
+from typing import AsyncIterator, Iterator, Optional, Union
+
 from langchain_core.output_parsers import StrOutputParser
-from langchain_openai import ChatOpenAI
 
 
 def generate_response(prompt, llm, context: str, question: str) -> str:
     chain = prompt | llm | StrOutputParser()
     return chain.invoke({"question": question, "context": context})
+
+
+async def agenerate_response(prompt, llm, context: str, question: str) -> str:
+    chain = prompt | llm | StrOutputParser()
+    return await chain.ainvoke({"question": question, "context": context})
+
+
+def stream_response(prompt, llm, context: str,
+                    question: str) -> Iterator[str]:
+    """Yields the response tokens as the LLM generates them."""
+    chain = prompt | llm | StrOutputParser()
+    yield from chain.stream({"question": question, "context": context})
+
+
+async def astream_response(prompt, llm, context: str,
+                           question: str) -> AsyncIterator[str]:
+    chain = prompt | llm | StrOutputParser()
+    async for token in chain.astream({"question": question,
+                                      "context": context}):
+        yield token
+
+
+class StreamedResponse:
+    """
+    Wraps a (sync or async) token iterator, passing tokens through while
+    accumulating the full text and timing the generation.
+    """
+
+    def __init__(self, tokens: Union[Iterator[str], AsyncIterator[str]]):
+        self._tokens = tokens
+        self._parts = []
+        self.start = time.perf_counter()
+        self.first_token: Optional[float] = None
+        self.end: Optional[float] = None
+
+    def _record(self, token: str):
+        if token and self.first_token is None:
+            self.first_token = time.perf_counter()
+        self._parts.append(token)
+
+    def __iter__(self) -> Iterator[str]:
+        for token in self._tokens:
+            self._record(token)
+            yield token
+        self.end = time.perf_counter()
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        async for token in self._tokens:
+            self._record(token)
+            yield token
+        self.end = time.perf_counter()
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def metrics(self, streamed: bool = True) -> dict:
+        """
+        Generation time, plus time to first token and tokens/sec after it
+        for streamed responses (OpenAI streams one token per chunk).
+        """
+        end = self.end or time.perf_counter()
+        metrics = {"generation_s": end - self.start}
+        if streamed and self.first_token is not None:
+            tokens = sum(1 for part in self._parts if part)
+            decode_s = end - self.first_token
+            metrics["time_to_first_token_s"] = self.first_token - self.start
+            metrics["tokens_per_sec"] = (tokens - 1) / decode_s \
+                if decode_s > 0 else 0.0
+        return metrics
@@ -1,109 +1,351 @@
 import os
-import re
-import json
-from typing import Optional
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.document_loaders import DirectoryLoader, PyPDFLoader
-from langchain_chroma import Chroma
-from langchain_pinecone import PineconeVectorStore
+from typing import Iterable, Iterator, Optional, Tuple
+from langchain_core.documents import Document
 from rag.config_schema import RulebookConfig
+from rag.embedding_cache import CachedEmbeddings, EmbeddingCache
+from rag.ingestion import (
+    batched,
+    clean_text,  # noqa: F401 - re-exported for existing callers
+    iter_chunks,
+    iter_text_chunks,
+    list_pdfs,
+    list_texts,
+    parse_files,
+)
+from rag.lexical import BM25Index, lexical_index_path
+from rag.local_store import LocalVectorStore
+from rag.manifest import (
+    IndexManifest,
+    chunk_id,
+    file_sha256,
+    manifest_path,
+    text_sha256,
+)
+from rag.rate_limit import BULK, INTERACTIVE, RateLimitedEmbeddings
+from rag.upload import PineconeUploader, open_pinecone_index
 
 from config.config import load_config_from_file
 
 
-def clean_text(text):
-    lines = text.split('\n')
-    filtered_lines = [line for line in lines if len(line.strip()) > 1]
-    text = '\n'.join(filtered_lines)
-    text = re.sub(r'\n{3,}', '\n\n', text)
-    text = re.sub(r' {2,}', ' ', text)
-    return text
-
-
-def upload_in_batches(
-    documents,
-    embedding,
-    index_name: str,
-    namespace: str,
-    batch_size: int = 200
-):
-    total = len(documents)
-    print(f"Uploading {total} documents to Pinecone "
-          f"in batches of {batch_size}...")
-
-    for i in range(0, total, batch_size):
-        batch = documents[i:i+batch_size]
-        print(f"\t→ Uploading batch {i // batch_size + 1} "
-              f"({len(batch)} docs)...")
-        PineconeVectorStore.from_documents(
-            documents=batch,
-            embedding=embedding,
-            index_name=index_name,
-            text_key="text",
-            namespace=namespace
-        )
+# index_pdfs persists the local store once its staged rows reach both the
+#   count and the fraction of the stored rows
+LOCAL_PERSIST_ROWS = 10_000
+LOCAL_PERSIST_FRACTION = 0.25
+
+
+def get_embeddings(api_key: Optional[str] = None,
+                   cache_path: Optional[str] = None,
+                   priority: int = INTERACTIVE) -> CachedEmbeddings:
+    """
+    Returns OpenAI embeddings behind the persistent on-disk embedding cache,
+    so identical chunks and repeated queries are only embedded once. Cache
+    misses go through the model's process-wide rate-limit scheduler at
+    `priority`.
+    """
+    from langchain_openai import OpenAIEmbeddings
+
+    # Retries are left to the scheduler, which backs off every caller
+    embeddings = (OpenAIEmbeddings(api_key=api_key, max_retries=0)
+                  if api_key else OpenAIEmbeddings(max_retries=0))
+    cache = EmbeddingCache(cache_path) if cache_path else EmbeddingCache()
+    return CachedEmbeddings(
+        RateLimitedEmbeddings(embeddings, priority=priority), cache)
+
+
+def with_chunk_ids(chunks: Iterable[Document], namespace: str,
+                   source: str) -> Iterator[Tuple[str, Document]]:
+    """
+    Gives every chunk of one file a deterministic ID and stores it in the
+    chunk metadata. Identical chunks on the same page are told apart by
+    their occurrence count.
+    """
+    occurrences = {}
+    for chunk in chunks:
+        page = chunk.metadata.get("page")
+        key = (page, text_sha256(chunk.page_content))
+        occurrence = occurrences.get(key, 0)
+        occurrences[key] = occurrence + 1
+        _id = chunk_id(namespace, source, page, chunk.page_content,
+                       occurrence)
+        chunk.metadata["chunk_id"] = _id
+        yield _id, chunk
 
 
 def index_pdfs(raw_dir: str, namespace: str, config: RulebookConfig,
                batch_size: int = 200, persist_dir: Optional[str] = None,
-               use_pinecone: bool = False):
-    loader = DirectoryLoader(raw_dir, glob="**/*.pdf", loader_cls=PyPDFLoader)
-    documents = loader.load()
+               use_pinecone: bool = False, workers: int = 1,
+               concurrency: int = 4, target: Optional[str] = None,
+               quantization: Optional[str] = None):
+    """
+    Incrementally indexes the PDFs, plain-text and Markdown files under
+    `raw_dir` into a namespace.
+
+    A per-namespace manifest records the hash of every indexed file and the
+    IDs of its chunks. Unchanged files are skipped without being parsed,
+    only new or changed chunks are embedded and upserted, and vectors of
+    chunks or files that disappeared are deleted. Each file is recorded in
+    the manifest as soon as its chunks are stored (for the local backend,
+    persisted), so an interrupted run resumes from the first file it had
+    not finished.
 
-    for doc in documents:
-        doc.page_content = clean_text(doc.page_content)
+    Ingestion is streamed: PDFs are parsed and cleaned over a pool of
+    `workers` processes a bounded number of files ahead, split lazily, and
+    embedded/upserted in `batch_size` batches while parsing continues, so
+    memory does not grow with the size of the corpus. Text and Markdown
+    files are streamed through mmap after the PDFs (see iter_text_chunks),
+    so memory does not grow with the size of a file either. Pinecone
+    uploads go through PineconeUploader with `concurrency` upserts in
+    flight.
 
+    `target` selects the backend ("pinecone", "chroma" or "local") and
+    defaults to Pinecone or Chroma according to `use_pinecone`. For the
+    local backend, `quantization` ("float16" or "int8") also stores a
+    compact copy of the vectors for search.
+
+    A BM25 index of the same chunks is kept next to the vectorstore for
+    lexical and hybrid retrieval. It is saved once at the end of the run.
+    When it is missing (e.g. the namespace was indexed before it existed)
+    or an interrupted run left it stale, every file is re-parsed to build
+    it; chunks that are already indexed are still not re-embedded.
+    """
+    target = target or ("pinecone" if use_pinecone else "chroma")
+    use_pinecone = target == "pinecone"
+    if use_pinecone and not config.pinecone_index_name:
+        raise ValueError(
+            "pinecone_index_name is required when use_pinecone=True")
+    if not use_pinecone and not persist_dir:
+        raise ValueError("persist_dir is required when use_pinecone=False")
+
+    manifest = IndexManifest.load(
+        manifest_path(persist_dir, namespace, target))
+    lexical = BM25Index(lexical_index_path(persist_dir, namespace, target))
+    # A stale index was left by an interrupted run and may miss chunks the
+    #   manifest already records
+    rebuild_lexical = not lexical.exists or lexical.stale
+    if rebuild_lexical:
+        lexical.clear()
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    # Chunk offsets let overlapping hits be merged when building contexts
     splitter = RecursiveCharacterTextSplitter(chunk_size=1000,
-                                              chunk_overlap=200)
-    chunks = splitter.split_documents(documents)
-    embeddings = OpenAIEmbeddings()
+                                              chunk_overlap=200,
+                                              add_start_index=True)
 
+    # Indexing yields to the queries of a server in the same process
+    embeddings = get_embeddings(config.openai_api_key, priority=BULK)
+    vectorstore = None
     if use_pinecone:
-        if not config.pinecone_index_name:
-            raise ValueError(
-                "pinecone_index_name is required when use_pinecone=True")
-        upload_in_batches(
-            documents=chunks,
-            embedding=embeddings,
-            index_name=config.pinecone_index_name,
+        uploader = PineconeUploader(
+            index=open_pinecone_index(config.pinecone_index_name,
+                                      config.pinecone_api_key),
+            embeddings=embeddings,
             namespace=namespace,
-            batch_size=batch_size
+            concurrency=concurrency,
+            checkpoint_path=os.path.join(os.path.dirname(manifest.path),
+                                         "upload_checkpoint.json")
         )
-        print("All batches uploaded successfully.")
-        return
+    elif target == "local":
+        print(f"Indexing to local NumPy store at '{persist_dir}'...")
+        # Writes are staged and persisted in large steps (see commit)
+        vectorstore = LocalVectorStore(
+            local_store_path(persist_dir, namespace), embeddings,
+            autopersist=False, quantization=quantization)
+    else:
+        from langchain_chroma import Chroma
 
-    if not persist_dir:
-        raise ValueError("persist_dir is required when use_pinecone=False")
+        print(f"Indexing to local Chroma at '{persist_dir}'...")
+        vectorstore = Chroma(
+            persist_directory=chroma_path(persist_dir, namespace),
+            embedding_function=embeddings
+        )
 
-    print(f"Indexing to local Chroma at '{persist_dir}'...")
-    vectorstore = Chroma.from_documents(
-        documents=chunks,
-        embedding=embeddings,
-        persist_directory=os.path.join(persist_dir, namespace)
-    )
-    print("Chroma indexing complete.")
+    stats = {"added": 0, "unchanged": 0, "removed": 0}
+    digests = {}
+    # Files whose chunks have all been produced, as (batch, source, hash,
+    #   chunk IDs, stale chunk IDs); a file is recorded in the manifest once
+    #   the batch holding its last new chunk is stored
+    pending = []
+    next_batch = 0
+
+    def changed_files(paths):
+        for path in paths:
+            source = os.path.relpath(path, raw_dir)
+            digest = digests[source] = file_sha256(path)
+            if manifest.file_hash(source) == digest and not rebuild_lexical:
+                stats["unchanged"] += len(manifest.chunk_ids(source))
+                continue
+            yield path
+
+    def file_chunks(source, chunks):
+        old_ids = set(manifest.chunk_ids(source))
+        ids = []
+        for _id, chunk in with_chunk_ids(chunks, namespace, source):
+            ids.append(_id)
+            lexical.add([_id], [chunk])
+            if _id in old_ids:
+                stats["unchanged"] += 1
+            else:
+                yield _id, chunk
+        pending.append((next_batch, source, digests[source], ids,
+                        sorted(old_ids - set(ids))))
+
+    def new_chunks():
+        for path, pages in parse_files(changed_files(list_pdfs(raw_dir)),
+                                       workers=workers):
+            source = os.path.relpath(path, raw_dir)
+            print(f"\t→ Parsed '{source}' ({len(pages)} pages)")
+            yield from file_chunks(source, iter_chunks(pages, splitter))
+        for path in changed_files(list_texts(raw_dir)):
+            source = os.path.relpath(path, raw_dir)
+            print(f"\t→ Streaming '{source}'")
+            yield from file_chunks(source, iter_text_chunks(path, splitter))
+
+    def id_batches():
+        nonlocal next_batch
+        for batch in batched(new_chunks(), batch_size):
+            yield [_id for _id, _ in batch], [chunk for _, chunk in batch]
+            next_batch += 1
+
+    def commit(stored_batch=None):
+        """
+        Records the pending files whose chunks are stored up to batch
+        `stored_batch` (all of them by default) and deletes the vectors
+        they replaced, so an interrupted run keeps its progress. The local
+        store is persisted first, as its writes are only staged.
+        """
+        ready = [entry for entry in pending
+                 if stored_batch is None or entry[0] <= stored_batch]
+        if not ready:
+            if target == "local":
+                vectorstore.persist()
+            return
+        del pending[:len(ready)]
+        removed_ids = [_id for entry in ready for _id in entry[4]]
+        if removed_ids:
+            print(f"Deleting {len(removed_ids)} stale vectors...")
+            if use_pinecone:
+                uploader.delete(removed_ids)
+            else:
+                for i in range(0, len(removed_ids), batch_size):
+                    vectorstore.delete(ids=removed_ids[i:i+batch_size])
+            stats["removed"] += len(removed_ids)
+        for _, source, digest, ids, _ in ready:
+            if digest is None:
+                manifest.remove_file(source)
+            else:
+                manifest.set_file(source, digest, ids)
+        if target == "local":
+            vectorstore.persist()
+        lexical.delete(removed_ids)
+        # The lexical index is saved once at the end; until then, an
+        #   interrupted run leaves it marked for a rebuild
+        lexical.mark_stale()
+        manifest.bump_version()
+        manifest.save()
+
+    if use_pinecone:
+        upload_stats = uploader.upload(id_batches(), on_commit=commit)
+        stats["added"] = upload_stats["uploaded"] + upload_stats["skipped"]
+    else:
+        for batch, (ids, chunks) in enumerate(id_batches()):
+            vectorstore.add_documents(chunks, ids=ids)
+            stats["added"] += len(ids)
+            print(f"\t→ Upserted {stats['added']} new chunks so far...")
+            # Persisting rewrites the local store, so it waits until the
+            #   staged rows are a fraction of the stored ones; the total
+            #   rewritten then stays proportional to the corpus
+            if target != "local" or vectorstore.staged_rows >= max(
+                    LOCAL_PERSIST_ROWS,
+                    len(vectorstore) * LOCAL_PERSIST_FRACTION):
+                commit(batch)
+
+    for source in sorted(set(manifest.files) - set(digests)):
+        pending.append((next_batch, source, None, [],
+                        manifest.chunk_ids(source)))
+    commit()
+    lexical.save()
+    if manifest.index_version is None:
+        manifest.bump_version()
+        manifest.save()
+
+    print(f"Indexed namespace '{namespace}': {stats['added']} added, "
+          f"{stats['unchanged']} unchanged, {stats['removed']} removed.")
+    print(f"Embedding cache: {embeddings.hits} hits, "
+          f"{embeddings.misses} misses.")
     return vectorstore
 
 
+def local_store_path(persist_dir: str, namespace: str) -> str:
+    return os.path.join(persist_dir, namespace, "local")
+
+
+def chroma_path(persist_dir: str, namespace: str) -> str:
+    """
+    Returns the Chroma directory of a namespace. Namespaces indexed before
+    the manifest existed were nested one level deeper, under
+    `<persist_dir>/<namespace>/<namespace>`; such a directory is moved up
+    into place the first time it is opened.
+    """
+    path = os.path.join(persist_dir, namespace)
+    legacy_path = os.path.join(path, namespace)
+    if not os.path.exists(os.path.join(legacy_path, "chroma.sqlite3")):
+        return path
+    if os.path.exists(os.path.join(path, "chroma.sqlite3")):
+        print(f"Warning: ignoring the old Chroma index at '{legacy_path}'; "
+              f"'{path}' already holds one. Delete it to reclaim space.")
+        return path
+    print(f"Moving the Chroma index at '{legacy_path}' to '{path}'...")
+    for entry in os.listdir(legacy_path):
+        os.replace(os.path.join(legacy_path, entry),
+                   os.path.join(path, entry))
+    os.rmdir(legacy_path)
+    return path
+
+
 def load_vectorstore(namespace: str, persist_dir: Optional[str] = None,
-                     use_pinecone: bool = False):
-    config = load_config_from_file()
-    embeddings = OpenAIEmbeddings(api_key=config.openai_api_key)
+                     use_pinecone: bool = False,
+                     target: Optional[str] = None,
+                     embeddings: Optional[CachedEmbeddings] = None,
+                     pinecone_index=None):
+    """
+    Opens the vectorstore of one namespace. `embeddings` and
+    `pinecone_index` let callers (see VectorStorePool) share one embeddings
+    client and Pinecone connection across namespaces; config/keys.json is
+    only read for what is not passed in.
+    """
+    target = target or ("pinecone" if use_pinecone else "chroma")
+    use_pinecone = target == "pinecone"
+    config = None
+    if embeddings is None or (use_pinecone and pinecone_index is None):
+        config = load_config_from_file()
+    if embeddings is None:
+        embeddings = get_embeddings(config.openai_api_key)
 
+    # Backends are imported on first use; each pulls in a large client
+    #   library that the others do not need
     if use_pinecone:
+        from langchain_pinecone import PineconeVectorStore
+
+        if pinecone_index is None:
+            pinecone_index = open_pinecone_index(config.pinecone_index_name,
+                                                 config.pinecone_api_key)
         return PineconeVectorStore(
-            index_name=config.pinecone_index_name,
+            index=pinecone_index,
             text_key="text",
             namespace=namespace,
-            embedding=embeddings,
-            pinecone_api_key=config.pinecone_api_key
+            embedding=embeddings
         )
 
     if not persist_dir:
         raise ValueError("persist_dir is required when use_pinecone=False")
 
+    if target == "local":
+        return LocalVectorStore(local_store_path(persist_dir, namespace),
+                                embeddings)
+
+    from langchain_chroma import Chroma
+
     return Chroma(
-        persist_directory=os.path.join(persist_dir, namespace),
+        persist_directory=chroma_path(persist_dir, namespace),
         embedding_function=embeddings
     )
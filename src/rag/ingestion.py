@@ -0,0 +1,187 @@
+import os
+import re
+import glob
+import mmap
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+
+def clean_text(text):
+    lines = text.split('\n')
+    filtered_lines = [line for line in lines if len(line.strip()) > 1]
+    text = '\n'.join(filtered_lines)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    text = re.sub(r' {2,}', ' ', text)
+    return text
+
+
+SPACES_RE = re.compile(r' {2,}')
+HEADING_RE = re.compile(r'#{1,6}\s+(.+?)\s*#*\s*$')
+TEXT_EXTENSIONS = (".txt", ".md")
+
+
+def clean_line(line: str) -> Optional[str]:
+    """
+    One line as clean_text would keep it, or None if it would be dropped.
+    """
+    if len(line.strip()) <= 1:
+        return None
+    return SPACES_RE.sub(' ', line)
+
+
+def list_pdfs(raw_dir: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(raw_dir, "**", "*.pdf"),
+                            recursive=True))
+
+
+def list_texts(raw_dir: str) -> List[str]:
+    """Plain-text and Markdown files under `raw_dir`."""
+    return sorted(path for extension in TEXT_EXTENSIONS
+                  for path in glob.glob(os.path.join(raw_dir, "**",
+                                                     "*" + extension),
+                                        recursive=True))
+
+
+def parse_pdf(path: str) -> List[Document]:
+    """Loads one PDF and cleans its pages. Runs inside worker processes."""
+    from langchain_community.document_loaders import PyPDFLoader
+
+    pages = PyPDFLoader(path).load()
+    for page in pages:
+        page.page_content = clean_text(page.page_content)
+    return pages
+
+
+def parse_files(paths: Iterable[str], workers: int = 1,
+                max_pending: int = 0) -> Iterator[Tuple[str, List[Document]]]:
+    """
+    Parses files over a process pool and yields (path, pages) in input order.
+
+    At most `max_pending` files (default: twice the worker count) are parsed
+    ahead of the consumer, so memory stays bounded by the queue depth rather
+    than the corpus size while the consumer embeds and uploads.
+    """
+    if workers <= 1:
+        for path in paths:
+            yield path, parse_pdf(path)
+        return
+
+    max_pending = max_pending or 2 * workers
+    paths = iter(paths)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for path in islice(paths, max_pending):
+            pending.append((path, executor.submit(parse_pdf, path)))
+        while pending:
+            path, future = pending.popleft()
+            for next_path in islice(paths, 1):
+                pending.append(
+                    (next_path, executor.submit(parse_pdf, next_path)))
+            yield path, future.result()
+
+
+def iter_chunks(pages: Iterable[Document], splitter) -> Iterator[Document]:
+    """Splits pages one at a time instead of materializing every chunk."""
+    for page in pages:
+        yield from splitter.split_documents([page])
+
+
+def iter_lines(path: str) -> Iterator[Tuple[int, int, str]]:
+    """
+    Yields the (line number, byte offset, text) of every line of a UTF-8
+    file, read through mmap so the file is never loaded whole.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            offset = 0
+            for number, raw in enumerate(iter(mapped.readline, b""), 1):
+                line = raw.decode("utf-8", errors="replace")
+                if number == 1:
+                    line = line.lstrip("\ufeff")
+                yield number, offset, line.rstrip("\r\n")
+                offset += len(raw)
+
+
+def iter_text_chunks(path: str, splitter,
+                     block_chars: int = 65_536) -> Iterator[Document]:
+    """
+    Streams a .txt or .md file into chunks, applying clean_text's
+    normalization line by line.
+
+    Cleaned lines are gathered into blocks of about `block_chars`
+    characters, ending early at Markdown headings, and each block is split
+    as soon as it is complete, so memory is bounded by the block size. Each
+    chunk records its `start_index` in the cleaned text of the whole file,
+    the first and last lines it covers in the file (`start_line`,
+    `end_line`), the byte `offset` of its first line and, in Markdown, the
+    heading it falls under (`section`). Chunks get no page, so chunks
+    anywhere in the file can be merged by offset.
+
+    `splitter` should be created with `add_start_index=True`; without it,
+    chunks get the offsets and lines of their whole block.
+    """
+    markdown = path.endswith(".md")
+    section = None
+    # Cleaned lines of the current block, with their line numbers, byte
+    #   offsets and start within the block
+    lines, numbers, offsets, starts = [], [], [], []
+    size = 0
+    block_start = 0
+
+    def flush() -> Iterator[Document]:
+        text = "\n".join(lines)
+        metadata = {"source": path}
+        if section is not None:
+            metadata["section"] = section
+        for chunk in splitter.split_documents(
+                [Document(page_content=text, metadata=metadata)]):
+            start = chunk.metadata.get("start_index", -1)
+            if start < 0:
+                first, last = 0, len(lines) - 1
+                start = 0
+            else:
+                end = start + max(len(chunk.page_content) - 1, 0)
+                first = bisect_right(starts, start) - 1
+                last = bisect_right(starts, end) - 1
+            chunk.metadata.update({"start_index": block_start + start,
+                                   "start_line": numbers[first],
+                                   "end_line": numbers[last],
+                                   "offset": offsets[first]})
+            yield chunk
+
+    for number, offset, line in iter_lines(path):
+        cleaned = clean_line(line)
+        if cleaned is None:
+            continue
+        heading = HEADING_RE.match(cleaned) if markdown else None
+        if lines and (heading or size >= block_chars):
+            yield from flush()
+            # The next block follows the newline that ended this one
+            block_start += size
+            lines, numbers, offsets, starts = [], [], [], []
+            size = 0
+        if heading:
+            section = heading.group(1)
+        starts.append(size)
+        lines.append(cleaned)
+        numbers.append(number)
+        offsets.append(offset)
+        size += len(cleaned) + 1
+    if lines:
+        yield from flush()
+
+
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
@@ -0,0 +1,203 @@
+"""
+instrumentation.py - In-process latency, token and cost instrumentation
+
+Stages (translation, retrieval, construction, generation, embedding calls,
+vectorstore loads) are timed into rolling windows, and LLM token usage and
+its cost are attributed to the model and the stage that was running. The
+p50/p95/p99 summary can be dumped to a local JSON or CSV file, so latency
+can be tracked without LangSmith.
+
+Instrumentation is off by default; `stage()` then returns a shared no-op
+context manager, so instrumented code pays for one global lookup.
+"""
+import os
+import csv
+import json
+import time
+import atexit
+import threading
+from collections import deque
+from contextlib import nullcontext
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+import numpy as np
+
+
+# USD per million (prompt, completion) tokens; model names are matched by
+#   their longest listed prefix, so dated snapshots resolve to their family
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "text-embedding-3-small": (0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.0),
+    "text-embedding-ada-002": (0.10, 0.0),
+}
+
+_NULL_STAGE = nullcontext()
+_current_stage = ContextVar("instrumentation_stage", default=None)
+
+
+def compute_cost(model: Optional[str], prompt_tokens: int,
+                 completion_tokens: int) -> float:
+    """Cost in USD of one call, or 0.0 for models without a known price."""
+    if not model:
+        return 0.0
+    matches = [name for name in MODEL_PRICES if model.startswith(name)]
+    if not matches:
+        return 0.0
+    prompt_price, completion_price = MODEL_PRICES[max(matches, key=len)]
+    return (prompt_tokens * prompt_price
+            + completion_tokens * completion_price) / 1_000_000
+
+
+class RollingHistogram:
+    """The last `window` samples of one measurement."""
+
+    def __init__(self, window: int = 10_000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+
+    def record(self, value: float):
+        self.samples.append(value)
+        self.count += 1
+
+    def summary(self) -> dict:
+        values = np.fromiter(self.samples, dtype=np.float64)
+        if not len(values):
+            return {"count": self.count}
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        return {"count": self.count, "mean": float(values.mean()),
+                "p50": float(p50), "p95": float(p95), "p99": float(p99),
+                "max": float(values.max())}
+
+
+class Instrumentation:
+    """Rolling stage latencies and per (model, stage) usage totals."""
+
+    def __init__(self, window: int = 10_000):
+        self.window = window
+        self.latencies: Dict[str, RollingHistogram] = {}
+        self.usage: Dict[tuple, dict] = {}
+        self._lock = threading.Lock()
+
+    def record_latency(self, stage: str, seconds: float):
+        with self._lock:
+            if stage not in self.latencies:
+                self.latencies[stage] = RollingHistogram(self.window)
+            self.latencies[stage].record(seconds)
+
+    def record_usage(self, model: Optional[str], stage: Optional[str],
+                     prompt_tokens: int, completion_tokens: int,
+                     cost: float):
+        key = (model or "unknown", stage or "unstaged")
+        with self._lock:
+            totals = self.usage.setdefault(key, {
+                "calls": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                "cost_usd": 0.0})
+            totals["calls"] += 1
+            totals["prompt_tokens"] += prompt_tokens
+            totals["completion_tokens"] += completion_tokens
+            totals["cost_usd"] += cost
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "latency_s": {stage: histogram.summary() for stage, histogram
+                              in sorted(self.latencies.items())},
+                "usage": [{"model": model, "stage": stage, **totals}
+                          for (model, stage), totals
+                          in sorted(self.usage.items())],
+            }
+
+    def dump(self, path: str):
+        """Writes the summary as JSON, or as CSV rows for a .csv path."""
+        summary = self.summary()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if not path.endswith(".csv"):
+            with open(path, "w") as f:
+                json.dump(summary, f, indent=2)
+            return
+        fields = ["kind", "stage", "model", "count", "mean", "p50", "p95",
+                  "p99", "max", "calls", "prompt_tokens",
+                  "completion_tokens", "cost_usd"]
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            for stage, stats in summary["latency_s"].items():
+                writer.writerow({"kind": "latency_s", "stage": stage,
+                                 **stats})
+            for row in summary["usage"]:
+                writer.writerow({"kind": "usage", **row})
+
+
+class _Stage:
+    __slots__ = ("name", "start", "token")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.token = _current_stage.set(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if _active is not None:
+            _active.record_latency(self.name,
+                                   time.perf_counter() - self.start)
+        try:
+            _current_stage.reset(self.token)
+        except ValueError:
+            # Generators finalized outside the context they started in
+            pass
+        return False
+
+
+_active: Optional[Instrumentation] = None
+
+
+def enable(dump_path: Optional[str] = None,
+           window: int = 10_000) -> Instrumentation:
+    """
+    Turns instrumentation on. With `dump_path`, the summary is written
+    there when the process exits.
+    """
+    global _active
+    if _active is None:
+        _active = Instrumentation(window)
+    if dump_path:
+        atexit.register(lambda: _active and _active.dump(dump_path))
+    return _active
+
+
+def disable():
+    global _active
+    _active = None
+
+
+def current() -> Optional[Instrumentation]:
+    return _active
+
+
+def stage(name: str):
+    """Times the enclosed block as `name`, when instrumentation is on."""
+    if _active is None:
+        return _NULL_STAGE
+    return _Stage(name)
+
+
+def current_stage() -> Optional[str]:
+    return _current_stage.get()
+
+
+def record_usage(model: Optional[str], prompt_tokens: int,
+                 completion_tokens: int, cost: float):
+    """Attributes one LLM call's usage to the running stage."""
+    if _active is not None:
+        _active.record_usage(model, _current_stage.get(), prompt_tokens,
+                             completion_tokens, cost)
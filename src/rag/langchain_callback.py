@@ -1,6 +1,19 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
 from langchain_core.callbacks.base import BaseCallbackHandler
 
+from rag.instrumentation import compute_cost, record_usage
+
+_active_callbacks = ContextVar("active_usage_callbacks", default=())
+
+
 class UsageTrackingCallback(BaseCallbackHandler):
+    """
+    Accumulates token usage, cost and completion token details over every
+    LLM call it sees.
+    """
+
     def __init__(self):
         self.total_tokens = 0
         self.prompt_tokens = 0
@@ -8,13 +21,59 @@ class UsageTrackingCallback(BaseCallbackHandler):
         self.completion_token_details = None
         self.total_cost = 0.0
         self.calls = 0
-        self.completion_token_details = None
 
     def on_llm_end(self, response, **kwargs):
         usage = response.llm_output
+        if usage and "token_usage" in usage:
+            token_usage = usage["token_usage"]
+            self._add(usage.get("model_name"),
+                      token_usage["prompt_tokens"],
+                      token_usage["completion_tokens"],
+                      token_usage["total_tokens"],
+                      token_usage.get("completion_tokens_details"))
+            return
+        # Streamed responses report usage on the final message instead
+        message = getattr(response.generations[0][0], "message", None) \
+            if response.generations and response.generations[0] else None
+        usage = getattr(message, "usage_metadata", None)
         if usage:
-            self.prompt_tokens += usage["token_usage"]["prompt_tokens"]
-            self.completion_tokens += usage["token_usage"]["completion_tokens"]
-            self.completion_token_details = usage["token_usage"]["completion_tokens_details"]
-            self.total_tokens += usage["token_usage"]["total_tokens"]
-            self.calls += 1
+            self._add(message.response_metadata.get("model_name"),
+                      usage["input_tokens"], usage["output_tokens"],
+                      usage["total_tokens"],
+                      usage.get("output_token_details"))
+
+    def _add(self, model, prompt_tokens, completion_tokens, total_tokens,
+             details):
+        cost = compute_cost(model, prompt_tokens, completion_tokens)
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.total_tokens += total_tokens
+        self.total_cost += cost
+        self.calls += 1
+        if details:
+            merged = dict(self.completion_token_details or {})
+            for key, value in details.items():
+                merged[key] = merged.get(key, 0) + (value or 0)
+            self.completion_token_details = merged
+        record_usage(model, prompt_tokens, completion_tokens, cost)
+
+
+class ContextUsageCallback(BaseCallbackHandler):
+    """
+    Callback for LLMs shared between requests. Forwards each LLM result to
+    the UsageTrackingCallbacks activated with `track_usage` in the calling
+    context, so concurrent requests keep separate token counts.
+    """
+
+    def on_llm_end(self, response, **kwargs):
+        for callback in _active_callbacks.get():
+            callback.on_llm_end(response, **kwargs)
+
+
+@contextmanager
+def track_usage(callback: UsageTrackingCallback):
+    token = _active_callbacks.set(_active_callbacks.get() + (callback,))
+    try:
+        yield callback
+    finally:
+        _active_callbacks.reset(token)
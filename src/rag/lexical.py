@@ -0,0 +1,292 @@
+"""
+lexical.py - BM25 inverted index persisted next to each vectorstore
+
+Each namespace and backend gets a directory holding:
+    index.json    - chunk ids and the vocabulary
+    postings.npz  - CSR postings: per-term offsets into parallel arrays of
+                    document indices and term frequencies, and the token
+                    length of every document
+    stale         - present while an indexing run has recorded changes
+                    elsewhere that are not saved here yet
+
+Chunk texts are not kept: hits are returned as IDs and scores, and their
+documents are fetched from the vectorstore, which already stores them.
+Search runs in-process with no embedding call, so it answers exact-term
+lookups ("Opportunity Attack", "Free Parking") even when the embedding
+endpoint is slow.
+"""
+import os
+import re
+import json
+from array import array
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from rag.local_store import top_k
+
+
+LEXICAL_VERSION = 2
+INDEX_FILE = "index.json"
+POSTINGS_FILE = "postings.npz"
+# Version 1 kept every chunk's text and metadata alongside the ids
+LEGACY_DOCS_FILE = "docs.json"
+# Present while a writer has changes that are not saved yet
+STALE_FILE = "stale"
+
+TOKEN_RE = re.compile(r"\w+")
+STOPWORDS = frozenset("""
+a an and are as at be been but by can do does did for from has have how i if
+in into is it its may of on or so that the their them then there these they
+this to was were what when where which while who why will with you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens without stopwords."""
+    return [token for token in TOKEN_RE.findall(text.lower())
+            if token not in STOPWORDS]
+
+
+def lexical_index_path(persist_dir: Optional[str], namespace: str,
+                       target: str) -> str:
+    base = persist_dir or os.path.join("data", "vectorstore")
+    return os.path.join(base, namespace, f"lexical.{target}")
+
+
+class BM25Index:
+    """
+    Okapi BM25 over the chunks of one namespace.
+
+    Writes (`add`, `delete`) are staged and applied by `save()`, which
+    merges the postings of the added chunks into the stored ones. Added
+    chunks are tokenized straight away and only their (term, tf) postings
+    are staged, so a bulk index never holds the chunk texts. Search
+    scores are divided by the summed IDF of the query terms, so a chunk
+    containing every term once at average length scores about 1.0 whatever
+    the query; terms missing from the vocabulary count against the score.
+    """
+
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._load()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    @property
+    def exists(self) -> bool:
+        return (os.path.exists(self._file(INDEX_FILE))
+                or os.path.exists(self._file(LEGACY_DOCS_FILE)))
+
+    @property
+    def stale(self) -> bool:
+        """Whether a writer recorded unsaved changes and never saved."""
+        return os.path.exists(self._file(STALE_FILE))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _reset_staged(self):
+        # Staged chunks are rows of flat posting arrays; an ID added twice
+        #   keeps its last row. New terms are numbered after stored ones
+        self._pending: Dict[str, int] = {}
+        self._deleted = set()
+        self._new_vocab: Dict[str, int] = {}
+        self._new_terms = array("i")
+        self._new_docs = array("i")
+        self._new_tfs = array("H")
+        self._new_lengths = array("f")
+
+    def _load(self):
+        self._reset_staged()
+        self.ids, self.terms = [], []
+        self.vocab = {}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.doc_ids = np.empty(0, dtype=np.int32)
+        self.tfs = np.empty(0, dtype=np.uint16)
+        self.lengths = np.empty(0, dtype=np.float32)
+        if self.exists:
+            index_file = (INDEX_FILE if os.path.exists(self._file(INDEX_FILE))
+                          else LEGACY_DOCS_FILE)
+            with open(self._file(index_file)) as f:
+                data = json.load(f)
+            if data.get("version") not in (1, LEXICAL_VERSION):
+                raise ValueError(
+                    f"Unsupported lexical index version "
+                    f"{data.get('version')} in '{self.path}'")
+            # Only the ids and terms of a version 1 index are read; the
+            #   next save drops its texts
+            self.ids = data["ids"]
+            self.terms = data["terms"]
+            self.vocab = {term: i for i, term in enumerate(self.terms)}
+            with np.load(self._file(POSTINGS_FILE)) as postings:
+                self.offsets = postings["offsets"]
+                self.doc_ids = postings["doc_ids"]
+                self.tfs = postings["tfs"]
+                self.lengths = postings["lengths"]
+        avg_length = float(self.lengths.mean()) if len(self.lengths) else 1.0
+        # Per-document part of the BM25 denominator, computed once
+        self._length_norm = self.k1 * (
+            1 - self.b + self.b * self.lengths / (avg_length or 1.0))
+
+    def add(self, ids: List[str], documents: List[Document]):
+        for _id, doc in zip(ids, documents):
+            row = len(self._new_lengths)
+            tokens = tokenize(doc.page_content)
+            for term, tf in Counter(tokens).items():
+                t = self.vocab.get(term)
+                if t is None:
+                    t = self._new_vocab.setdefault(
+                        term, len(self.terms) + len(self._new_vocab))
+                self._new_terms.append(t)
+                self._new_docs.append(row)
+                self._new_tfs.append(min(tf, 65535))
+            self._new_lengths.append(len(tokens))
+            self._pending[_id] = row
+            self._deleted.discard(_id)
+
+    def delete(self, ids: List[str]):
+        for _id in ids:
+            self._pending.pop(_id, None)
+            self._deleted.add(_id)
+
+    def clear(self):
+        """Stages the deletion of every stored chunk."""
+        self.delete(self.ids)
+
+    def mark_stale(self):
+        """
+        Records that the staged writes belong to changes already made
+        elsewhere (e.g. a manifest), until the next `save()`. A writer that
+        finds the index stale rebuilds it.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        open(self._file(STALE_FILE), "w").close()
+
+    def save(self):
+        """Applies staged writes and rewrites both files."""
+        if not self._pending and not self._deleted and \
+                os.path.exists(self._file(INDEX_FILE)):
+            if self.stale:
+                os.remove(self._file(STALE_FILE))
+            return
+        replaced = self._deleted | set(self._pending)
+        keep = np.array([_id not in replaced for _id in self.ids],
+                        dtype=bool)
+        ids = [_id for _id, kept in zip(self.ids, keep) if kept]
+
+        # Postings of the kept chunks, as (term, document, tf) triples
+        #   with documents renumbered past the removed ones
+        terms = self.terms + list(self._new_vocab)
+        term_idx = np.repeat(np.arange(len(self.terms), dtype=np.int64),
+                             np.diff(self.offsets))
+        kept = keep[self.doc_ids] if len(keep) else np.zeros(0, dtype=bool)
+        renumber = np.cumsum(keep) - 1
+        term_parts = [term_idx[kept]]
+        doc_parts = [renumber[self.doc_ids[kept]].astype(np.int64)]
+        tf_parts = [self.tfs[kept].astype(np.int64)]
+        lengths = [self.lengths[keep] if len(keep) else self.lengths]
+
+        # Staged rows that are still live, numbered after the kept chunks
+        rows = sorted(self._pending.values())
+        row_ids = {row: _id for _id, row in self._pending.items()}
+        new_number = np.full(len(self._new_lengths), -1, dtype=np.int64)
+        new_number[rows] = np.arange(len(ids), len(ids) + len(rows))
+        new_docs = new_number[np.frombuffer(self._new_docs, dtype=np.int32)]
+        live = new_docs >= 0
+        term_parts.append(
+            np.frombuffer(self._new_terms, dtype=np.int32)[live])
+        doc_parts.append(new_docs[live])
+        tf_parts.append(np.frombuffer(self._new_tfs, dtype=np.uint16)[live])
+        lengths.append(np.frombuffer(self._new_lengths,
+                                     dtype=np.float32)[rows])
+        ids.extend(row_ids[row] for row in rows)
+
+        term_idx = np.concatenate(term_parts).astype(np.int64)
+        # Drop terms no kept chunk uses any more
+        used, term_idx = np.unique(term_idx, return_inverse=True)
+        terms = [terms[t] for t in used]
+        # Group postings by term, keeping document order within a term
+        order = np.argsort(term_idx, kind="stable")
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_idx, minlength=len(terms)),
+                  out=offsets[1:])
+
+        os.makedirs(self.path, exist_ok=True)
+        tmp_postings = self._file(POSTINGS_FILE + ".tmp.npz")
+        np.savez(tmp_postings, offsets=offsets,
+                 doc_ids=np.concatenate(doc_parts).astype(np.int32)[order],
+                 tfs=np.concatenate(tf_parts).astype(np.uint16)[order],
+                 lengths=np.concatenate(lengths).astype(np.float32))
+        tmp_index = self._file(INDEX_FILE + ".tmp")
+        with open(tmp_index, "w") as f:
+            json.dump({"version": LEXICAL_VERSION, "ids": ids,
+                       "terms": terms}, f, separators=(",", ":"))
+        os.replace(tmp_postings, self._file(POSTINGS_FILE))
+        os.replace(tmp_index, self._file(INDEX_FILE))
+        for name in (LEGACY_DOCS_FILE, STALE_FILE):
+            if os.path.exists(self._file(name)):
+                os.remove(self._file(name))
+        self._load()
+
+    def _idf(self, df: int) -> float:
+        n = len(self.ids)
+        return float(np.log1p((n - df + 0.5) / (df + 0.5)))
+
+    def search_ids(self, query: str, k: int = 4) -> List[Tuple[str, float]]:
+        """
+        Returns the IDs of up to `k` chunks matching the query, best first,
+        with their normalized BM25 score.
+        """
+        terms = set(tokenize(query))
+        if not terms or not self.ids:
+            return []
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        max_score = 0.0
+        for term in terms:
+            t = self.vocab.get(term)
+            if t is None:
+                max_score += self._idf(0)
+                continue
+            start, end = self.offsets[t], self.offsets[t + 1]
+            idf = self._idf(int(end - start))
+            max_score += idf
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end].astype(np.float32)
+            # A term has at most one posting per document
+            scores[docs] += idf * tf * (self.k1 + 1) / (
+                tf + self._length_norm[docs])
+
+        hits = []
+        for i in top_k(scores, k):
+            if scores[i] <= 0:
+                break
+            hits.append((self.ids[i],
+                         min(float(scores[i]) / max_score, 1.0)))
+        return hits
+
+    def search(self, query: str, k: int,
+               fetch: Callable[[List[str]], List[Document]]
+               ) -> List[Tuple[Document, float]]:
+        """
+        Returns up to `k` chunks matching the query, best first, with their
+        normalized BM25 score (also stored as `bm25_score` metadata).
+        `fetch` returns the documents of a list of chunk IDs, e.g. from the
+        vectorstore; chunks it does not return are skipped.
+        """
+        hits = self.search_ids(query, k)
+        if not hits:
+            return []
+        docs = {doc.id: doc for doc in fetch([_id for _id, _ in hits])}
+        results = []
+        for _id, score in hits:
+            doc = docs.get(_id)
+            if doc is not None:
+                doc.metadata = {**doc.metadata, "bm25_score": score}
+                results.append((doc, score))
+        return results
@@ -0,0 +1,504 @@
+"""
+local_store.py - Local memory-mapped NumPy vectorstore
+
+Each namespace is a directory holding:
+    vectors.npy    - contiguous (N, dim) float32 matrix of unit-normalized
+                     embeddings, opened with np.memmap
+    texts.bin      - UTF-8 chunk texts, concatenated
+    metadata.json  - ids, byte offsets into texts.bin and chunk metadata
+                     (source, page, ...)
+
+Search is exact: one matrix-vector product plus argpartition for a single
+query, one matrix-matrix product for a batch of queries.
+
+Optionally a compact copy of the vectors is stored alongside:
+    vectors.f16.npy           - float16 vectors, or
+    vectors.i8.npy/scales.npy - int8 vectors with a float32 scale per vector
+Searches then score the compact copy and rescore a small candidate set
+against the float32 vectors, so only a few full-precision rows are read.
+"""
+import os
+import json
+import mmap
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks import CallbackManager
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables.config import get_config_list, run_in_executor
+from langchain_core.vectorstores import VectorStore, VectorStoreRetriever
+
+
+VECTORS_FILE = "vectors.npy"
+TEXTS_FILE = "texts.bin"
+METADATA_FILE = "metadata.json"
+FLOAT16_FILE = "vectors.f16.npy"
+INT8_FILE = "vectors.i8.npy"
+SCALES_FILE = "scales.npy"
+QUANTIZATIONS = ("float16", "int8")
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+def quantize_int8(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-vector int8 quantization: matrix ~= q * scales."""
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    q = np.rint(matrix / scales[:, np.newaxis]).astype(np.int8)
+    return q, scales.astype(np.float32)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the `k` highest scores per row, best first."""
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+    part = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    order = np.argsort(-np.take_along_axis(scores, part, axis=-1), axis=-1)
+    return np.take_along_axis(part, order, axis=-1)
+
+
+class LocalVectorStore(VectorStore):
+    """
+    Exact-search vectorstore over a memory-mapped float32 matrix.
+
+    Writes (`add_texts`, `delete`) are staged and applied by `persist()`,
+    which rewrites the files in one streaming pass. With `autopersist` (the
+    default) every write is persisted immediately; bulk writers such as
+    `index_pdfs` turn it off and persist once the staged rows are a
+    fraction of the stored ones, so the rows rewritten over a whole index
+    stay proportional to its size.
+
+    `quantization` ("float16" or "int8") stores a compact copy of the
+    vectors that searches run over, rescoring the best `k * rescore_factor`
+    candidates at full precision. When omitted, the setting the store was
+    persisted with is used.
+    """
+
+    def __init__(self, persist_directory: str, embedding_function: Embeddings,
+                 autopersist: bool = True,
+                 quantization: Optional[str] = None,
+                 rescore_factor: int = 4):
+        if quantization not in (None, "none") + QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization: {quantization}")
+        self.persist_directory = persist_directory
+        self._embedding = embedding_function
+        self.autopersist = autopersist
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        self._pending_ids = []
+        self._pending_texts = []
+        self._pending_metadatas = []
+        self._pending_vectors = None
+        self._pending_dim = 0
+        self._deleted = set()
+        self._load()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.persist_directory, name)
+
+    def _load(self):
+        self.ids, self.offsets, self.metadatas = [], [0], []
+        self.vectors = np.empty((0, 0), dtype=np.float32)
+        self.compact, self.scales = None, None
+        self._stored_quantization = None
+        self._texts = b""
+        # id -> row, built on the first get_by_ids
+        self._positions = None
+        if not os.path.exists(self._path(METADATA_FILE)):
+            return
+        with open(self._path(METADATA_FILE)) as f:
+            meta = json.load(f)
+        self.ids = meta["ids"]
+        self.offsets = meta["offsets"]
+        self.metadatas = meta["metadatas"]
+        self._stored_quantization = meta.get("quantization")
+        if self.quantization is None:
+            self.quantization = self._stored_quantization
+        if self.ids:
+            self.vectors = np.load(self._path(VECTORS_FILE), mmap_mode="r")
+            if self.offsets[-1]:
+                with open(self._path(TEXTS_FILE), "rb") as f:
+                    self._texts = mmap.mmap(f.fileno(), 0,
+                                            access=mmap.ACCESS_READ)
+            if self._stored_quantization == "float16":
+                self.compact = np.load(self._path(FLOAT16_FILE),
+                                       mmap_mode="r")
+            elif self._stored_quantization == "int8":
+                self.compact = np.load(self._path(INT8_FILE), mmap_mode="r")
+                self.scales = np.load(self._path(SCALES_FILE))
+        if len(self.ids) != len(self.vectors):
+            raise ValueError(
+                f"Corrupt local vectorstore at '{self.persist_directory}': "
+                f"{len(self.ids)} ids but {len(self.vectors)} vectors")
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def staged_rows(self) -> int:
+        """Rows added or deleted since the last persist."""
+        return len(self._pending_ids) + len(self._deleted)
+
+    def _text(self, i: int) -> str:
+        return self._texts[self.offsets[i]:self.offsets[i + 1]].decode("utf-8")
+
+    def _document(self, i: int) -> Document:
+        return Document(page_content=self._text(i),
+                        metadata=dict(self.metadatas[i]), id=self.ids[i])
+
+    def iter_batches(self, batch_size: int = 4096):
+        """
+        Yields the persisted rows as (ids, vectors, texts, metadatas)
+        batches, e.g. to export a snapshot.
+        """
+        for start in range(0, len(self.ids), batch_size):
+            end = min(start + batch_size, len(self.ids))
+            yield (self.ids[start:end], np.asarray(self.vectors[start:end]),
+                   [self._text(i) for i in range(start, end)],
+                   [dict(metadata) for metadata in self.metadatas[start:end]])
+
+    # Writes
+
+    def add_texts(self, texts: Iterable[str],
+                  metadatas: Optional[List[dict]] = None, *,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        vectors = np.asarray(self._embedding.embed_documents(texts),
+                             dtype=np.float32)
+        return self.add_vectors(vectors, texts, metadatas, ids=ids)
+
+    def add_vectors(self, vectors: np.ndarray, texts: List[str],
+                    metadatas: Optional[List[dict]] = None, *,
+                    ids: Optional[List[str]] = None) -> List[str]:
+        """Stages precomputed embeddings, e.g. from a snapshot."""
+        ids = list(ids) if ids else [os.urandom(16).hex() for _ in texts]
+        metadatas = metadatas or [{} for _ in texts]
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+        dim = (self._pending_dim if self._pending_vectors is not None
+               else self.vectors.shape[1] if self.ids else None)
+        if dim is not None and vectors.shape[1] != dim:
+            raise ValueError(f"Expected {dim}-dimensional vectors, "
+                             f"got {vectors.shape[1]}")
+        if self._pending_vectors is None:
+            # Staged vectors are spilled to a temp file, so a bulk index
+            #   does not hold the whole corpus in memory before persisting
+            os.makedirs(self.persist_directory, exist_ok=True)
+            self._pending_vectors = tempfile.TemporaryFile(
+                dir=self.persist_directory)
+            self._pending_dim = vectors.shape[1]
+        self._pending_vectors.write(vectors.tobytes())
+        self._pending_ids.extend(ids)
+        self._pending_texts.extend(texts)
+        self._pending_metadatas.extend(metadatas)
+        if self.autopersist:
+            self.persist()
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None,
+               **kwargs: Any) -> Optional[bool]:
+        self._deleted.update(ids or [])
+        if self.autopersist:
+            self.persist()
+        return True
+
+    def persist(self, block_rows: int = 4096):
+        """
+        Applies staged writes: kept rows are copied block by block from the
+        current files, staged rows are appended, and the new files replace
+        the old ones.
+        """
+        quantization = (None if self.quantization == "none"
+                        else self.quantization)
+        if (not self._pending_ids and not self._deleted
+                and quantization == self._stored_quantization):
+            return
+        replaced = self._deleted | set(self._pending_ids)
+        keep = [i for i, _id in enumerate(self.ids) if _id not in replaced]
+        dim = self.vectors.shape[1] if len(self.ids) else self._pending_dim
+        count = len(keep) + len(self._pending_ids)
+        os.makedirs(self.persist_directory, exist_ok=True)
+
+        ids, offsets, metadatas = [], [0], []
+        tmp_vectors = self._path(VECTORS_FILE + ".tmp")
+        tmp_texts = self._path(TEXTS_FILE + ".tmp")
+        out = np.lib.format.open_memmap(tmp_vectors, mode="w+",
+                                        dtype=np.float32,
+                                        shape=(count, dim))
+        row = 0
+        with open(tmp_texts, "wb") as texts_out:
+            for start in range(0, len(keep), block_rows):
+                block = keep[start:start + block_rows]
+                out[row:row + len(block)] = self.vectors[block]
+                row += len(block)
+                for i in block:
+                    data = self._texts[self.offsets[i]:self.offsets[i + 1]]
+                    texts_out.write(data)
+                    offsets.append(offsets[-1] + len(data))
+                    ids.append(self.ids[i])
+                    metadatas.append(self.metadatas[i])
+
+            if self._pending_ids:
+                self._pending_vectors.seek(0)
+                for start in range(0, len(self._pending_ids), block_rows):
+                    n = min(block_rows, len(self._pending_ids) - start)
+                    block = np.frombuffer(
+                        self._pending_vectors.read(n * dim * 4),
+                        dtype=np.float32).reshape(n, dim)
+                    out[row:row + n] = block
+                    row += n
+                for text in self._pending_texts:
+                    data = text.encode("utf-8")
+                    texts_out.write(data)
+                    offsets.append(offsets[-1] + len(data))
+                ids.extend(self._pending_ids)
+                metadatas.extend(self._pending_metadatas)
+        out.flush()
+        del out
+
+        tmp_metadata = self._path(METADATA_FILE + ".tmp")
+        with open(tmp_metadata, "w") as f:
+            json.dump({"ids": ids, "offsets": offsets,
+                       "metadatas": metadatas,
+                       "quantization": quantization},
+                      f, separators=(",", ":"))
+
+        self._close()
+        os.replace(tmp_vectors, self._path(VECTORS_FILE))
+        os.replace(tmp_texts, self._path(TEXTS_FILE))
+        if quantization:
+            self._write_compact(quantization, block_rows)
+        os.replace(tmp_metadata, self._path(METADATA_FILE))
+        stale = {None: (FLOAT16_FILE, INT8_FILE, SCALES_FILE),
+                 "float16": (INT8_FILE, SCALES_FILE),
+                 "int8": (FLOAT16_FILE,)}[quantization]
+        for name in stale:
+            if os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+        self._pending_ids, self._pending_texts = [], []
+        self._pending_metadatas, self._deleted = [], set()
+        if self._pending_vectors is not None:
+            self._pending_vectors.close()
+            self._pending_vectors = None
+        self._load()
+
+    def _write_compact(self, quantization: str, block_rows: int):
+        """Writes the compact copy of vectors.npy block by block."""
+        vectors = np.load(self._path(VECTORS_FILE), mmap_mode="r")
+        count, dim = vectors.shape
+        dtype = np.float16 if quantization == "float16" else np.int8
+        name = FLOAT16_FILE if quantization == "float16" else INT8_FILE
+        out = np.lib.format.open_memmap(self._path(name + ".tmp"), mode="w+",
+                                        dtype=dtype, shape=(count, dim))
+        scales = np.empty(count, dtype=np.float32)
+        for start in range(0, count, block_rows):
+            block = np.asarray(vectors[start:start + block_rows])
+            if quantization == "float16":
+                out[start:start + len(block)] = block.astype(np.float16)
+            else:
+                q, block_scales = quantize_int8(block)
+                out[start:start + len(block)] = q
+                scales[start:start + len(block)] = block_scales
+        out.flush()
+        del out, vectors
+        os.replace(self._path(name + ".tmp"), self._path(name))
+        if quantization == "int8":
+            np.save(self._path(SCALES_FILE), scales)
+
+    def _close(self):
+        if isinstance(self._texts, mmap.mmap):
+            self._texts.close()
+        self.vectors = np.empty((0, 0), dtype=np.float32)
+        self.compact, self.scales = None, None
+
+    # Search
+
+    def _compact_scores(self, queries: np.ndarray,
+                        block_rows: int = 65536) -> np.ndarray:
+        """
+        Approximate (Q, N) scores over the compact vectors. Blocks are
+        upcast one at a time, so no full float32 copy is materialized.
+        """
+        scores = np.empty((len(queries), len(self.ids)), dtype=np.float32)
+        for start in range(0, len(self.ids), block_rows):
+            block = self.compact[start:start + block_rows]
+            block_scores = queries @ block.astype(np.float32).T
+            if self.scales is not None:
+                block_scores *= self.scales[start:start + block_rows]
+            scores[:, start:start + block_rows] = block_scores
+        return scores
+
+    def search_vectors(self, query_vectors: np.ndarray, k: int,
+                       rescore: bool = True
+                       ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns (indices, scores) of the top `k` rows for each query.
+
+        Without a compact copy this is one exact matrix product. With one,
+        candidates come from the compact scores and, if `rescore`, are
+        re-ranked against the float32 rows.
+        """
+        queries = _normalize(np.asarray(query_vectors, dtype=np.float32))
+        if self.compact is None:
+            scores = queries @ self.vectors.T
+            best = top_k(scores, k)
+            return best, np.take_along_axis(scores, best, axis=-1)
+
+        approx = self._compact_scores(queries)
+        if not rescore:
+            best = top_k(approx, k)
+            return best, np.take_along_axis(approx, best, axis=-1)
+        candidates = top_k(approx, k * self.rescore_factor)
+        exact = np.einsum("qd,qcd->qc", queries,
+                          self.vectors[candidates.ravel()].reshape(
+                              candidates.shape + (queries.shape[1],)))
+        order = top_k(exact, k)
+        return (np.take_along_axis(candidates, order, axis=-1),
+                np.take_along_axis(exact, order, axis=-1))
+
+    def _search(self, query_vectors: np.ndarray,
+                k: int) -> List[List[Tuple[Document, float]]]:
+        if not len(self.ids):
+            return [[] for _ in range(len(query_vectors))]
+        best, scores = self.search_vectors(query_vectors, k)
+        return [[(self._document(int(i)), float(score))
+                 for i, score in zip(best[q], scores[q])]
+                for q in range(len(best))]
+
+    def similarity_search_by_vector_with_score(
+            self, embedding: List[float],
+            k: int = 4) -> List[Tuple[Document, float]]:
+        query = np.asarray(embedding, dtype=np.float32)[np.newaxis, :]
+        return self._search(query, k)[0]
+
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     **kwargs: Any
+                                     ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(
+            self._embedding.embed_query(query), k)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in
+                self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search(self, query: str, k: int = 4,
+                          **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def batch_similarity_search_with_score(
+            self, queries: List[str],
+            k: int = 4) -> List[List[Tuple[Document, float]]]:
+        """
+        Answers several queries with one matrix-matrix product. The queries
+        are embedded concurrently with `embed_query`, as asymmetric models
+        embed queries differently from documents.
+        """
+        if not queries:
+            return []
+        if len(queries) == 1:
+            vectors = [self._embedding.embed_query(queries[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+                vectors = list(executor.map(self._embedding.embed_query,
+                                            queries))
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return self._search(vectors, k)
+
+    def _select_relevance_score_fn(self):
+        # Scores are cosine similarities already
+        return lambda score: score
+
+    def get_by_ids(self, ids: List[str], /) -> List[Document]:
+        if self._positions is None:
+            self._positions = {_id: i for i, _id in enumerate(self.ids)}
+        return [self._document(self._positions[_id]) for _id in ids
+                if _id in self._positions]
+
+    def as_retriever(self, **kwargs: Any) -> "LocalVectorStoreRetriever":
+        tags = kwargs.pop("tags", None) or [*self._get_retriever_tags()]
+        return LocalVectorStoreRetriever(vectorstore=self, tags=tags,
+                                         **kwargs)
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings,
+                   metadatas: Optional[List[dict]] = None, *,
+                   ids: Optional[List[str]] = None,
+                   persist_directory: Optional[str] = None,
+                   **kwargs: Any) -> "LocalVectorStore":
+        if not persist_directory:
+            raise ValueError("persist_directory is required")
+        store = cls(persist_directory, embedding, autopersist=False)
+        store.add_texts(texts, metadatas, ids=ids)
+        store.persist()
+        store.autopersist = True
+        return store
+
+
+class LocalVectorStoreRetriever(VectorStoreRetriever):
+    """
+    Retriever that serves `batch` calls for plain similarity search with
+    one matrix-matrix product.
+    """
+
+    def batch(self, inputs: List[str], config=None, *,
+              return_exceptions: bool = False, **kwargs: Any):
+        if self.search_type != "similarity" or not inputs:
+            return super().batch(inputs, config,
+                                 return_exceptions=return_exceptions,
+                                 **kwargs)
+        # One retriever run per input, as invoke would start, so callbacks
+        #   and tracing see every query
+        configs = get_config_list(config, len(inputs))
+        run_managers = [
+            self._callback_manager(query_config, **kwargs).on_retriever_start(
+                None, query,
+                name=query_config.get("run_name") or self.get_name())
+            for query, query_config in zip(inputs, configs)]
+        k = self.search_kwargs.get("k", 4)
+        try:
+            results = self.vectorstore.batch_similarity_search_with_score(
+                list(inputs), k)
+        except Exception as e:
+            for run_manager in run_managers:
+                run_manager.on_retriever_error(e)
+            if return_exceptions:
+                return [e for _ in inputs]
+            raise
+        documents = [[doc for doc, _ in hits] for hits in results]
+        for run_manager, docs in zip(run_managers, documents):
+            run_manager.on_retriever_end(docs)
+        return documents
+
+    def _callback_manager(self, config, **kwargs: Any) -> CallbackManager:
+        return CallbackManager.configure(
+            config.get("callbacks"),
+            None,
+            verbose=kwargs.get("verbose", False),
+            inheritable_tags=config.get("tags"),
+            local_tags=self.tags,
+            inheritable_metadata={**(config.get("metadata") or {}),
+                                  **self._get_ls_params(**kwargs)},
+            local_metadata=self.metadata,
+        )
+
+    async def abatch(self, inputs: List[str], config=None, *,
+                     return_exceptions: bool = False, **kwargs: Any):
+        if self.search_type != "similarity" or not inputs:
+            return await super().abatch(inputs, config,
+                                        return_exceptions=return_exceptions,
+                                        **kwargs)
+        return await run_in_executor(None, self.batch, inputs, config,
+                                     return_exceptions=return_exceptions,
+                                     **kwargs)
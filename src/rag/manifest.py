@@ -0,0 +1,121 @@
+import os
+import json
+import hashlib
+import uuid
+from typing import Dict, List, Optional
+
+
+MANIFEST_VERSION = 1
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """Returns the SHA-256 hex digest of a file, read in fixed-size blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_id(namespace: str, source: str, page, content: str,
+             occurrence: int = 0) -> str:
+    """
+    Builds a deterministic vector ID for a chunk.
+
+    The ID only depends on where the chunk lives and what it contains, so
+    re-splitting an unchanged file yields the same IDs and the vectorstore
+    can be updated in place instead of appended to.
+    """
+    key = f"{namespace}|{source}|{page}|{text_sha256(content)}|{occurrence}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+def manifest_path(persist_dir: Optional[str], namespace: str,
+                  target: str) -> str:
+    base = persist_dir or os.path.join("data", "vectorstore")
+    return os.path.join(base, namespace, f"manifest.{target}.json")
+
+
+class IndexManifest:
+    """
+    Record of the files and chunk IDs indexed into one namespace.
+
+    `files` maps a path relative to the raw directory to its content hash
+    and the IDs of the chunks it produced. `index_version` changes every
+    time the indexed content changes, so caches keyed on it are invalidated
+    by a re-index.
+    """
+
+    def __init__(self, path: str, files: Optional[Dict[str, dict]] = None,
+                 index_version: Optional[str] = None):
+        self.path = path
+        self.files = files or {}
+        self.index_version = index_version
+
+    @classmethod
+    def load(cls, path: str) -> "IndexManifest":
+        if not os.path.exists(path):
+            return cls(path)
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("version") != MANIFEST_VERSION:
+            raise ValueError(
+                f"Unsupported manifest version {data.get('version')} "
+                f"in '{path}'")
+        return cls(path, data.get("files", {}), data.get("index_version"))
+
+    def file_hash(self, source: str) -> Optional[str]:
+        entry = self.files.get(source)
+        return entry["sha256"] if entry else None
+
+    def chunk_ids(self, source: str) -> List[str]:
+        entry = self.files.get(source)
+        return list(entry["chunks"]) if entry else []
+
+    def set_file(self, source: str, sha256: str, chunk_ids: List[str]):
+        self.files[source] = {"sha256": sha256, "chunks": list(chunk_ids)}
+
+    def remove_file(self, source: str) -> List[str]:
+        entry = self.files.pop(source, None)
+        return list(entry["chunks"]) if entry else []
+
+    def bump_version(self):
+        self.index_version = uuid.uuid4().hex
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "version": MANIFEST_VERSION,
+                "index_version": self.index_version,
+                "files": self.files,
+            }, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+_index_versions = {}
+
+
+def current_index_version(persist_dir: Optional[str], namespace: str,
+                          target: str) -> Optional[str]:
+    """
+    Returns the namespace's current index version. The manifest is only
+    re-read when its modification time changes, so this is cheap enough to
+    call for every question.
+    """
+    path = manifest_path(persist_dir, namespace, target)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    cached = _index_versions.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    version = IndexManifest.load(path).index_version
+    _index_versions[path] = (mtime, version)
+    return version
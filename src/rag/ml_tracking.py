@@ -1,30 +1,183 @@
-import mlflow
 import os
-import json
-
-def start_experiment(name="RuleBookAssistant"):
-    mlflow.set_tracking_uri(os.getenv("MLFLOW_TRACKING_URI", "file:./mlruns"))
-    mlflow.set_experiment(name)
-
-def log_pipeline_params(params: dict):
-    for key, value in params.items():
-        mlflow.log_param(key, value)
-
-def log_pipeline_metrics(metrics: dict):
-    for key, value in metrics.items():
-        mlflow.log_metric(key, value)
-
-def log_artifacts(response: str, context: str, completion_token_details: str):
-    with open("temp_response.txt", "w") as f:
-        f.write(response)
-    with open("temp_context.txt", "w") as f:
-        f.write(context)
-    with open("completion_tokens_detsils.json", "w") as f:
-        json.dump(completion_token_details, f)
-
-    mlflow.log_artifact("temp_response.txt")
-    mlflow.log_artifact("temp_context.txt")
-    mlflow.log_artifact("completion_tokens_detsils.json")
-    os.remove("temp_response.txt")
-    os.remove("temp_context.txt")
-    os.remove("completion_tokens_detsils.json")
+import sys
+import time
+import queue
+import atexit
+import threading
+from typing import Optional
+
+from rag.instrumentation import stage
+
+# mlflow takes over a second to import, so it is imported on first use by
+#   the MLflowLogger worker thread, off the request path
+
+DEFAULT_EXPERIMENT = "RuleBookAssistant"
+
+
+def tracking_uri() -> str:
+    return os.getenv("MLFLOW_TRACKING_URI", "file:./mlruns")
+
+
+class MLflowLogger:
+    """
+    Logs pipeline runs to MLflow from a background thread, so tracking I/O
+    stays off the request path.
+
+    Runs wait in a queue of at most `max_queue` entries. When it is full,
+    `policy="drop"` discards the run (counted in `dropped`) and
+    `policy="block"` waits for room. The experiment is set up once by the
+    worker; each run is written with one `log_batch` call plus its
+    artifacts, straight from memory. Queued runs are flushed at interpreter
+    exit.
+    """
+
+    def __init__(self, experiment: str = DEFAULT_EXPERIMENT,
+                 max_queue: int = 1000, policy: str = "drop",
+                 exit_timeout: float = 30.0):
+        if policy not in ("drop", "block"):
+            raise ValueError(f"Unknown queue policy: {policy}")
+        self.experiment = experiment
+        self.policy = policy
+        self.exit_timeout = exit_timeout
+        self.logged = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._work, name="mlflow-logger", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def log_run(self, params: dict, metrics: dict,
+                artifacts: Optional[dict] = None) -> bool:
+        """
+        Queues one run. `artifacts` maps artifact file names to text, or to
+            JSON-serializable objects for `.json` names.
+
+        Returns:
+            bool: Whether the run was queued (False if it was dropped).
+        """
+        if self._closed:
+            return False
+        self._start()
+        item = (params, metrics, artifacts or {}, time.time())
+        if self.policy == "block":
+            self._queue.put(item)
+            return True
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _work(self):
+        client, experiment_id = None, None
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if experiment_id is None:
+                    from mlflow import MlflowClient
+
+                    client = MlflowClient(tracking_uri=tracking_uri())
+                    experiment = client.get_experiment_by_name(
+                        self.experiment)
+                    experiment_id = (experiment.experiment_id if experiment
+                                     else client.create_experiment(
+                                         self.experiment))
+                with stage("mlflow_log"):
+                    self._write(client, experiment_id, *item)
+                self.logged += 1
+            except Exception as e:
+                # Keep draining the queue; report the first error only
+                self.failed += 1
+                if self.failed == 1:
+                    print(f"MLflow logging failed: {type(e).__name__}: {e}",
+                          file=sys.stderr)
+            finally:
+                self._queue.task_done()
+
+    @staticmethod
+    def _write(client, experiment_id: str, params: dict, metrics: dict,
+               artifacts: dict, timestamp: float):
+        from mlflow.entities import Metric, Param
+
+        run = client.create_run(experiment_id,
+                                start_time=int(timestamp * 1000))
+        run_id = run.info.run_id
+        millis = int(timestamp * 1000)
+        client.log_batch(
+            run_id,
+            metrics=[Metric(key, float(value), millis, 0)
+                     for key, value in metrics.items()],
+            params=[Param(key, str(value)) for key, value in params.items()])
+        for name, content in artifacts.items():
+            if name.endswith(".json"):
+                client.log_dict(run_id, content, name)
+            else:
+                client.log_text(run_id, content, name)
+        client.set_terminated(run_id)
+
+    def flush(self):
+        """Waits until every queued run has been written."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        """Writes the queued runs and stops the worker."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(self.exit_timeout)
+        if self._thread.is_alive():
+            print(f"MLflow logging did not finish within "
+                  f"{self.exit_timeout}s; {self._queue.qsize()} runs lost.",
+                  file=sys.stderr)
+        if self.dropped or self.failed:
+            print(f"MLflow logging dropped {self.dropped} runs (queue full) "
+                  f"and failed to write {self.failed}.", file=sys.stderr)
+
+
+class NullLogger:
+    """Stands in for MLflowLogger when runs should not be tracked."""
+
+    policy = "drop"
+    logged = dropped = failed = 0
+
+    def log_run(self, params: dict, metrics: dict,
+                artifacts: Optional[dict] = None) -> bool:
+        return False
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+_default_logger = None
+_default_lock = threading.Lock()
+
+
+def get_logger(**kwargs) -> MLflowLogger:
+    """
+    Returns the process-wide logger, creating it with `kwargs` (see
+    MLflowLogger) on first use.
+    """
+    global _default_logger
+    with _default_lock:
+        if _default_logger is None:
+            _default_logger = MLflowLogger(**kwargs)
+        return _default_logger
@@ -0,0 +1,698 @@
+"""
+pipeline.py - Long-lived RAG pipeline for one namespace
+
+Builds the LLM, query translators, prompt and vectorstore once so that
+answering a question only costs retrieval plus generation. The async path
+overlaps its stages: the vectorstore opens and the original question is
+retrieved while the query is translated, and each translated query is
+retrieved as soon as its line of the LLM output is complete.
+"""
+import time
+import asyncio
+import threading
+from typing import AsyncIterator, Iterator, List, Optional, Union
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.vectorstores import VectorStore
+
+from rag.answer_cache import AnswerCache
+from rag.generation import StreamedResponse
+from rag.indexing import load_vectorstore
+from rag.instrumentation import stage
+from rag.lexical import BM25Index, lexical_index_path
+from rag.manifest import current_index_version
+from rag.query_translation import (
+    DEFAULT_TRANSLATION_CACHE_PATH,
+    QueryTranslator,
+    TranslationCache,
+)
+from rag.query_construction import get_prompt
+from rag.rate_limit import RateLimitedChatModel
+from rag.retrieval import asearch_with_scores, fuse_results, get_documents
+from rag.tracing import (
+    traceable,
+    atraced_translate,
+    atraced_generate,
+    atraced_stream,
+    traced_translate,
+    traced_lexical_search,
+    traced_retrieve,
+    traced_search,
+    traced_build_context,
+    traced_generate,
+    traced_stream,
+)
+from rag.langchain_callback import (
+    ContextUsageCallback,
+    UsageTrackingCallback,
+    track_usage,
+)
+from rag.ml_tracking import MLflowLogger, NullLogger, get_logger
+from rag.vectorstore_pool import VectorStorePool
+
+
+# Strategy that retrieves the untranslated question first and falls back to
+#   query translation only when its hits are weak
+ADAPTIVE = "adaptive"
+STRATEGIES = ("passthrough", *QueryTranslator.PROMPTS, ADAPTIVE)
+
+
+def game_name(namespace: str, supported_games: dict) -> str:
+    for game, details in supported_games.items():
+        if details['abbr'] == namespace:
+            return game
+    return "N/A"
+
+
+class RAGPipeline:
+    """
+    Warm pipeline components for one namespace.
+
+    Translators are created lazily, once per strategy. LLM usage is counted
+    per question through `track_usage`, so a single instance can answer
+    many questions concurrently. With an `answer_cache`, repeated and
+    near-duplicate questions are answered without translation, retrieval or
+    generation.
+
+    `retrieval` selects "vector" search, "hybrid" search (vector results
+    fused with an in-process BM25 search of the question), or "lexical":
+    when the top BM25 hit scores at least `lexical_threshold`, its hits are
+    used directly, skipping translation and the embedding call; otherwise
+    retrieval falls back to hybrid.
+
+    Opening the vectorstore is the slow part of construction; with `lazy`
+    it is deferred to `warm_up`, which the async path runs concurrently
+    with the first query translation. Runs are logged to MLflow by a
+    background `tracker` (the process-wide MLflowLogger by default).
+
+    The "adaptive" strategy first retrieves the untranslated question with
+    scores. Only when the top score is below `adaptive_min_score`, or the
+    gap between the best and worst hit is below `adaptive_min_spread`, is
+    the question translated with `adaptive_fallback` and the translated
+    queries retrieved too. The path taken and the translation latency it
+    saved (the mean cost of past escalations) are logged with each run.
+
+    With a VectorStorePool (`pool`), the vectorstore is taken from the pool,
+    which pipelines of several namespaces share, rather than opened and
+    kept by the pipeline.
+
+    `llm`, `vectorstore` and `translation_cache` replace the components the
+    pipeline would otherwise build (e.g. the offline fakes used by
+    scripts/bench.py); attach a ContextUsageCallback to an injected LLM for
+    its usage to be counted.
+    """
+
+    def __init__(self, namespace: str, supported_games: dict,
+                 openai_api_key: str, target: str = "chroma",
+                 strategy: str = "passthrough", model: str = "gpt-4o-mini",
+                 persist_dir: str = "data/vectorstore",
+                 answer_cache: Optional[AnswerCache] = None,
+                 top_k: int = 4, fetch_k: Optional[int] = None,
+                 retrieval: str = "vector", lexical_threshold: float = 0.8,
+                 context_tokens: int = 2000, lazy: bool = False,
+                 tracker: Optional[Union[MLflowLogger, NullLogger]] = None,
+                 llm: Optional[BaseChatModel] = None,
+                 vectorstore: Optional[VectorStore] = None,
+                 translation_cache: Optional[TranslationCache] = None,
+                 pool: Optional[VectorStorePool] = None,
+                 adaptive_fallback: str = "multi_query",
+                 adaptive_min_score: float = 0.5,
+                 adaptive_min_spread: float = 0.02):
+        if retrieval not in ("vector", "hybrid", "lexical"):
+            raise ValueError(f"Unknown retrieval mode: {retrieval}")
+        if adaptive_fallback in ("passthrough", ADAPTIVE):
+            raise ValueError(
+                f"Invalid adaptive fallback strategy: {adaptive_fallback}")
+        self.namespace = namespace
+        self.persist_dir = persist_dir
+        self.answer_cache = answer_cache
+        # Hits fetched per query before fusion, and kept after it
+        self.top_k = top_k
+        self.fetch_k = fetch_k
+        # Token budget of the context passed to the LLM
+        self.context_tokens = context_tokens
+        self.strategy = strategy
+        self.adaptive_fallback = adaptive_fallback
+        self.adaptive_min_score = adaptive_min_score
+        self.adaptive_min_spread = adaptive_min_spread
+        # Total time and count of adaptive escalations, to estimate the
+        #   latency saved when a question does not escalate
+        self._expansion_s = 0.0
+        self._expansions = 0
+        self.model = model
+        self.target = target
+        # Add game context to the question for LLM, but instruct not to
+        #   mention the game name
+        game = game_name(namespace, supported_games)
+        self.game_context = (f"\n[The query is pertaining to the game "
+                             f"'{game}'. Do not mention the game name.]\n")
+
+        # Initialize LLM with a callback that reports usage per question
+        #   (including streamed responses). Calls go through the model's
+        #   process-wide rate-limit scheduler, which also retries them
+        if llm is None:
+            from langchain_openai import ChatOpenAI
+            from pydantic import SecretStr
+
+            llm = RateLimitedChatModel(
+                llm=ChatOpenAI(model=model, temperature=0,
+                               stream_usage=True, max_retries=0,
+                               api_key=SecretStr(openai_api_key)),
+                callbacks=[ContextUsageCallback()])
+        self.llm = llm
+        self.prompt = get_prompt()
+        # BM25 index built by index_pdfs next to the vectorstore
+        self.retrieval = retrieval
+        self.lexical_threshold = lexical_threshold
+        self.lexical = None
+        if retrieval != "vector":
+            # Reloaded when a re-index changes the index version
+            self._lexical_version = current_index_version(
+                persist_dir, namespace, target)
+            self.lexical = BM25Index(lexical_index_path(persist_dir,
+                                                        namespace, target))
+            if not self.lexical.exists:
+                raise ValueError(
+                    f"No lexical index for namespace '{namespace}' "
+                    f"({target}); re-run scripts/index.py to build it")
+        # One translation cache (in-memory LRU over SQLite) is shared by the
+        #   translators of every strategy
+        if translation_cache is None:
+            translation_cache = TranslationCache(
+                path=DEFAULT_TRANSLATION_CACHE_PATH)
+        self.translation_cache = translation_cache
+        self._translators = {}
+        self._lock = threading.Lock()
+        self.tracker = tracker or get_logger()
+        # Shared with the pipelines of other namespaces when given
+        self.pool = pool
+        self._vectorstore = vectorstore
+        self._retriever = (vectorstore.as_retriever()
+                           if vectorstore is not None else None)
+        self._warm_lock = threading.Lock()
+        if not lazy:
+            self.warm_up()
+
+    def warm_up(self):
+        """
+        Loads the appropriate vectorstore (Pinecone, Chroma or local). Runs
+            once per pipeline. With a `pool`, the store is looked up there
+            on every call instead, so the pool can evict and reopen it.
+        """
+        if self.pool is not None:
+            return self.pool.get(self.namespace, count=False)
+        with self._warm_lock:
+            if self._vectorstore is None:
+                with stage("vectorstore_load"):
+                    vectorstore = load_vectorstore(
+                        namespace=self.namespace,
+                        persist_dir=self.persist_dir, target=self.target)
+                self._retriever = vectorstore.as_retriever()
+                self._vectorstore = vectorstore
+        return self._vectorstore
+
+    async def awarm_up(self):
+        if self._vectorstore is not None:
+            return self._vectorstore
+        if self.pool is not None and self.pool.is_open(self.namespace):
+            return self.pool.get(self.namespace, count=False)
+        return await asyncio.to_thread(self.warm_up)
+
+    @property
+    def vectorstore(self):
+        if self._vectorstore is not None:
+            return self._vectorstore
+        return self.warm_up()
+
+    @property
+    def retriever(self):
+        if self._retriever is not None:
+            return self._retriever
+        if self.pool is not None:
+            return self.warm_up().as_retriever()
+        self.warm_up()
+        return self._retriever
+
+    def translator(self, strategy: str) -> QueryTranslator:
+        # Translators are kept per strategy, so only known ones are built
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown strategy: {strategy}")
+        with self._lock:
+            if strategy not in self._translators:
+                self._translators[strategy] = QueryTranslator(
+                    self.llm, strategy=strategy,
+                    cache=self.translation_cache)
+            return self._translators[strategy]
+
+    def _cache_key(self, strategy: str):
+        # Re-indexing bumps the index version, which invalidates the cache
+        version = current_index_version(self.persist_dir, self.namespace,
+                                        self.target)
+        return (self.namespace, strategy, version or "unversioned")
+
+    def _lexical_search(self, question: str):
+        """
+        BM25 hits of the question, their chunks fetched from the
+            vectorstore (opened only when there are hits).
+        """
+        if self.lexical is None:
+            return None
+        version = current_index_version(self.persist_dir, self.namespace,
+                                        self.target)
+        if version != self._lexical_version:
+            self.lexical = BM25Index(self.lexical.path)
+            self._lexical_version = version
+        return traced_lexical_search(
+            self.lexical, question, self.fetch_k or self.top_k,
+            lambda ids: get_documents(self.vectorstore, ids))
+
+    async def _alexical_search(self, question: str):
+        if self.lexical is None:
+            return None
+        # Fetching the hits may open the vectorstore
+        return await asyncio.to_thread(self._lexical_search, question)
+
+    def _lexical_fast_path(self, hits) -> bool:
+        return (self.retrieval == "lexical" and bool(hits)
+                and hits[0][1] >= self.lexical_threshold)
+
+    def _lexical_metrics(self, hits, fast_path: bool) -> dict:
+        if self.lexical is None:
+            return {}
+        return {"lexical_fast_path": int(fast_path),
+                "bm25_top_score": hits[0][1] if hits else 0.0}
+
+    def _cache_hit(self, response: str, similarity: float) -> dict:
+        metrics = {
+            "response_length": len(response),
+            "answer_cache_hit": 1,
+            "answer_cache_similarity": similarity,
+            **self.answer_cache.stats()
+        }
+        return {"answer": response, "metrics": metrics, "cached": True}
+
+    def _cache_miss_metrics(self) -> dict:
+        if not self.answer_cache:
+            return {}
+        return {"answer_cache_hit": 0, **self.answer_cache.stats()}
+
+    def _params(self, question: str, strategy: str,
+                adaptive: Optional[dict] = None) -> dict:
+        params = {
+            "question": question,
+            "strategy": strategy,
+            "retrieval": self.retrieval,
+            "vectorstore": self.target,
+            "namespace": self.namespace,
+            "llm_model": self.model
+        }
+        if adaptive:
+            params["adaptive_path"] = (self.adaptive_fallback
+                                       if adaptive["adaptive_escalated"]
+                                       else "passthrough")
+        return params
+
+    def _escalate(self, hits, adaptive: dict) -> bool:
+        """
+        Whether the untranslated question's hits are too weak to answer
+            from, recording the decision in `adaptive`. Hits without scores
+            always escalate.
+        """
+        scores = [score for _, score in hits if score is not None]
+        top = max(scores, default=0.0)
+        spread = top - min(scores) if len(scores) > 1 else top
+        escalate = (not scores or top < self.adaptive_min_score
+                    or spread < self.adaptive_min_spread)
+        adaptive.update({"adaptive_escalated": int(escalate),
+                         "adaptive_top_score": top,
+                         "adaptive_score_spread": spread})
+        if not escalate:
+            adaptive["adaptive_latency_saved_s"] = (
+                self._expansion_s / self._expansions
+                if self._expansions else 0.0)
+        return escalate
+
+    def _record_expansion(self, seconds: float, adaptive: dict):
+        with self._lock:
+            self._expansion_s += seconds
+            self._expansions += 1
+        adaptive["adaptive_expansion_s"] = seconds
+
+    def _adaptive_retrieve(self, original: str, lexical_hits,
+                           adaptive: dict):
+        """
+        Retrieves the untranslated question with scores and, only when its
+            hits are weak, translates it with the fallback strategy and
+            fuses in the hits of the translated queries.
+        """
+        fetch_k = self.fetch_k or self.top_k
+        hits = traced_search(self.retriever, [original], fetch_k)[0]
+        if not self._escalate(hits, adaptive):
+            return [original], fuse_results([hits], self.top_k,
+                                            lexical_hits=lexical_hits)
+        start = time.perf_counter()
+        queries = traced_translate(self.translator(self.adaptive_fallback),
+                                   original)
+        if isinstance(queries, str):
+            queries = [queries]
+        results = [hits]
+        extra = [query for query in queries if query != original]
+        if extra:
+            results += traced_search(self.retriever, extra, fetch_k)
+        self._record_expansion(time.perf_counter() - start, adaptive)
+        return (_with_original(original, queries),
+                fuse_results(results, self.top_k, lexical_hits=lexical_hits))
+
+    def _metrics(self, queries, docs, response,
+                 callback: UsageTrackingCallback,
+                 lexical_metrics: dict) -> dict:
+        return {
+            "num_queries": len(queries),
+            "num_docs": len(docs),
+            "response_length": len(response),
+            "prompt_tokens": callback.prompt_tokens,
+            "completion_tokens": callback.completion_tokens,
+            "total_tokens": callback.total_tokens,
+            "llm_calls": callback.calls,
+            "total_cost_usd": callback.total_cost,
+            **self.vectorstore.embeddings.stats(),
+            **self.translation_cache.stats(),
+            **self._cache_miss_metrics(),
+            **(self.pool.stats() if self.pool is not None else {}),
+            **(self.llm.stats() if isinstance(self.llm, RateLimitedChatModel)
+               else {}),
+            **lexical_metrics
+        }
+
+    def _log_run(self, params: dict, metrics: dict, response: str,
+                 context: str, completion_token_details):
+        # Queued for the background logger; only blocks when its queue is
+        #   full and it is set to block
+        self.tracker.log_run(params, metrics, {
+            "response.txt": response,
+            "context.txt": context,
+            "completion_tokens_details.json": completion_token_details,
+        })
+
+    async def _alog_run(self, *args):
+        if self.tracker.policy == "block":
+            await asyncio.to_thread(self._log_run, *args)
+        else:
+            self._log_run(*args)
+
+    @traceable(name="RAG End-to-End")
+    def _answer_steps(self, question: str, strategy: Optional[str],
+                      stream: bool, result: dict) -> Iterator[str]:
+        """
+        Answers one question, yielding the response as it is generated
+            (token by token when `stream` is set, else in one piece) and
+            filling `result` with the answer and its metrics at the end.
+        """
+        strategy = strategy or self.strategy
+        if self.pool is not None:
+            # The one lookup of this question the pool counts
+            self.pool.touch(self.namespace)
+        embedding = None
+        cached = None
+        if self.answer_cache:
+            # Exact match on the normalized question first, then nearest
+            #   neighbour on the embedding of the retrieval text, which
+            #   retrieval then reads back from the embedding cache
+            cache_key = self._cache_key(strategy)
+            cached = self.answer_cache.get_exact(cache_key, question)
+            similarity = 1.0
+        lexical_hits = self._lexical_search(question)
+        fast_path = self._lexical_fast_path(lexical_hits)
+        if self.answer_cache:
+            # A confident lexical hit skips the embedding call entirely
+            if cached is None and not fast_path:
+                embedding = self.vectorstore.embeddings.embed_query(
+                    question + self.game_context)
+                cached, similarity = self.answer_cache.get_similar(
+                    cache_key, embedding)
+            if cached is not None:
+                result.update(self._cache_hit(cached, similarity))
+                self._log_run(self._params(question, strategy),
+                              result["metrics"], cached, "", None)
+                yield cached
+                return
+
+        adaptive = {}
+        with track_usage(UsageTrackingCallback()) as callback:
+            if fast_path:
+                queries = [question]
+                docs = [doc for doc, _ in lexical_hits[:self.top_k]]
+            elif strategy == ADAPTIVE:
+                queries, docs = self._adaptive_retrieve(
+                    question + self.game_context, lexical_hits, adaptive)
+            else:
+                # Translate the question according to the chosen strategy;
+                #   the original question is retrieved alongside
+                original = question + self.game_context
+                queries = traced_translate(self.translator(strategy),
+                                           original)
+                if isinstance(queries, str):
+                    queries = [queries]
+                queries = _with_original(original, queries)
+
+                # Retrieve relevant documents
+                docs = traced_retrieve(self.retriever, queries, self.top_k,
+                                       self.fetch_k, lexical_hits)
+            # Construct the context for the prompt, merging overlapping
+            #   chunks and packing it into the token budget
+            context, context_stats = traced_build_context(
+                docs, self.context_tokens, self.model)
+            # Generate the final response
+            if stream:
+                tokens = StreamedResponse(traced_stream(
+                    self.prompt, self.llm, context, question))
+            else:
+                tokens = StreamedResponse(_iter_one(
+                    traced_generate, self.prompt, self.llm, context,
+                    question))
+            yield from tokens
+            response = tokens.text
+
+        if self.answer_cache:
+            self.answer_cache.put(cache_key, question, embedding, response)
+        metrics = self._metrics(queries, docs, response, callback,
+                                self._lexical_metrics(lexical_hits,
+                                                      fast_path))
+        metrics.update(tokens.metrics(streamed=stream))
+        metrics.update(context_stats)
+        metrics.update(adaptive)
+        self._log_run(self._params(question, strategy, adaptive), metrics,
+                      response, context, callback.completion_token_details)
+        result.update({"answer": response, "metrics": metrics})
+
+    @traceable(name="RAG End-to-End")
+    async def _aanswer_steps(self, question: str, strategy: Optional[str],
+                             stream: bool, result: dict
+                             ) -> AsyncIterator[str]:
+        strategy = strategy or self.strategy
+        if self.pool is not None:
+            # The one lookup of this question the pool counts
+            self.pool.touch(self.namespace)
+        embedding = None
+        cached = None
+        if self.answer_cache:
+            # SQLite lookups block, so they run off the event loop
+            cache_key = await asyncio.to_thread(self._cache_key, strategy)
+            cached = await asyncio.to_thread(
+                self.answer_cache.get_exact, cache_key, question)
+            similarity = 1.0
+        lexical_hits = await self._alexical_search(question)
+        fast_path = self._lexical_fast_path(lexical_hits)
+        if self.answer_cache:
+            if cached is None and not fast_path:
+                vectorstore = await self.awarm_up()
+                embedding = await vectorstore.embeddings.aembed_query(
+                    question + self.game_context)
+                cached, similarity = await asyncio.to_thread(
+                    self.answer_cache.get_similar, cache_key, embedding)
+            if cached is not None:
+                result.update(self._cache_hit(cached, similarity))
+                await self._alog_run(self._params(question, strategy),
+                                     result["metrics"], cached, "", None)
+                yield cached
+                return
+
+        adaptive = {}
+        with track_usage(UsageTrackingCallback()) as callback:
+            if fast_path:
+                queries = [question]
+                docs = [doc for doc, _ in lexical_hits[:self.top_k]]
+            else:
+                queries, docs = await self._atranslate_and_retrieve(
+                    question, strategy, lexical_hits, adaptive)
+            context, context_stats = traced_build_context(
+                docs, self.context_tokens, self.model)
+            if stream:
+                tokens = StreamedResponse(atraced_stream(
+                    self.prompt, self.llm, context, question))
+            else:
+                tokens = StreamedResponse(_aiter_one(atraced_generate(
+                    self.prompt, self.llm, context, question)))
+            async for token in tokens:
+                yield token
+            response = tokens.text
+
+        if self.answer_cache:
+            await asyncio.to_thread(self.answer_cache.put, cache_key,
+                                    question, embedding, response)
+        metrics = self._metrics(queries, docs, response, callback,
+                                self._lexical_metrics(lexical_hits,
+                                                      fast_path))
+        metrics.update(tokens.metrics(streamed=stream))
+        metrics.update(context_stats)
+        metrics.update(adaptive)
+        await self._alog_run(self._params(question, strategy, adaptive),
+                             metrics, response, context,
+                             callback.completion_token_details)
+        result.update({"answer": response, "metrics": metrics})
+
+    @traceable(name="Translate and Retrieve")
+    async def _atranslate_and_retrieve(self, question: str, strategy: str,
+                                       lexical_hits,
+                                       adaptive: Optional[dict] = None):
+        """
+        Retrieves the original question while it is translated, and each
+            translated query as soon as it is available: line-based
+            strategies (multi_query, rag_fusion, decompose) stream their
+            output, so the first sub-question is being retrieved while the
+            LLM still writes the next. The vectorstore is opened
+            concurrently if the pipeline has not been warmed up yet. The
+            adaptive strategy waits for the original question's hits and
+            only translates when they are weak, recording the decision in
+            `adaptive`.
+        """
+        original = question + self.game_context
+        fetch_k = self.fetch_k or self.top_k
+        adaptive = {} if adaptive is None else adaptive
+        warm_up = asyncio.ensure_future(self.awarm_up())
+        searches = {}
+
+        async def search(query: str):
+            await warm_up
+            with stage("retrieve"):
+                results = await asearch_with_scores(self.retriever, [query],
+                                                    fetch_k)
+            return results[0]
+
+        def start_search(query: str):
+            if query not in searches:
+                searches[query] = asyncio.ensure_future(search(query))
+
+        start_search(original)
+        expansion_start = None
+        try:
+            if strategy == ADAPTIVE:
+                hits = await searches[original]
+                if not self._escalate(hits, adaptive):
+                    return [original], fuse_results(
+                        [hits], self.top_k, lexical_hits=lexical_hits)
+                strategy = self.adaptive_fallback
+                expansion_start = time.perf_counter()
+            translator = self.translator(strategy)
+            if translator.strategy in QueryTranslator.PROMPTS and \
+                    QueryTranslator.PROMPTS[translator.strategy][1]:
+                queries = []
+                with stage("translate"):
+                    async for query in translator.astream_lines(original):
+                        queries.append(query)
+                        start_search(query)
+            else:
+                queries = await atraced_translate(translator, original)
+                if isinstance(queries, str):
+                    queries = [queries]
+                for query in queries:
+                    start_search(query)
+            results = await asyncio.gather(*searches.values())
+        except BaseException:
+            for task in [warm_up, *searches.values()]:
+                task.cancel()
+            raise
+        if expansion_start is not None:
+            self._record_expansion(time.perf_counter() - expansion_start,
+                                   adaptive)
+        return (_with_original(original, queries),
+                fuse_results(results, self.top_k,
+                             lexical_hits=lexical_hits))
+
+    def answer(self, question: str, strategy: str = None) -> dict:
+        """
+        Runs query translation, retrieval, prompt construction, and response
+            generation for one question, logging metrics and artifacts.
+
+        Args:
+            question (str): The user's question.
+            strategy (str): Query translation strategy. Defaults to the
+                pipeline's strategy.
+
+        Returns:
+            dict: The answer and the metrics logged for the question.
+        """
+        result = {}
+        for _ in self._answer_steps(question, strategy, False, result):
+            pass
+        return result
+
+    async def aanswer(self, question: str, strategy: str = None) -> dict:
+        """
+        Async variant of `answer` built on the LLM's and retriever's async
+            APIs, so many questions can share one event loop. MLflow logging
+            runs in a worker thread.
+        """
+        result = {}
+        async for _ in self._aanswer_steps(question, strategy, False, result):
+            pass
+        return result
+
+    def stream(self, question: str, strategy: str = None) -> "StreamedAnswer":
+        """
+        Like `answer`, but the response is generated with `chain.stream`
+            and its tokens can be iterated over as they arrive.
+
+        Returns:
+            StreamedAnswer: Iterable over the response tokens.
+        """
+        result = {}
+        return StreamedAnswer(
+            self._answer_steps(question, strategy, True, result), result)
+
+    def astream(self, question: str,
+                strategy: str = None) -> "StreamedAnswer":
+        """Async variant of `stream`; iterate with `async for`."""
+        result = {}
+        return StreamedAnswer(
+            self._aanswer_steps(question, strategy, True, result), result)
+
+
+class StreamedAnswer:
+    """
+    Tokens of one answer as they are generated. Once the tokens are
+    exhausted, `result` holds the same answer/metrics dict as
+    `RAGPipeline.answer`.
+    """
+
+    def __init__(self, tokens, result: dict):
+        self._tokens = tokens
+        self.result = result
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._tokens)
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._tokens.__aiter__()
+
+
+def _with_original(original: str, queries: List[str]) -> List[str]:
+    return queries if original in queries else [original] + queries
+
+
+def _iter_one(generate, *args) -> Iterator[str]:
+    yield generate(*args)
+
+
+async def _aiter_one(awaitable) -> AsyncIterator[str]:
+    yield await awaitable
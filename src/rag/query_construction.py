@@ -1,7 +1,12 @@
+from langchain_core.documents import Document
 from langchain_core.prompts import ChatPromptTemplate
+from functools import lru_cache
 from pathlib import Path
+from typing import Callable, List, Optional, Tuple
 import os
 
+import tiktoken
+
 
 PROMPT = """
 You are a helpful assistant that answers questions about game mechanics and rules using only the provided context.
@@ -24,9 +29,212 @@ def get_prompt():
 def format_doc(doc):
     source = doc.metadata.get("source", "unknown")
     source = os.path.basename(source) if is_path(source) else source
-    page = doc.metadata.get("page", "unknown")
-    return f"[{source}, page {page}]\n{doc.page_content.strip()}"
+    if "page" not in doc.metadata and "start_line" in doc.metadata:
+        # Text and Markdown chunks are located by line instead
+        location = (f"lines {doc.metadata['start_line']}-"
+                    f"{doc.metadata.get('end_line', '?')}")
+    else:
+        location = f"page {doc.metadata.get('page', 'unknown')}"
+    return f"[{source}, {location}]\n{doc.page_content.strip()}"
 
 def is_path(s):
     path = Path(s)
     return path.suffix != "" or len(path.parts) > 1
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def _estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+@lru_cache(maxsize=None)
+def token_counter(model: str) -> Callable[[str], int]:
+    """
+    Token counter of the model's tiktoken encoding, or an estimate of about
+    4 characters per token when the encoding cannot be loaded (tiktoken
+    downloads its BPE files on first use, which fails offline).
+    """
+    try:
+        encoding = get_encoding(model)
+    except Exception:
+        return _estimate_tokens
+
+    def count_tokens(text: str) -> int:
+        return len(encoding.encode(text, disallowed_special=()))
+
+    return count_tokens
+
+
+def _overlap(a: str, b: str, min_overlap: int = 20) -> int:
+    """Length of the longest suffix of `a` that is a prefix of `b`."""
+    probe = b[:min_overlap]
+    if len(probe) < min_overlap:
+        return 0
+    i = a.find(probe, max(0, len(a) - len(b)))
+    while i != -1:
+        if b.startswith(a[i:]):
+            return len(a) - i
+        i = a.find(probe, i + 1)
+    return 0
+
+
+def _join(passage: dict, start: Optional[int], text: str) -> bool:
+    """Extends `passage` with an overlapping or adjacent chunk, if it is."""
+    if passage["start"] is not None and start is not None:
+        # Where the passage ends in the source; its text may differ in
+        #   length by the spaces inserted across gaps
+        end = passage["end"]
+        # The splitter strips whitespace at chunk edges, so a gap of a
+        #   character or two still means the chunks are adjacent
+        if not passage["start"] <= start <= end + 2:
+            return False
+        if start > end:
+            passage["text"] += " " + text
+        elif start + len(text) > end:
+            passage["text"] += text[end - start:]
+        passage["end"] = max(end, start + len(text))
+        return True
+    if text in passage["text"]:
+        return True
+    if passage["text"] in text:
+        passage["text"], passage["start"] = text, start
+        passage["end"] = None if start is None else start + len(text)
+        return True
+    overlap = _overlap(passage["text"], text)
+    if overlap:
+        passage["text"] += text[overlap:]
+        return True
+    overlap = _overlap(text, passage["text"])
+    if overlap:
+        passage["text"] = text + passage["text"][overlap:]
+        passage["start"] = start
+        passage["end"] = None if start is None else start + len(
+            passage["text"])
+        return True
+    return False
+
+
+def merge_chunks(docs: List[Document]) -> List[Document]:
+    """
+    Merges chunks of the same source and page that overlap or touch, using
+    their `start_index` offsets (or, for chunks indexed without offsets,
+    the text they share). Passages keep the rank of their best chunk, so
+    the result is still ordered by relevance.
+    """
+    groups = {}
+    for rank, doc in enumerate(docs):
+        key = (doc.metadata.get("source"), doc.metadata.get("page"))
+        groups.setdefault(key, []).append((rank, doc))
+
+    passages = []
+    for members in groups.values():
+        members.sort(key=lambda m: (m[1].metadata.get("start_index") is None,
+                                    m[1].metadata.get("start_index") or 0))
+        merged = []
+        for rank, doc in members:
+            start = doc.metadata.get("start_index")
+            for passage in merged:
+                if _join(passage, start, doc.page_content):
+                    passage["rank"] = min(passage["rank"], rank)
+                    end_line = doc.metadata.get("end_line")
+                    if end_line is not None:
+                        passage["metadata"] = {
+                            **passage["metadata"],
+                            "end_line": max(
+                                passage["metadata"].get("end_line", 0),
+                                end_line)}
+                    break
+            else:
+                merged.append({"rank": rank, "start": start,
+                               "end": (None if start is None
+                                       else start + len(doc.page_content)),
+                               "text": doc.page_content,
+                               "metadata": doc.metadata})
+        passages.extend(merged)
+
+    passages.sort(key=lambda p: p["rank"])
+    return [Document(page_content=p["text"], metadata=p["metadata"])
+            for p in passages]
+
+
+def _shingles(text: str, size: int = 5) -> set:
+    words = text.lower().split()
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size])
+            for i in range(len(words) - size + 1)}
+
+
+def drop_near_duplicates(docs: List[Document],
+                         threshold: float = 0.9) -> List[Document]:
+    """
+    Drops passages whose word 5-grams are mostly (`threshold`) contained in
+    a more relevant passage, or that mostly contain one.
+    """
+    kept, kept_shingles = [], []
+    for doc in docs:
+        shingles = _shingles(doc.page_content)
+        if not any(len(shingles & other) >=
+                   threshold * min(len(shingles), len(other))
+                   for other in kept_shingles):
+            kept.append(doc)
+            kept_shingles.append(shingles)
+    return kept
+
+
+def build_context(docs: List[Document], max_tokens: int = 2000,
+                  model: str = "gpt-4o-mini",
+                  count_tokens: Optional[Callable[[str], int]] = None
+                  ) -> Tuple[str, dict]:
+    """
+    Builds the prompt context from retrieved chunks, ordered by relevance:
+    overlapping chunks are merged, near-duplicate passages dropped, and
+    passages packed best first into `max_tokens` tokens (counted with the
+    model's tiktoken encoding, or estimated when it cannot be loaded; see
+    `token_counter`). Tokens are counted on the merged passages, so the
+    spaces joining chunks across gaps count against the budget. A passage
+    that does not fit is skipped in favour of smaller, less relevant ones;
+    the best passage is truncated rather than dropped.
+
+    Returns:
+        tuple: The context and its stats, including the tokens saved
+            compared to joining every chunk.
+    """
+    if count_tokens is None:
+        count_tokens = token_counter(model)
+
+    separator = "\n\n"
+    naive_tokens = count_tokens(separator.join(format_doc(doc)
+                                               for doc in docs))
+    passages = drop_near_duplicates(merge_chunks(docs))
+
+    parts, used = [], 0
+    separator_tokens = count_tokens(separator)
+    for doc in passages:
+        part = format_doc(doc)
+        tokens = count_tokens(part) + (separator_tokens if parts else 0)
+        if used + tokens <= max_tokens:
+            parts.append(part)
+            used += tokens
+        elif not parts:
+            # Shrink the best passage until it fits the budget on its own
+            while tokens > max_tokens and part:
+                part = part[:int(len(part) * max_tokens / tokens) - 1]
+                tokens = count_tokens(part)
+            parts.append(part)
+            used += tokens
+
+    context = separator.join(parts)
+    return context, {
+        "context_tokens": used,
+        "context_tokens_saved": max(naive_tokens - used, 0),
+        "context_chunks": len(docs),
+        "context_passages": len(parts),
+    }
@@ -1,23 +1,171 @@
 # src/rag/query_translation.py
 
-from typing import List, Union
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import AsyncIterator, List, Optional, Union
 from langchain_core.language_models import BaseLanguageModel
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 
 
+# Bump whenever a translation prompt changes, so cached outputs of the old
+#   prompts are no longer served
+PROMPT_VERSION = 1
+
+DEFAULT_TRANSLATION_CACHE_PATH = os.path.join("data", "cache",
+                                              "translations.sqlite")
+
+
+class TranslationCache:
+    """
+    Two-tier cache of query translations keyed by (strategy, model, prompt
+    version, question): an in-memory LRU of `max_entries` items in front of
+    an optional persistent SQLite tier at `path`.
+
+    The SQLite tier is an LRU too, like EmbeddingCache: an entry's access
+    time is refreshed when it is read from disk, and once the table holds
+    more than `max_stored` rows the least recently used are evicted, down
+    to `evict_to` of `max_stored`. The table is only counted when an upper
+    bound on its size, kept from the rows written, passes `max_stored`.
+    """
+
+    def __init__(self, max_entries: int = 1024, path: Optional[str] = None,
+                 max_stored: int = 100_000, evict_to: float = 0.9):
+        self.max_entries = max_entries
+        self.max_stored = max_stored
+        self.evict_to = evict_to
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            if path != ":memory:":
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS translations ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "last_used REAL NOT NULL DEFAULT 0)")
+            columns = [row[1] for row in self._conn.execute(
+                "PRAGMA table_info(translations)")]
+            if "last_used" not in columns:
+                # Caches written before eviction existed
+                self._conn.execute(
+                    "ALTER TABLE translations ADD COLUMN "
+                    "last_used REAL NOT NULL DEFAULT 0")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS translations_last_used "
+                "ON translations(last_used)")
+            self._conn.commit()
+            self._size_bound = self._count()
+
+    def _count(self) -> int:
+        (count,) = self._conn.execute(
+            "SELECT COUNT(*) FROM translations").fetchone()
+        return count
+
+    @staticmethod
+    def key(strategy: str, model: str, question: str) -> str:
+        return json.dumps([strategy, model, PROMPT_VERSION, question])
+
+    def get(self, key: str) -> Optional[Union[str, List[str]]]:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            if self._conn:
+                row = self._conn.execute(
+                    "SELECT value FROM translations WHERE key = ?",
+                    (key,)).fetchone()
+                if row:
+                    self._conn.execute(
+                        "UPDATE translations SET last_used = ? "
+                        "WHERE key = ?", (time.time(), key))
+                    self._conn.commit()
+                    self._remember(key, json.loads(row[0]))
+                    self.hits += 1
+                    return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: Union[str, List[str]]):
+        with self._lock:
+            self._remember(key, value)
+            if self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO translations "
+                    "(key, value, last_used) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), time.time()))
+                self._size_bound += 1
+                if self._size_bound > self.max_stored:
+                    self._evict()
+                self._conn.commit()
+
+    def _evict(self):
+        count = self._count()
+        if count > self.max_stored:
+            excess = count - int(self.max_stored * self.evict_to)
+            self._conn.execute(
+                "DELETE FROM translations WHERE key IN (SELECT key FROM "
+                "translations ORDER BY last_used ASC LIMIT ?)", (excess,))
+            count -= excess
+        self._size_bound = count
+
+    def _remember(self, key: str, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"translation_cache_hits": self.hits,
+                "translation_cache_misses": self.misses}
+
+
 class QueryTranslator:
-    def __init__(self, llm: BaseLanguageModel, strategy: str = "passthrough"):
+    # strategy -> (prompt builder, whether the output is one query per line)
+    PROMPTS = {
+        "multi_query": ("_multi_query_prompt", True),
+        "rag_fusion": ("_multi_query_prompt", True),
+        "hyde": ("_hyde_prompt", False),
+        "step_back": ("_step_back_prompt", False),
+        "decompose": ("_decompose_prompt", True),
+    }
+
+    def __init__(self, llm: BaseLanguageModel, strategy: str = "passthrough",
+                 cache: Optional[TranslationCache] = None):
         self.llm = llm
         self.strategy = strategy.lower()
         self.output_parser = StrOutputParser()
         self.prefix = "You are an expert helper assistant on the rules and mechanics of tabletop games. "
         self.postfix = " write this postfix: \"Cite references (e.g., document name, chapters, pages, quotes, etc.)\", at the end of the line."
-    
+        self.cache = cache if cache is not None else TranslationCache()
+        self.model = (getattr(llm, "model_name", None)
+                      or getattr(llm, "model", None) or type(llm).__name__)
+        # Prompt chains are built once per translator, not on every call
+        self._chains = {}
+        if self.strategy in self.PROMPTS:
+            self._chain(self.PROMPTS[self.strategy][0])
+
     def translate(self, query: str) -> Union[str, List[str]]:
         if self.strategy == "passthrough":
             return query
-        elif self.strategy == "multi_query":
+        key = TranslationCache.key(self.strategy, self.model, query)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return list(cached) if isinstance(cached, list) else cached
+        result = self._translate(query)
+        self.cache.put(key, result)
+        return result
+
+    def _translate(self, query: str) -> Union[str, List[str]]:
+        if self.strategy == "multi_query":
             return self._multi_query(query)
         elif self.strategy == "rag_fusion":
             return self._multi_query(query)  # Retrieval fusion will use these
@@ -29,39 +177,104 @@ class QueryTranslator:
             return self._decompose_query(query)
         else:
             raise ValueError(f"Unknown strategy: {self.strategy}")
-    
-    def _multi_query(self, query: str) -> List[str]:
-        prompt = ChatPromptTemplate.from_messages([
+
+    async def atranslate(self, query: str) -> Union[str, List[str]]:
+        if self.strategy == "passthrough":
+            return query
+        if self.strategy not in self.PROMPTS:
+            raise ValueError(f"Unknown strategy: {self.strategy}")
+        key = TranslationCache.key(self.strategy, self.model, query)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return list(cached) if isinstance(cached, list) else cached
+        prompt_name, returns_lines = self.PROMPTS[self.strategy]
+        result = await self._chain(prompt_name).ainvoke({"question": query})
+        result = self._lines(result) if returns_lines else result.strip()
+        self.cache.put(key, result)
+        return result
+
+    async def astream_lines(self, query: str) -> AsyncIterator[str]:
+        """
+        Yields the translated queries one at a time, each as soon as its
+        line of the LLM output is complete, so callers can act on the first
+        queries while the rest are generated. Single-output strategies yield
+        their one query.
+        """
+        if self.strategy not in self.PROMPTS or \
+                not self.PROMPTS[self.strategy][1]:
+            result = await self.atranslate(query)
+            for line in ([result] if isinstance(result, str) else result):
+                yield line
+            return
+        key = TranslationCache.key(self.strategy, self.model, query)
+        cached = self.cache.get(key)
+        if cached is not None:
+            for line in cached:
+                yield line
+            return
+        lines, buffer = [], ""
+        chain = self._chain(self.PROMPTS[self.strategy][0])
+        async for chunk in chain.astream({"question": query}):
+            buffer += chunk
+            *complete, buffer = buffer.split("\n")
+            for line in self._lines("\n".join(complete)):
+                lines.append(line)
+                yield line
+        for line in self._lines(buffer):
+            lines.append(line)
+            yield line
+        self.cache.put(key, lines)
+
+    def _chain(self, prompt_name: str):
+        if prompt_name not in self._chains:
+            prompt = getattr(self, prompt_name)()
+            self._chains[prompt_name] = prompt | self.llm | self.output_parser
+        return self._chains[prompt_name]
+
+    @staticmethod
+    def _lines(result: str) -> List[str]:
+        return [q.strip("- ").strip() for q in result.split("\n") if q.strip()]
+
+    def _multi_query_prompt(self) -> ChatPromptTemplate:
+        return ChatPromptTemplate.from_messages([
             ("system", self.prefix + "Reformulate user question(s) for better document retrieval."),
             ("user", "Original question: {question}\nGenerate 4 rephrasings, line by line. For each rephrasing," + self.postfix)
         ])
-        chain = prompt | self.llm | self.output_parser
-        result = chain.invoke({"question": query})
-        return [q.strip("- ").strip() for q in result.split("\n") if q.strip()]
-    
-    def _hyde_query(self, query: str) -> str:
-        prompt = ChatPromptTemplate.from_messages([
+
+    def _hyde_prompt(self) -> ChatPromptTemplate:
+        return ChatPromptTemplate.from_messages([
             ("system", self.prefix + "Given a question, write a hypothetical answer."),
             ("user", "{question}")
         ])
-        chain = prompt | self.llm | self.output_parser
+
+    def _step_back_prompt(self) -> ChatPromptTemplate:
+        return ChatPromptTemplate.from_messages([
+            ("system", self.prefix + "Generalize the question(s)."),
+            ("user", "Specific question: {question}\nWhat is a more general version?" + self.postfix)
+        ])
+
+    def _decompose_prompt(self) -> ChatPromptTemplate:
+        return ChatPromptTemplate.from_messages([
+            ("system", self.prefix + "Break down complex question(s) into sub-questions."),
+            ("user", "Complex question: {question}\nList 3 sub-questions, line by line. For each sub-questions," + self.postfix)
+        ])
+
+    def _multi_query(self, query: str) -> List[str]:
+        chain = self._chain("_multi_query_prompt")
+        result = chain.invoke({"question": query})
+        return self._lines(result)
+    
+    def _hyde_query(self, query: str) -> str:
+        chain = self._chain("_hyde_prompt")
         llm_answer = chain.invoke({"question": query})
         return llm_answer.strip()
     
     def _step_back_query(self, query: str) -> str:
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", self.prefix + "Generalize the question(s)."),
-            ("user", "Specific question: {question}\nWhat is a more general version?" + self.postfix)
-        ])
-        chain = prompt | self.llm | self.output_parser
+        chain = self._chain("_step_back_prompt")
         broader_question = chain.invoke({"question": query})
         return broader_question.strip()
     
     def _decompose_query(self, query: str) -> List[str]:
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", self.prefix + "Break down complex question(s) into sub-questions."),
-            ("user", "Complex question: {question}\nList 3 sub-questions, line by line. For each sub-questions," + self.postfix)
-        ])
-        chain = prompt | self.llm | self.output_parser
+        chain = self._chain("_decompose_prompt")
         result = chain.invoke({"question": query})
-        return [q.strip("- ").strip() for q in result.split("\n") if q.strip()]
+        return self._lines(result)
@@ -0,0 +1,545 @@
+"""
+rate_limit.py - Process-wide scheduling of OpenAI chat and embedding calls
+
+Every model call made by the pipeline and the indexer goes through the
+RateLimitScheduler of its model, which the whole process shares. Concurrent
+queries and indexing batches then stay under the provider's requests/min
+and tokens/min limits together, instead of each running into 429s on its
+own. Token counts are estimated with tiktoken before a call is sent and
+corrected from the reported usage afterwards. Interactive calls are served
+before bulk ones, and bulk calls leave part of each budget free. Rate-limit
+and transient errors are retried with jittered exponential backoff, during
+which every call to the model pauses.
+
+RateLimitedEmbeddings also coalesces short lists of documents that arrive
+within a few milliseconds of each other into one call. Queries are sent
+right away, so a question never waits for the coalescing window.
+"""
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+)
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+from rag.upload import backoff_delay, is_transient
+
+
+# Priorities; lower values are served first
+INTERACTIVE = 0
+BULK = 1
+
+# (requests, tokens) per minute at OpenAI's first usage tier; model names
+#   are matched by their longest listed prefix, as in MODEL_PRICES
+DEFAULT_LIMITS = {
+    "gpt-4o-mini": (500, 200_000),
+    "gpt-4o": (500, 30_000),
+    "gpt-4.1-nano": (500, 200_000),
+    "gpt-4.1-mini": (500, 200_000),
+    "gpt-4.1": (500, 30_000),
+    "gpt-3.5-turbo": (3_500, 200_000),
+    "text-embedding-3-small": (3_000, 1_000_000),
+    "text-embedding-3-large": (3_000, 1_000_000),
+    "text-embedding-ada-002": (3_000, 1_000_000),
+}
+
+# How often async callers that are not first in line check their turn
+POLL_S = 0.01
+
+
+def estimate_tokens(texts: List[str], model: str) -> int:
+    """Tokens of `texts` for `model`, or about 4 characters per token."""
+    from rag.query_construction import token_counter
+
+    count_tokens = token_counter(model)
+    return sum(count_tokens(text) for text in texts)
+
+
+def is_retryable(error: Exception) -> bool:
+    if is_transient(error):
+        return True
+    # The openai client's connection errors carry no status code
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+class TokenBucket:
+    """`rate` units per `period` seconds, holding at most `rate` units."""
+
+    def __init__(self, rate: float, period: float = 60.0):
+        self.capacity = float(rate)
+        self.fill_rate = rate / period
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available."""
+        self.level = min(self.capacity,
+                         self.level + (now - self.updated) * self.fill_rate)
+        self.updated = now
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.fill_rate
+
+    def take(self, amount: float):
+        # The level goes negative when a call used more than was reserved
+        self.level -= amount
+
+    def give(self, amount: float):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimitScheduler:
+    """
+    Requests/min and tokens/min budgets of one model, shared by its callers.
+
+    Callers wait in one queue ordered by priority, then arrival, and the
+    first in line takes its request and estimated tokens once both buckets
+    hold enough. BULK calls also leave `bulk_reserve` of each bucket for
+    INTERACTIVE ones. A limit of None is not enforced. A call larger than a
+    whole bucket waits for the bucket to be full.
+
+    `call` and `acall` retry rate-limit and transient errors up to
+    `max_retries` times, waiting `backoff * 2**attempt` seconds (capped at
+    `max_backoff`) plus as much random jitter, or the Retry-After the error
+    asks for if longer. After a 429 every caller waits as long.
+    """
+
+    def __init__(self, model: str = "",
+                 requests_per_min: Optional[float] = None,
+                 tokens_per_min: Optional[float] = None,
+                 period: float = 60.0, bulk_reserve: float = 0.1,
+                 max_retries: int = 6, backoff: float = 0.5,
+                 max_backoff: float = 30.0):
+        self.model = model
+        self.requests = (TokenBucket(requests_per_min, period)
+                         if requests_per_min else None)
+        self.tokens = (TokenBucket(tokens_per_min, period)
+                       if tokens_per_min else None)
+        self.bulk_reserve = bulk_reserve
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.calls = 0
+        self.retries = 0
+        self.rate_limited = 0
+        # Total seconds spent waiting for a turn, per priority
+        self.waited = {INTERACTIVE: 0.0, BULK: 0.0}
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+
+    def _bucket_wait(self, bucket: Optional[TokenBucket], amount: float,
+                     priority: int, now: float) -> float:
+        if bucket is None:
+            return 0.0
+        reserve = bucket.capacity * self.bulk_reserve \
+            if priority == BULK else 0.0
+        return bucket.wait_time(min(amount + reserve, bucket.capacity), now)
+
+    def _poll(self, ticket, tokens: int) -> Optional[float]:
+        """
+        Takes the budget of a call if it is its turn. Returns 0 when it was
+            taken, else the seconds to wait, or None until another call
+            goes first.
+        """
+        if self._queue[0] != ticket:
+            return None
+        now = time.monotonic()
+        if self._paused_until > now:
+            return self._paused_until - now
+        priority = ticket[0]
+        delay = max(self._bucket_wait(self.requests, 1, priority, now),
+                    self._bucket_wait(self.tokens, tokens, priority, now))
+        if delay > 0:
+            return delay
+        if self.requests is not None:
+            self.requests.take(1)
+        if self.tokens is not None:
+            self.tokens.take(min(tokens, self.tokens.capacity))
+        heapq.heappop(self._queue)
+        self.calls += 1
+        self._cond.notify_all()
+        return 0.0
+
+    def _enqueue(self, priority: int):
+        ticket = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._queue, ticket)
+            # A sleeping caller may no longer be first in line
+            self._cond.notify_all()
+        return ticket
+
+    def _discard(self, ticket):
+        with self._cond:
+            if ticket in self._queue:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+
+    def acquire(self, tokens: int = 0, priority: int = INTERACTIVE):
+        """Blocks until the call can be sent."""
+        start = time.monotonic()
+        ticket = self._enqueue(priority)
+        try:
+            with self._cond:
+                while True:
+                    delay = self._poll(ticket, tokens)
+                    if delay == 0:
+                        break
+                    self._cond.wait(delay)
+        finally:
+            self._discard(ticket)
+        self.waited[priority] += time.monotonic() - start
+
+    async def aacquire(self, tokens: int = 0, priority: int = INTERACTIVE):
+        start = time.monotonic()
+        ticket = self._enqueue(priority)
+        try:
+            while True:
+                with self._cond:
+                    delay = self._poll(ticket, tokens)
+                if delay == 0:
+                    break
+                await asyncio.sleep(delay or POLL_S)
+        finally:
+            self._discard(ticket)
+        self.waited[priority] += time.monotonic() - start
+
+    def settle(self, estimated: int, actual: int):
+        """Corrects the tokens taken for a call by its reported usage."""
+        if self.tokens is None or actual == estimated:
+            return
+        with self._cond:
+            if actual < estimated:
+                self.tokens.give(estimated - actual)
+                self._cond.notify_all()
+            else:
+                self.tokens.take(actual - estimated)
+
+    def retry_delay(self, attempt: int, error: Exception) -> Optional[float]:
+        """
+        Seconds to wait before retrying a call that failed with `error`, or
+            None if it should not be retried.
+        """
+        if attempt >= self.max_retries or not is_retryable(error):
+            return None
+        self.retries += 1
+        delay = backoff_delay(attempt, self.backoff, self.max_backoff, error)
+        status = getattr(error, "status", None) or getattr(
+            error, "status_code", None)
+        if status == 429:
+            self.rate_limited += 1
+            # The budgets were wrong about the provider's; hold every call
+            with self._cond:
+                self._paused_until = max(self._paused_until,
+                                         time.monotonic() + delay)
+        return delay
+
+    def call(self, fn: Callable, *args, tokens: int = 0,
+             priority: int = INTERACTIVE, **kwargs):
+        """Runs `fn(*args, **kwargs)` within the budgets, with retries."""
+        for attempt in itertools.count():
+            self.acquire(tokens, priority)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                delay = self.retry_delay(attempt, e)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+
+    async def acall(self, fn: Callable, *args, tokens: int = 0,
+                    priority: int = INTERACTIVE, **kwargs):
+        for attempt in itertools.count():
+            await self.aacquire(tokens, priority)
+            try:
+                return await fn(*args, **kwargs)
+            except Exception as e:
+                delay = self.retry_delay(attempt, e)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {"rate_limit_calls": self.calls,
+                "rate_limit_retries": self.retries,
+                "rate_limit_429s": self.rate_limited,
+                "rate_limit_interactive_wait_s": self.waited[INTERACTIVE],
+                "rate_limit_bulk_wait_s": self.waited[BULK]}
+
+
+_schedulers: Dict[str, RateLimitScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(model: str, **kwargs) -> RateLimitScheduler:
+    """
+    Returns the process-wide scheduler of `model`, creating it with `kwargs`
+    (see RateLimitScheduler) on first use. Its limits default to the
+    model's DEFAULT_LIMITS entry; models without one are not limited.
+    """
+    with _schedulers_lock:
+        if model not in _schedulers:
+            matches = [name for name in DEFAULT_LIMITS
+                       if model.startswith(name)]
+            if matches:
+                rpm, tpm = DEFAULT_LIMITS[max(matches, key=len)]
+                kwargs.setdefault("requests_per_min", rpm)
+                kwargs.setdefault("tokens_per_min", tpm)
+            _schedulers[model] = RateLimitScheduler(model, **kwargs)
+        return _schedulers[model]
+
+
+class RateLimitedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper sending every call through a RateLimitScheduler
+    (the model's process-wide one by default) at a fixed `priority`.
+
+    Document requests of fewer than `coalesce_below` texts are queued, and
+    a background thread sends what arrived within `coalesce_ms` of the
+    first one (up to `max_batch` texts) as one call, with up to
+    `concurrency` calls in flight. Larger requests and single queries are
+    sent directly.
+    """
+
+    def __init__(self, embeddings: Embeddings,
+                 scheduler: Optional[RateLimitScheduler] = None,
+                 priority: int = INTERACTIVE, coalesce_ms: float = 5.0,
+                 coalesce_below: int = 16, max_batch: int = 256,
+                 concurrency: int = 4):
+        self.embeddings = embeddings
+        # Kept identical to the wrapped model's, as it keys the cache
+        self.model = getattr(embeddings, "model", type(embeddings).__name__)
+        self.scheduler = scheduler or get_scheduler(self.model)
+        self.priority = priority
+        self.coalesce_s = coalesce_ms / 1000
+        self.coalesce_below = coalesce_below if coalesce_ms else 0
+        self.max_batch = max_batch
+        self.concurrency = concurrency
+        self.batches = 0
+        self.coalesced = 0
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._executor = None
+
+    def _tokens(self, texts: List[str]) -> int:
+        return estimate_tokens(texts, self.model)
+
+    def _submit(self, texts: List[str]) -> Future:
+        future = Future()
+        with self._cond:
+            if self._thread is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.concurrency,
+                    thread_name_prefix="embed")
+                self._thread = threading.Thread(
+                    target=self._work, name="embedding-coalescer",
+                    daemon=True)
+                self._thread.start()
+            self._pending.append((texts, future))
+            self._cond.notify()
+        return future
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = time.monotonic() + self.coalesce_s
+                while sum(len(texts) for texts, _ in self._pending) \
+                        < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, size = [], 0
+                while self._pending and (
+                        not batch or size + len(self._pending[0][0])
+                        <= self.max_batch):
+                    texts, future = self._pending.popleft()
+                    batch.append((texts, future))
+                    size += len(texts)
+            self._executor.submit(self._send, batch)
+
+    def _send(self, batch):
+        texts = [text for request, _ in batch for text in request]
+        try:
+            vectors = self.scheduler.call(
+                self.embeddings.embed_documents, texts,
+                tokens=self._tokens(texts), priority=self.priority)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.coalesced += len(batch)
+        start = 0
+        for request, future in batch:
+            future.set_result(vectors[start:start + len(request)])
+            start += len(request)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        if len(texts) < self.coalesce_below:
+            return self._submit(texts).result()
+        return self.scheduler.call(self.embeddings.embed_documents, texts,
+                                   tokens=self._tokens(texts),
+                                   priority=self.priority)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.scheduler.call(self.embeddings.embed_query, text,
+                                   tokens=self._tokens([text]),
+                                   priority=self.priority)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        if len(texts) < self.coalesce_below:
+            return await asyncio.wrap_future(self._submit(texts))
+        return await self.scheduler.acall(
+            self.embeddings.aembed_documents, texts,
+            tokens=self._tokens(texts), priority=self.priority)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.scheduler.acall(
+            self.embeddings.aembed_query, text,
+            tokens=self._tokens([text]), priority=self.priority)
+
+    def stats(self) -> dict:
+        return {"embedding_batches": self.batches,
+                "embedding_requests_coalesced": self.coalesced}
+
+
+class RateLimitedChatModel(BaseChatModel):
+    """
+    Chat model wrapper sending every call of `llm` through a
+    RateLimitScheduler (the model's process-wide one by default) at a fixed
+    `priority`. Each call reserves the estimated prompt tokens plus the
+    model's `max_tokens`, or `max_output_tokens` when it sets none. A
+    stream is only retried before its first chunk.
+
+    Give the wrapped model no callbacks and no retries of its own; attach
+    callbacks to the wrapper.
+    """
+
+    llm: BaseChatModel
+    scheduler: Optional[Any] = None
+    priority: int = INTERACTIVE
+    max_output_tokens: int = 512
+
+    @property
+    def _llm_type(self) -> str:
+        return f"rate-limited-{self.llm._llm_type}"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return self.llm._identifying_params
+
+    @property
+    def model_name(self) -> str:
+        return (getattr(self.llm, "model_name", None)
+                or getattr(self.llm, "model", None) or self.llm._llm_type)
+
+    def _scheduler(self) -> RateLimitScheduler:
+        return self.scheduler or get_scheduler(self.model_name)
+
+    def _tokens(self, messages: List[BaseMessage]) -> int:
+        # Prompt plus a few tokens of formatting per message, and the
+        #   completion tokens the provider counts against the limit
+        prompt = estimate_tokens([str(m.content) for m in messages],
+                                 self.model_name) + 4 * len(messages)
+        return prompt + (getattr(self.llm, "max_tokens", None)
+                         or self.max_output_tokens)
+
+    def _settle(self, scheduler, tokens: int, message):
+        usage = getattr(message, "usage_metadata", None)
+        if usage:
+            scheduler.settle(tokens, usage["total_tokens"])
+
+    def _generate(self, messages: List[BaseMessage],
+                  stop: Optional[List[str]] = None, run_manager=None,
+                  **kwargs: Any) -> ChatResult:
+        scheduler, tokens = self._scheduler(), self._tokens(messages)
+        result = scheduler.call(self.llm._generate, messages, stop=stop,
+                                run_manager=run_manager, tokens=tokens,
+                                priority=self.priority, **kwargs)
+        if result.generations:
+            self._settle(scheduler, tokens, result.generations[0].message)
+        return result
+
+    async def _agenerate(self, messages: List[BaseMessage],
+                         stop: Optional[List[str]] = None, run_manager=None,
+                         **kwargs: Any) -> ChatResult:
+        scheduler, tokens = self._scheduler(), self._tokens(messages)
+        result = await scheduler.acall(
+            self.llm._agenerate, messages, stop=stop,
+            run_manager=run_manager, tokens=tokens, priority=self.priority,
+            **kwargs)
+        if result.generations:
+            self._settle(scheduler, tokens, result.generations[0].message)
+        return result
+
+    def _stream(self, messages: List[BaseMessage],
+                stop: Optional[List[str]] = None, run_manager=None,
+                **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        scheduler, tokens = self._scheduler(), self._tokens(messages)
+        for attempt in itertools.count():
+            scheduler.acquire(tokens, self.priority)
+            started = False
+            try:
+                for chunk in self.llm._stream(messages, stop=stop,
+                                              run_manager=run_manager,
+                                              **kwargs):
+                    started = True
+                    self._settle(scheduler, tokens, chunk.message)
+                    yield chunk
+                return
+            except Exception as e:
+                delay = None if started else scheduler.retry_delay(attempt,
+                                                                   e)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+
+    async def _astream(self, messages: List[BaseMessage],
+                       stop: Optional[List[str]] = None, run_manager=None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        scheduler, tokens = self._scheduler(), self._tokens(messages)
+        for attempt in itertools.count():
+            await scheduler.aacquire(tokens, self.priority)
+            started = False
+            try:
+                async for chunk in self.llm._astream(
+                        messages, stop=stop, run_manager=run_manager,
+                        **kwargs):
+                    started = True
+                    self._settle(scheduler, tokens, chunk.message)
+                    yield chunk
+                return
+            except Exception as e:
+                delay = None if started else scheduler.retry_delay(attempt,
+                                                                   e)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return self._scheduler().stats()
@@ -1,24 +1,168 @@
-from typing import List
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple
 from langchain_core.documents import Document
 
 
-def retrieve_documents(retriever, queries: List[str], top_k: int = 4) -> List[Document]:
+ScoredDocs = List[Tuple[Document, Optional[float]]]
+
+
+def doc_key(doc: Document) -> str:
+    """
+    Stable identity of a chunk: its indexed chunk ID when present, else the
+    vectorstore ID, else a hash of its content.
+    """
+    key = doc.metadata.get("chunk_id") or getattr(doc, "id", None)
+    if key:
+        return key
+    return hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+
+
+def get_documents(vectorstore, ids: List[str]) -> List[Document]:
+    """
+    The stored chunks of `ids`, in that order, skipping unknown IDs.
+    LangChain's Pinecone store does not implement `get_by_ids`, so its
+    index is fetched from directly.
+    """
+    if not ids:
+        return []
+    text_key = getattr(vectorstore, "_text_key", None)
+    index = getattr(vectorstore, "_index", None)
+    if text_key is not None and index is not None:
+        response = index.fetch(ids=ids, namespace=vectorstore._namespace)
+        vectors = (response.get("vectors") if isinstance(response, dict)
+                   else response.vectors) or {}
+        docs = []
+        for _id in ids:
+            if _id not in vectors:
+                continue
+            vector = vectors[_id]
+            metadata = dict((vector.get("metadata")
+                             if isinstance(vector, dict)
+                             else vector.metadata) or {})
+            docs.append(Document(page_content=metadata.pop(text_key, ""),
+                                 metadata=metadata, id=_id))
+        return docs
+    found = {doc.id: doc for doc in vectorstore.get_by_ids(ids)}
+    return [found[_id] for _id in ids if _id in found]
+
+
+def _scored_vectorstore(retriever):
+    """The retriever's vectorstore if scores can be fetched from it."""
+    vectorstore = getattr(retriever, "vectorstore", None)
+    if vectorstore is None or \
+            getattr(retriever, "search_type", "similarity") != "similarity":
+        return None
+    return vectorstore
+
+
+def _scored_search(vectorstore, query: str, k: int) -> ScoredDocs:
+    try:
+        return vectorstore.similarity_search_with_relevance_scores(query, k=k)
+    except NotImplementedError:
+        # Stores without a relevance score function still contribute ranks
+        return [(doc, None) for doc in vectorstore.similarity_search(query,
+                                                                     k=k)]
+
+
+async def _ascored_search(vectorstore, query: str, k: int) -> ScoredDocs:
+    try:
+        return await vectorstore.asimilarity_search_with_relevance_scores(
+            query, k=k)
+    except NotImplementedError:
+        return [(doc, None) for doc in
+                await vectorstore.asimilarity_search(query, k=k)]
+
+
+def search_with_scores(retriever, queries: List[str],
+                       fetch_k: int) -> List[ScoredDocs]:
     """
-    Supports single or multi-query retrieval using retriever.invoke() or retriever.batch().
-    Deduplicates and limits to top_k.
+    Fetches `fetch_k` hits per query with their relevance scores, running
+    the queries concurrently. Falls back to `retriever.batch()` (without
+    scores) for retrievers that are not backed by a vectorstore.
     """
+    vectorstore = _scored_vectorstore(retriever)
+    if vectorstore is None:
+        return [[(doc, None) for doc in docs]
+                for docs in retriever.batch(queries)]
+    if hasattr(vectorstore, "batch_similarity_search_with_score"):
+        return vectorstore.batch_similarity_search_with_score(queries,
+                                                              fetch_k)
     if len(queries) == 1:
-        docs = retriever.invoke(queries[0])
-    else:
-        all_results = retriever.batch(queries)
-        docs = [doc for result in all_results for doc in result]
-
-    # Optional deduplication by content
-    seen = set()
-    unique_docs = []
-    for doc in docs:
-        if doc.page_content not in seen:
-            unique_docs.append(doc)
-            seen.add(doc.page_content)
-
-    return unique_docs[:top_k]
+        return [_scored_search(vectorstore, queries[0], fetch_k)]
+    with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+        return list(executor.map(
+            lambda q: _scored_search(vectorstore, q, fetch_k), queries))
+
+
+async def asearch_with_scores(retriever, queries: List[str],
+                              fetch_k: int) -> List[ScoredDocs]:
+    vectorstore = _scored_vectorstore(retriever)
+    if vectorstore is None:
+        return [[(doc, None) for doc in docs]
+                for docs in await retriever.abatch(queries)]
+    if hasattr(vectorstore, "batch_similarity_search_with_score"):
+        return await asyncio.to_thread(
+            vectorstore.batch_similarity_search_with_score, queries, fetch_k)
+    return list(await asyncio.gather(*(
+        _ascored_search(vectorstore, q, fetch_k) for q in queries)))
+
+
+def reciprocal_rank_fusion(results: Sequence[ScoredDocs],
+                           rrf_k: int = 60) -> List[Document]:
+    """
+    Merges ranked lists with reciprocal rank fusion: a chunk scores
+    sum(1 / (rrf_k + rank)) over the lists it appears in, with its best
+    vector score breaking ties. Runs in O(total hits); chunks are matched by
+    `doc_key`, never by comparing their text.
+    """
+    fused = {}
+    for hits in results:
+        for rank, (doc, score) in enumerate(hits, start=1):
+            key = doc_key(doc)
+            entry = fused.get(key)
+            if entry is None:
+                entry = fused[key] = [0.0, float("-inf"), doc]
+            entry[0] += 1.0 / (rrf_k + rank)
+            if score is not None and score > entry[1]:
+                entry[1] = score
+
+    ranked = sorted(fused.values(), key=lambda e: (e[0], e[1]), reverse=True)
+    docs = []
+    for rrf_score, score, doc in ranked:
+        doc.metadata["rrf_score"] = rrf_score
+        if score != float("-inf"):
+            doc.metadata["score"] = score
+        docs.append(doc)
+    return docs
+
+
+def fuse_results(results: List[ScoredDocs], top_k: int, rrf_k: int = 60,
+                 lexical_hits: Optional[ScoredDocs] = None
+                 ) -> List[Document]:
+    """
+    The best `top_k` chunks of the fused vector result lists, with
+    `lexical_hits` fused in as one more ranked list.
+    """
+    if lexical_hits is not None:
+        # BM25 scores are not comparable to vector scores, so the lexical
+        #   list only contributes ranks to the fusion
+        results = list(results) + [[(doc, None) for doc, _ in lexical_hits]]
+    return reciprocal_rank_fusion(results, rrf_k)[:top_k]
+
+
+def retrieve_documents(retriever, queries: List[str], top_k: int = 4,
+                       fetch_k: Optional[int] = None, rrf_k: int = 60,
+                       lexical_hits: Optional[ScoredDocs] = None
+                       ) -> List[Document]:
+    """
+    Supports single or multi-query retrieval. Each query fetches `fetch_k`
+    scored hits (default: top_k), the ranked lists are merged with
+    reciprocal rank fusion and deduplicated by chunk ID, and the best top_k
+    are returned. `lexical_hits` (e.g. BM25 results) are fused in as one
+    more ranked list.
+    """
+    results = search_with_scores(retriever, queries, fetch_k or top_k)
+    return fuse_results(results, top_k, rrf_k, lexical_hits)
+
@@ -0,0 +1,180 @@
+"""
+server.py - Query server that keeps RAG pipelines warm
+
+Answers questions over stdin/stdout JSON lines or a minimal local HTTP
+endpoint. Requests are handled on an asyncio event loop, so many questions
+can be in flight at once while each namespace's pipeline is built only once.
+"""
+import sys
+import json
+import time
+import asyncio
+import contextlib
+from typing import Callable, Iterable, Optional
+
+
+class PipelineRegistry:
+    """
+    Builds one pipeline per namespace on first use and reuses it. With
+    `strategies`, requests naming any other strategy are rejected.
+    """
+
+    def __init__(self, factory: Callable,
+                 strategies: Optional[Iterable[str]] = None):
+        self._factory = factory
+        self.strategies = (frozenset(strategies) if strategies is not None
+                           else None)
+        self._pipelines = {}
+        self._locks = {}
+
+    async def get(self, namespace: str):
+        lock = self._locks.setdefault(namespace, asyncio.Lock())
+        async with lock:
+            if namespace not in self._pipelines:
+                self._pipelines[namespace] = await asyncio.to_thread(
+                    self._factory, namespace)
+        return self._pipelines[namespace]
+
+    @property
+    def namespaces(self):
+        return list(self._pipelines)
+
+
+async def handle_request(registry: PipelineRegistry, request: dict,
+                         default_namespace: Optional[str],
+                         semaphore: Optional[asyncio.Semaphore] = None
+                         ) -> dict:
+    """
+    Answers one {question, namespace?, strategy?, id?} request.
+
+    Returns:
+        dict: The answer with its latency and metrics, or an error message.
+    """
+    start = time.perf_counter()
+    reply = {"id": None}
+    try:
+        if not isinstance(request, dict):
+            raise ValueError("Request must be a JSON object")
+        reply["id"] = request.get("id")
+        question = request.get("question")
+        namespace = request.get("namespace") or default_namespace
+        strategy = request.get("strategy")
+        if not question or not namespace:
+            raise ValueError("'question' and 'namespace' are required")
+        if strategy and registry.strategies is not None and \
+                strategy not in registry.strategies:
+            raise ValueError(f"Unknown strategy: {strategy}")
+        async with semaphore or contextlib.nullcontext():
+            pipeline = await registry.get(namespace)
+            result = await pipeline.aanswer(question, strategy)
+        reply.update(result)
+    except Exception as e:
+        reply["error"] = f"{type(e).__name__}: {e}"
+    reply["latency_s"] = round(time.perf_counter() - start, 4)
+    return reply
+
+
+async def serve_stdio(registry: PipelineRegistry,
+                      default_namespace: Optional[str] = None,
+                      max_concurrency: int = 8):
+    """
+    Reads one JSON request per line from stdin and writes one JSON reply per
+    line to stdout, in completion order. Replies echo the request's `id`.
+    Anything else printed while serving goes to stderr, so diagnostics
+    never corrupt the replies.
+    """
+    with contextlib.redirect_stdout(sys.stderr):
+        await _serve_stdio(registry, default_namespace, max_concurrency,
+                           sys.__stdout__)
+
+
+async def _serve_stdio(registry: PipelineRegistry,
+                       default_namespace: Optional[str],
+                       max_concurrency: int, out):
+    semaphore = asyncio.Semaphore(max_concurrency)
+    tasks = set()
+
+    async def answer(line: str):
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            reply = {"id": None, "error": f"Invalid JSON: {e}"}
+        else:
+            reply = await handle_request(registry, request,
+                                         default_namespace, semaphore)
+        out.write(json.dumps(reply) + "\n")
+        out.flush()
+
+    while True:
+        line = await asyncio.to_thread(sys.stdin.readline)
+        if not line:
+            break
+        if not line.strip():
+            continue
+        task = asyncio.create_task(answer(line))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+
+
+async def _write_http(writer, status: int, payload: dict):
+    reasons = {200: "OK", 400: "Bad Request", 404: "Not Found"}
+    body = json.dumps(payload).encode("utf-8")
+    writer.write(
+        f"HTTP/1.1 {status} {reasons.get(status, '')}\r\n"
+        f"Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: close\r\n\r\n".encode("ascii") + body)
+    await writer.drain()
+    writer.close()
+
+
+async def serve_http(registry: PipelineRegistry,
+                     default_namespace: Optional[str] = None,
+                     host: str = "127.0.0.1", port: int = 8000,
+                     max_concurrency: int = 8):
+    """
+    Serves `POST /ask` with a JSON request body and `GET /health`.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def handle(reader, writer):
+        try:
+            method, path, _ = (await reader.readline()).decode().split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                key, _, value = line.decode().partition(":")
+                headers[key.strip().lower()] = value.strip()
+            body = await reader.readexactly(
+                int(headers.get("content-length", 0)))
+        except (ValueError, asyncio.IncompleteReadError):
+            await _write_http(writer, 400, {"error": "Malformed request"})
+            return
+
+        if method == "GET" and path == "/health":
+            await _write_http(writer, 200, {
+                "status": "ok", "namespaces": registry.namespaces})
+        elif method == "POST" and path == "/ask":
+            try:
+                request = json.loads(body or b"{}")
+            except json.JSONDecodeError as e:
+                await _write_http(writer, 400, {"error": f"Invalid JSON: {e}"})
+                return
+            if not isinstance(request, dict):
+                await _write_http(writer, 400, {
+                    "error": "Request must be a JSON object"})
+                return
+            reply = await handle_request(registry, request,
+                                         default_namespace, semaphore)
+            await _write_http(writer, 200, reply)
+        else:
+            await _write_http(writer, 404, {"error": "Not found"})
+
+    server = await asyncio.start_server(handle, host, port)
+    print(f"Serving on http://{host}:{port} (POST /ask)", file=sys.stderr)
+    async with server:
+        await server.serve_forever()
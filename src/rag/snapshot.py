@@ -0,0 +1,368 @@
+"""
+snapshot.py - Portable single-file snapshots of a namespace's index
+
+A snapshot holds the IDs, vectors, texts and metadata of every chunk of a
+namespace, whichever backend it was exported from, so it can be loaded
+into any backend without re-parsing or re-embedding. The file is laid out
+in columns:
+
+    magic           b"RAGSNAP1", padded to 64 bytes
+    vectors         (N, dim) little-endian float32, starting at byte 64
+    texts           UTF-8 chunk texts, concatenated
+    offsets         N + 1 little-endian uint64 byte offsets into texts
+    table           JSON {"ids": [...], "metadatas": [...]}
+    footer          JSON with the section offsets, the namespace, the
+                    exporting backend and its index manifest
+    footer length   little-endian uint64, then the magic again
+
+The vectors are aligned for np.memmap, so reading them copies nothing.
+The footer is written last, so exports stream rows straight to disk.
+"""
+import os
+import json
+import mmap
+import time
+import shutil
+import struct
+import tempfile
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from rag.indexing import chroma_path, local_store_path
+from rag.lexical import BM25Index, lexical_index_path
+from rag.local_store import LocalVectorStore
+from rag.manifest import IndexManifest, manifest_path
+from rag.upload import PineconeUploader
+
+
+MAGIC = b"RAGSNAP1"
+FORMAT_VERSION = 1
+VECTORS_OFFSET = 64
+TRAILER = struct.Struct("<Q8s")
+# Rows per backend request; Pinecone upserts are capped at 2 MB
+DEFAULT_BATCH_SIZES = {"local": 4096, "chroma": 1000, "pinecone": 100}
+
+Batch = Tuple[List[str], np.ndarray, List[str], List[dict]]
+
+
+class SnapshotWriter:
+    """
+    Writes a snapshot from (ids, vectors, texts, metadatas) batches. Vectors
+    go straight to the file and texts to a temporary file; the snapshot
+    replaces `path` when it is closed.
+    """
+
+    def __init__(self, path: str, **info):
+        self.path = path
+        self.info = info
+        self.count = 0
+        self.dim = None
+        self._offsets = [0]
+        self._ids, self._metadatas = [], []
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path + ".tmp", "wb")
+        self._file.write(MAGIC.ljust(VECTORS_OFFSET, b"\0"))
+        self._texts = tempfile.TemporaryFile(dir=directory)
+
+    def write(self, ids: List[str], vectors, texts: List[str],
+              metadatas: List[dict]):
+        vectors = np.ascontiguousarray(vectors, dtype="<f4")
+        if len(ids) == 0:
+            return
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional vectors, "
+                             f"got {vectors.shape[1]}")
+        self._file.write(vectors.tobytes())
+        for text in texts:
+            data = text.encode("utf-8")
+            self._texts.write(data)
+            self._offsets.append(self._offsets[-1] + len(data))
+        self._ids.extend(ids)
+        self._metadatas.extend(metadatas)
+        self.count += len(ids)
+
+    def close(self):
+        footer = {"format": FORMAT_VERSION, "count": self.count,
+                  "dim": self.dim or 0, "vectors_offset": VECTORS_OFFSET,
+                  **self.info}
+        footer["texts_offset"] = self._file.tell()
+        self._texts.seek(0)
+        shutil.copyfileobj(self._texts, self._file)
+        self._texts.close()
+        # Keep the offsets 8-byte aligned for np.frombuffer
+        self._file.write(b"\0" * (-self._file.tell() % 8))
+        footer["offsets_offset"] = self._file.tell()
+        self._file.write(np.asarray(self._offsets, dtype="<u8").tobytes())
+        footer["table_offset"] = self._file.tell()
+        table = json.dumps({"ids": self._ids, "metadatas": self._metadatas},
+                           separators=(",", ":")).encode("utf-8")
+        self._file.write(table)
+        footer["table_size"] = len(table)
+        data = json.dumps(footer, separators=(",", ":")).encode("utf-8")
+        self._file.write(data)
+        self._file.write(TRAILER.pack(len(data), MAGIC))
+        self._file.close()
+        os.replace(self.path + ".tmp", self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+            return
+        self._file.close()
+        self._texts.close()
+        os.remove(self.path + ".tmp")
+
+
+class Snapshot:
+    """
+    Read access to a snapshot file. `vectors`, `offsets` and the texts are
+    views of the memory-mapped file; a text is only decoded when it is
+    needed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"'{path}' is not an index snapshot")
+            f.seek(-TRAILER.size, os.SEEK_END)
+            length, magic = TRAILER.unpack(f.read(TRAILER.size))
+            if magic != MAGIC:
+                raise ValueError(f"Truncated index snapshot at '{path}'")
+            f.seek(-TRAILER.size - length, os.SEEK_END)
+            self.info = json.loads(f.read(length))
+            if self.info["format"] != FORMAT_VERSION:
+                raise ValueError(
+                    f"Unsupported snapshot format {self.info['format']} "
+                    f"in '{path}'")
+            f.seek(self.info["table_offset"])
+            table = json.loads(f.read(self.info["table_size"]))
+        self.ids = table["ids"]
+        self.metadatas = table["metadatas"]
+        self.count, self.dim = self.info["count"], self.info["dim"]
+        self.namespace = self.info.get("namespace")
+        self.manifest = self.info.get("manifest")
+
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0,
+                               access=mmap.ACCESS_READ)
+        # Both are views of the mapping; neither copies the file
+        self.offsets = np.frombuffer(self._mmap, dtype="<u8",
+                                     count=self.count + 1,
+                                     offset=self.info["offsets_offset"])
+        self._texts = memoryview(self._mmap)[
+            self.info["texts_offset"]:self.info["offsets_offset"]]
+        if self.count:
+            self.vectors = np.memmap(path, dtype="<f4", mode="r",
+                                     offset=self.info["vectors_offset"],
+                                     shape=(self.count, self.dim))
+        else:
+            self.vectors = np.empty((0, self.dim), dtype=np.float32)
+
+    def __len__(self):
+        return self.count
+
+    def text(self, i: int) -> str:
+        return str(self._texts[self.offsets[i]:self.offsets[i + 1]],
+                   "utf-8")
+
+    def batches(self, batch_size: int) -> Iterator[Batch]:
+        for start in range(0, self.count, batch_size):
+            end = min(start + batch_size, self.count)
+            yield (self.ids[start:end], np.asarray(self.vectors[start:end]),
+                   [self.text(i) for i in range(start, end)],
+                   self.metadatas[start:end])
+
+    def close(self):
+        # The mapping cannot be closed while views of it are alive
+        self.vectors = self.offsets = None
+        self._texts.release()
+        self._mmap.close()
+        self._file.close()
+
+
+def _field(obj, name: str):
+    # Pinecone clients return objects; InMemoryIndex returns dicts
+    return obj[name] if isinstance(obj, dict) else getattr(obj, name)
+
+
+def _scalar_metadata(metadata: dict) -> dict:
+    """Chroma and Pinecone reject null metadata values."""
+    return {key: value for key, value in metadata.items()
+            if value is not None}
+
+
+def _open_chroma(persist_dir: str, namespace: str):
+    from langchain_chroma import Chroma
+
+    return Chroma(persist_directory=chroma_path(persist_dir, namespace))
+
+
+def iter_rows(target: str, namespace: str, persist_dir: str,
+              index=None, batch_size: Optional[int] = None,
+              text_key: str = "text") -> Iterator[Batch]:
+    """
+    Yields every chunk of a namespace as (ids, vectors, texts, metadatas)
+    batches. `index` is the Pinecone index client for the Pinecone target.
+    """
+    batch_size = batch_size or DEFAULT_BATCH_SIZES[target]
+    if target == "local":
+        store = LocalVectorStore(local_store_path(persist_dir, namespace),
+                                 None)
+        yield from store.iter_batches(batch_size)
+    elif target == "chroma":
+        store = _open_chroma(persist_dir, namespace)
+        offset = 0
+        while True:
+            page = store.get(limit=batch_size, offset=offset,
+                             include=["embeddings", "documents",
+                                      "metadatas"])
+            if not page["ids"]:
+                return
+            yield (page["ids"], np.asarray(page["embeddings"]),
+                   page["documents"],
+                   [dict(metadata or {}) for metadata in page["metadatas"]])
+            offset += len(page["ids"])
+    elif target == "pinecone":
+        # IDs are listed 100 at a time, and fetched in the same pages
+        for ids in index.list(namespace=namespace):
+            found = _field(index.fetch(ids=ids, namespace=namespace),
+                           "vectors")
+            ids = [_id for _id in ids if _id in found]
+            vectors, texts, metadatas = [], [], []
+            for _id in ids:
+                metadata = dict(_field(found[_id], "metadata") or {})
+                texts.append(metadata.pop(text_key, ""))
+                metadatas.append(metadata)
+                vectors.append(_field(found[_id], "values"))
+            if ids:
+                yield ids, np.asarray(vectors), texts, metadatas
+    else:
+        raise ValueError(f"Unknown target: {target}")
+
+
+def export_namespace(path: str, namespace: str, target: str,
+                     persist_dir: str = os.path.join("data", "vectorstore"),
+                     index=None, batch_size: Optional[int] = None) -> int:
+    """
+    Writes a namespace's chunks, and its index manifest if it has one, to a
+    snapshot at `path`.
+
+    Returns:
+        int: Number of chunks exported.
+    """
+    start = time.perf_counter()
+    if target != "pinecone" and not os.path.isdir(
+            os.path.join(persist_dir, namespace)):
+        raise ValueError(f"No {target} index for namespace '{namespace}' "
+                         f"under '{persist_dir}'")
+    manifest = IndexManifest.load(
+        manifest_path(persist_dir, namespace, target))
+    print(f"Exporting namespace '{namespace}' from {target} to '{path}'...")
+    with SnapshotWriter(path, namespace=namespace, source=target,
+                        created=time.time(),
+                        manifest={"files": manifest.files,
+                                  "index_version": manifest.index_version}
+                        if manifest.files else None) as writer:
+        for batch in iter_rows(target, namespace, persist_dir, index,
+                               batch_size):
+            writer.write(*batch)
+            print(f"\t→ Exported {writer.count} chunks so far...")
+    print(f"Exported {writer.count} chunks ({writer.dim or 0} dims) in "
+          f"{time.perf_counter() - start:.1f}s.")
+    return writer.count
+
+
+def import_namespace(path: str, target: str,
+                     namespace: Optional[str] = None,
+                     persist_dir: str = os.path.join("data", "vectorstore"),
+                     index=None, batch_size: Optional[int] = None,
+                     concurrency: int = 4) -> dict:
+    """
+    Loads a snapshot into a namespace of `target` (the snapshot's own
+    namespace by default) with precomputed vectors, in large batches.
+
+    Chunks are upserted by ID, and chunks the target's manifest lists but
+    the snapshot lacks are deleted, so the namespace ends up matching the
+    snapshot. The target's manifest and BM25 index are rebuilt from the
+    snapshot, and the index version is bumped so cached answers are
+    dropped. Pinecone imports run through PineconeUploader, which retries
+    and resumes an interrupted import.
+
+    Returns:
+        dict: Counts of imported and removed chunks.
+    """
+    start = time.perf_counter()
+    snapshot = Snapshot(path)
+    namespace = namespace or snapshot.namespace
+    if not namespace:
+        raise ValueError("The snapshot names no namespace; pass one")
+    batch_size = batch_size or DEFAULT_BATCH_SIZES[target]
+    print(f"Importing {len(snapshot)} chunks from '{path}' into namespace "
+          f"'{namespace}' ({target})...")
+
+    manifest = IndexManifest.load(
+        manifest_path(persist_dir, namespace, target))
+    stale = {_id for source in manifest.files
+             for _id in manifest.chunk_ids(source)} - set(snapshot.ids)
+    lexical = BM25Index(lexical_index_path(persist_dir, namespace, target))
+    lexical.delete(sorted(stale))
+
+    def batches():
+        for ids, vectors, texts, metadatas in snapshot.batches(batch_size):
+            lexical.add(ids, [Document(page_content=text, metadata=metadata)
+                              for text, metadata in zip(texts, metadatas)])
+            yield ids, vectors, texts, metadatas
+
+    if target == "local":
+        store = LocalVectorStore(local_store_path(persist_dir, namespace),
+                                 None, autopersist=False)
+        for ids, vectors, texts, metadatas in batches():
+            store.add_vectors(vectors, texts, metadatas, ids=ids)
+        store.delete(sorted(stale))
+        store.persist()
+    elif target == "chroma":
+        collection = _open_chroma(persist_dir, namespace)._collection
+        for ids, vectors, texts, metadatas in batches():
+            collection.upsert(ids=ids, embeddings=vectors, documents=texts,
+                              # Chroma accepts None but rejects {}
+                              metadatas=[_scalar_metadata(m) or None
+                                         for m in metadatas])
+            print(f"\t→ Upserted {len(ids)} chunks...")
+        stale_ids = sorted(stale)
+        for i in range(0, len(stale_ids), batch_size):
+            collection.delete(ids=stale_ids[i:i + batch_size])
+    elif target == "pinecone":
+        uploader = PineconeUploader(
+            index=index, embeddings=None, namespace=namespace,
+            concurrency=concurrency,
+            checkpoint_path=os.path.join(os.path.dirname(manifest.path),
+                                         "upload_checkpoint.json"))
+        uploader.upload(
+            (ids, [Document(page_content=text,
+                            metadata=_scalar_metadata(metadata))
+                   for text, metadata in zip(texts, metadatas)],
+             vectors.tolist())
+            for ids, vectors, texts, metadatas in batches())
+        uploader.delete(sorted(stale))
+    else:
+        raise ValueError(f"Unknown target: {target}")
+
+    lexical.save()
+    # Later re-indexes then only embed what changed since the export
+    manifest.files = dict((snapshot.manifest or {}).get("files", {}))
+    manifest.bump_version()
+    manifest.save()
+    stats = {"imported": len(snapshot), "removed": len(stale)}
+    snapshot.close()
+    print(f"Imported {stats['imported']} chunks ({stats['removed']} stale "
+          f"removed) in {time.perf_counter() - start:.1f}s.")
+    return stats
@@ -1,27 +1,92 @@
 # src/rag/tracing.py
 
-from langsmith import traceable
-from src.rag.retrieval import retrieve_documents
-from src.rag.query_construction import format_doc
-from src.rag.generation import generate_response
+import os
+from rag.instrumentation import stage
+from rag.retrieval import retrieve_documents, search_with_scores
+from rag.query_construction import build_context
+from rag.generation import (
+    agenerate_response,
+    astream_response,
+    generate_response,
+    stream_response,
+)
+
+
+def tracing_disabled() -> bool:
+    """Whether LangSmith tracing was switched off (e.g. by --no_tracing)."""
+    return os.getenv("LANGSMITH_TRACING", "").lower() == "false"
+
+
+def traceable(name: str):
+    """
+    LangSmith's `traceable`, or a no-op decorator when tracing is disabled,
+    so untraced runs do not import or call into langsmith.
+    """
+    if tracing_disabled():
+        return lambda fn: fn
+    from langsmith import traceable as langsmith_traceable
+
+    return langsmith_traceable(name=name)
 
 
 @traceable(name="Translate Query")
 def traced_translate(translator, query):
-    return translator.translate(query)
+    with stage("translate"):
+        return translator.translate(query)
 
 
 @traceable(name="Retrieve Documents")
-def traced_retrieve(retriever, queries, top_k=4):
-    return retrieve_documents(retriever, queries, top_k)
+def traced_retrieve(retriever, queries, top_k=4, fetch_k=None,
+                    lexical_hits=None):
+    with stage("retrieve"):
+        return retrieve_documents(retriever, queries, top_k, fetch_k,
+                                  lexical_hits=lexical_hits)
+
+
+@traceable(name="Search With Scores")
+def traced_search(retriever, queries, fetch_k=4):
+    with stage("retrieve"):
+        return search_with_scores(retriever, queries, fetch_k)
+
+
+@traceable(name="Lexical Search")
+def traced_lexical_search(index, question, k, fetch):
+    with stage("lexical_search"):
+        return index.search(question, k, fetch)
 
 
 @traceable(name="Construct Prompt")
-def traced_construct_prompt(docs):
-    context = "\n\n".join(format_doc(doc) for doc in docs)
-    return context
+def traced_build_context(docs, max_tokens=2000, model="gpt-4o-mini"):
+    with stage("construct"):
+        return build_context(docs, max_tokens, model)
 
 
 @traceable(name="Generate Response")
 def traced_generate(prompt, llm, context, question):
-    return generate_response(prompt, llm, context, question)
+    with stage("generate"):
+        return generate_response(prompt, llm, context, question)
+
+
+@traceable(name="Generate Response")
+def traced_stream(prompt, llm, context, question):
+    with stage("generate"):
+        yield from stream_response(prompt, llm, context, question)
+
+
+@traceable(name="Translate Query")
+async def atraced_translate(translator, query):
+    with stage("translate"):
+        return await translator.atranslate(query)
+
+
+@traceable(name="Generate Response")
+async def atraced_generate(prompt, llm, context, question):
+    with stage("generate"):
+        return await agenerate_response(prompt, llm, context, question)
+
+
+@traceable(name="Generate Response")
+async def atraced_stream(prompt, llm, context, question):
+    with stage("generate"):
+        async for token in astream_response(prompt, llm, context, question):
+            yield token
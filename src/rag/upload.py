@@ -0,0 +1,261 @@
+import os
+import json
+import time
+import random
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+def is_transient(error: Exception) -> bool:
+    """Network failures, timeouts, rate limits and 5xx responses."""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    status = getattr(error, "status", None) or getattr(
+        error, "status_code", None)
+    return status in RETRYABLE_STATUS
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds to wait requested by a rate-limit error, if any."""
+    value = getattr(error, "retry_after", None)
+    if value is None:
+        headers = getattr(getattr(error, "response", None), "headers", None)
+        value = headers.get("retry-after") if headers else None
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, backoff: float, max_backoff: float = 30.0,
+                  error: Optional[Exception] = None) -> float:
+    """
+    Seconds to wait before retry `attempt` (from 0): `backoff * 2**attempt`
+    capped at `max_backoff`, plus as much random jitter, or the Retry-After
+    `error` asks for if longer.
+    """
+    delay = min(max_backoff, backoff * (2 ** attempt))
+    delay += random.uniform(0, delay)
+    if error is not None:
+        delay = max(delay, retry_after(error) or 0.0)
+    return delay
+
+
+def open_pinecone_index(index_name: str, api_key: Optional[str] = None):
+    """Returns a Pinecone index client, reused for every batch."""
+    from pinecone import Pinecone
+
+    client = Pinecone(api_key=api_key or os.environ.get("PINECONE_API_KEY"))
+    return client.Index(index_name)
+
+
+class InMemoryIndex:
+    """
+    Local stand-in for a Pinecone index, implementing the subset of the
+    client API used by the uploader. `transient_failures` makes that many
+    upsert calls fail with a retryable error first.
+    """
+
+    def __init__(self, transient_failures: int = 0):
+        self.namespaces = {}
+        self.transient_failures = transient_failures
+        self.upsert_calls = 0
+
+    def upsert(self, vectors, namespace: str = ""):
+        self.upsert_calls += 1
+        if self.transient_failures > 0:
+            self.transient_failures -= 1
+            raise ConnectionError("simulated transient upsert failure")
+        store = self.namespaces.setdefault(namespace, {})
+        for record in vectors:
+            store[record["id"]] = record
+        return {"upserted_count": len(vectors)}
+
+    def delete(self, ids: List[str], namespace: str = ""):
+        store = self.namespaces.get(namespace, {})
+        for _id in ids:
+            store.pop(_id, None)
+        return {}
+
+    def list(self, namespace: str = "", limit: int = 100):
+        """Yields the IDs in a namespace, `limit` at a time."""
+        ids = list(self.namespaces.get(namespace, {}))
+        for i in range(0, len(ids), limit):
+            yield ids[i:i + limit]
+
+    def fetch(self, ids: List[str], namespace: str = ""):
+        store = self.namespaces.get(namespace, {})
+        return {"vectors": {_id: store[_id] for _id in ids if _id in store}}
+
+    def describe_index_stats(self):
+        return {"namespaces": {name: {"vector_count": len(store)}
+                               for name, store in self.namespaces.items()}}
+
+
+class UploadCheckpoint:
+    """
+    Fingerprints of the batches already committed to the index, in order.
+    A re-run after a crash skips a batch only if its fingerprint matches the
+    one recorded at the same position.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.committed = []
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.committed = json.load(f).get("committed", [])
+
+    @staticmethod
+    def fingerprint(ids: List[str]) -> str:
+        return hashlib.sha256("\n".join(ids).encode("utf-8")).hexdigest()[:16]
+
+    def is_committed(self, seq: int, fingerprint: str) -> bool:
+        return seq < len(self.committed) and \
+            self.committed[seq] == fingerprint
+
+    def commit(self, seq: int, fingerprint: str):
+        if self.is_committed(seq, fingerprint):
+            return
+        del self.committed[seq:]
+        self.committed.append(fingerprint)
+        if self.path:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"committed": self.committed}, f)
+            os.replace(tmp_path, self.path)
+
+    def clear(self):
+        self.committed = []
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class PineconeUploader:
+    """
+    Upload engine for Pinecone-compatible indexes.
+
+    A single index client is reused for every batch. Batch N+1 is embedded
+    on the calling thread while up to `concurrency` earlier batches are
+    being upserted, transient errors are retried with jittered exponential
+    backoff, and committed batches are checkpointed so an interrupted run
+    resumes where it stopped.
+    """
+
+    def __init__(self, index, embeddings, namespace: str,
+                 text_key: str = "text", concurrency: int = 4,
+                 max_retries: int = 5, backoff: float = 0.5,
+                 max_backoff: float = 30.0,
+                 checkpoint_path: Optional[str] = None):
+        self.index = index
+        self.embeddings = embeddings
+        self.namespace = namespace
+        self.text_key = text_key
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.checkpoint = UploadCheckpoint(checkpoint_path)
+        self.retries = 0
+
+    def _records(self, ids: List[str], docs: List[Document],
+                 vectors=None) -> List[dict]:
+        if vectors is None:
+            vectors = self.embeddings.embed_documents(
+                [doc.page_content for doc in docs])
+        return [{
+            "id": _id,
+            "values": vector,
+            "metadata": {**doc.metadata, self.text_key: doc.page_content},
+        } for _id, doc, vector in zip(ids, docs, vectors)]
+
+    def _with_retries(self, call, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return call(*args, **kwargs)
+            except Exception as e:
+                if attempt == self.max_retries or not is_transient(e):
+                    raise
+                self.retries += 1
+                time.sleep(backoff_delay(attempt, self.backoff,
+                                         self.max_backoff, e))
+
+    def _upsert(self, records: List[dict]) -> int:
+        self._with_retries(self.index.upsert, vectors=records,
+                           namespace=self.namespace)
+        return len(records)
+
+    def upload(self,
+               batches: Iterable[Tuple[List[str], List[Document]]],
+               on_commit: Optional[Callable[[int], None]] = None) -> dict:
+        """
+        Embeds and upserts (ids, documents) batches. Batches of (ids,
+        documents, vectors) carry precomputed vectors, e.g. from a
+        snapshot, and are upserted as they are. `on_commit` is called with
+        the position of each batch once it and every batch before it are
+        stored.
+
+        Returns:
+            dict: Counts of uploaded and resumed (skipped) documents, plus
+                retries and throughput.
+        """
+        stats = {"uploaded": 0, "skipped": 0}
+        start = time.perf_counter()
+        inflight = deque()
+        done = {}
+        next_commit = 0
+
+        def settle(block: bool):
+            nonlocal next_commit
+            while inflight and (block or inflight[0][2].done()):
+                seq, fingerprint, future = inflight.popleft()
+                stats["uploaded"] += future.result()
+                done[seq] = fingerprint
+            # Only a contiguous prefix of batches is recorded as committed
+            while next_commit in done:
+                self.checkpoint.commit(next_commit, done.pop(next_commit))
+                if on_commit:
+                    on_commit(next_commit)
+                next_commit += 1
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for seq, (ids, docs, *vectors) in enumerate(batches):
+                fingerprint = UploadCheckpoint.fingerprint(ids)
+                if self.checkpoint.is_committed(seq, fingerprint):
+                    stats["skipped"] += len(ids)
+                    done[seq] = fingerprint
+                    settle(block=False)
+                    continue
+                records = self._records(ids, docs, *vectors)
+                while len(inflight) >= self.concurrency:
+                    inflight[0][2].result()
+                    settle(block=False)
+                inflight.append((seq, fingerprint,
+                                 executor.submit(self._upsert, records)))
+                settle(block=False)
+                print(f"\t→ Batch {seq + 1} queued "
+                      f"({stats['uploaded']} docs uploaded so far)...")
+            while inflight:
+                settle(block=True)
+
+        self.checkpoint.clear()
+        elapsed = time.perf_counter() - start
+        stats["retries"] = self.retries
+        stats["docs_per_sec"] = stats["uploaded"] / elapsed if elapsed else 0.0
+        print(f"Uploaded {stats['uploaded']} docs "
+              f"({stats['skipped']} resumed from checkpoint) in "
+              f"{elapsed:.1f}s: {stats['docs_per_sec']:.1f} docs/sec.")
+        return stats
+
+    def delete(self, ids: List[str], batch_size: int = 1000):
+        for i in range(0, len(ids), batch_size):
+            self._with_retries(self.index.delete, ids=ids[i:i+batch_size],
+                               namespace=self.namespace)
@@ -0,0 +1,218 @@
+"""
+vectorstore_pool.py - Shared cache of opened per-namespace vectorstores
+
+A process serving many games opens each namespace's vectorstore once and
+keeps it while it is in use. Every store in the pool shares one embeddings
+client (with its on-disk cache) and, for Pinecone, one index connection;
+config/keys.json is read once. Chroma keeps one client per namespace, as
+each namespace directory is its own database. The least recently used
+stores are closed when more than `max_open` are open or, with `max_mb`,
+when their estimated footprint exceeds it.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from rag.config_schema import RulebookConfig
+from rag.embedding_cache import CachedEmbeddings
+from rag.indexing import get_embeddings, load_vectorstore
+from rag.instrumentation import stage
+from rag.local_store import LocalVectorStore
+from rag.upload import open_pinecone_index
+
+from config.config import load_config_from_file
+
+
+def _close(store):
+    """
+    Releases the Chroma client of a store. chromadb keeps every client's
+    system in a process-wide cache, so dropping the store frees nothing.
+    """
+    client = getattr(store, "_client", None)
+    if client is None:
+        return
+    if hasattr(client, "close"):
+        client.close()
+        return
+    # Older chromadb has no close(); stop only this directory's system,
+    #   as clear_system_cache() would drop every namespace's
+    from chromadb.api.shared_system_client import SharedSystemClient
+
+    system = SharedSystemClient._identifier_to_system.pop(
+        client._identifier, None)
+    if system is not None:
+        system.stop()
+
+
+def _dir_size(path: str) -> int:
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            size += os.path.getsize(os.path.join(root, name))
+    return size
+
+
+class VectorStorePool:
+    """
+    LRU cache of vectorstores keyed by namespace, for one backend.
+
+    `get` opens a namespace on first use. Hits count per-question lookups:
+    pipelines `touch` the pool once per question and read the store with
+    `count=False` otherwise.
+    Footprints are estimated when a store is opened: the mapped files of a
+    local store, the SQLite file and HNSW segments of a Chroma directory,
+    and nothing for Pinecone, which holds no vectors in process. Namespaces
+    in `warm` are opened up front.
+    """
+
+    def __init__(self, target: str = "chroma",
+                 persist_dir: str = os.path.join("data", "vectorstore"),
+                 max_open: int = 8, max_mb: Optional[float] = None,
+                 warm: Iterable[str] = (),
+                 config: Optional[RulebookConfig] = None,
+                 embeddings: Optional[CachedEmbeddings] = None):
+        if max_open < 1:
+            raise ValueError("max_open must be at least 1")
+        self.target = target
+        self.persist_dir = persist_dir
+        self.max_open = max_open
+        self.max_mb = max_mb
+        self.opens = 0
+        self.hits = 0
+        self.evictions = 0
+        self._config = config
+        self._embeddings = embeddings
+        self._pinecone_index = None
+        # namespace -> (store, estimated bytes), least recently used first
+        self._stores = OrderedDict()
+        self._lock = threading.Lock()
+        # Opening is slow; per-namespace locks keep it from blocking hits
+        #   on other namespaces while still opening each store only once
+        self._open_locks = {}
+        self.warm_up(warm)
+
+    @property
+    def config(self) -> RulebookConfig:
+        if self._config is None:
+            self._config = load_config_from_file()
+        return self._config
+
+    @property
+    def embeddings(self) -> CachedEmbeddings:
+        if self._embeddings is None:
+            self._embeddings = get_embeddings(self.config.openai_api_key)
+        return self._embeddings
+
+    @property
+    def pinecone_index(self):
+        if self._pinecone_index is None:
+            self._pinecone_index = open_pinecone_index(
+                self.config.pinecone_index_name,
+                self.config.pinecone_api_key)
+        return self._pinecone_index
+
+    def warm_up(self, namespaces: Iterable[str]):
+        for namespace in namespaces:
+            self.get(namespace)
+
+    def is_open(self, namespace: str) -> bool:
+        return namespace in self._stores
+
+    def touch(self, namespace: str) -> bool:
+        """
+        Counts a lookup of the namespace, as a hit if it is open, and marks
+        it most recently used. Returns whether it is open.
+        """
+        return self._lookup(namespace) is not None
+
+    def get(self, namespace: str, count: bool = True):
+        """
+        Returns the namespace's vectorstore, opening it if needed. With
+        `count=False`, finding it open is not counted as a hit.
+        """
+        store = self._lookup(namespace, count)
+        if store is not None:
+            return store
+        with self._lock:
+            open_lock = self._open_locks.setdefault(namespace,
+                                                    threading.Lock())
+        with open_lock:
+            # Another thread may have opened it in the meantime
+            store = self._lookup(namespace, count)
+            if store is not None:
+                return store
+            with stage("vectorstore_load"):
+                store = self._open(namespace)
+            size = self._footprint(namespace, store)
+            with self._lock:
+                self._stores[namespace] = (store, size)
+                self.opens += 1
+                self._evict(keep=namespace)
+        return store
+
+    def _lookup(self, namespace: str, count: bool = True):
+        with self._lock:
+            entry = self._stores.get(namespace)
+            if entry is None:
+                return None
+            self._stores.move_to_end(namespace)
+            if count:
+                self.hits += 1
+            return entry[0]
+
+    def _open(self, namespace: str):
+        # The shared clients are created once, when the first namespace is
+        #   opened
+        with self._lock:
+            embeddings = self.embeddings
+            pinecone_index = self.pinecone_index \
+                if self.target == "pinecone" else None
+        return load_vectorstore(namespace, persist_dir=self.persist_dir,
+                                target=self.target, embeddings=embeddings,
+                                pinecone_index=pinecone_index)
+
+    def _footprint(self, namespace: str, store) -> int:
+        if isinstance(store, LocalVectorStore):
+            # Everything in the directory is memory-mapped or loaded
+            return _dir_size(store.persist_directory)
+        if self.target == "pinecone":
+            return 0
+        path = os.path.join(self.persist_dir, namespace)
+        if not os.path.isdir(path):
+            return 0
+        size = 0
+        for entry in os.scandir(path):
+            if entry.name == "chroma.sqlite3":
+                size += entry.stat().st_size
+            # HNSW segment directories are named by UUID; skip the local
+            #   store, lexical index and manifests kept alongside
+            elif entry.is_dir() and len(entry.name) == 36:
+                size += _dir_size(entry.path)
+        return size
+
+    def _evict(self, keep: str):
+        def over_limit() -> bool:
+            if len(self._stores) > self.max_open:
+                return True
+            return self.max_mb is not None and \
+                self.total_bytes() > self.max_mb * 2**20
+
+        while len(self._stores) > 1 and over_limit():
+            namespace = next(iter(self._stores))
+            if namespace == keep:
+                break
+            store, _ = self._stores.pop(namespace)
+            _close(store)
+            self.evictions += 1
+
+    def total_bytes(self) -> int:
+        return sum(size for _, size in self._stores.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"vectorstore_pool_open": len(self._stores),
+                    "vectorstore_pool_mb": self.total_bytes() / 2**20,
+                    "vectorstore_pool_opens": self.opens,
+                    "vectorstore_pool_hits": self.hits,
+                    "vectorstore_pool_evictions": self.evictions}
@@ -0,0 +1,158 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from rag.fakes import (
+    FakeChatModel,
+    FakeEmbeddings,
+    FakeRateLimitError,
+    FakeRateLimits,
+)
+from rag.rate_limit import (
+    BULK,
+    INTERACTIVE,
+    RateLimitedChatModel,
+    RateLimitedEmbeddings,
+    RateLimitScheduler,
+)
+
+# A "minute" of the fake limits and schedulers, so tests take seconds
+PERIOD = 0.5
+
+
+def embed_concurrently(embeddings, workers: int = 4, batches: int = 3):
+    errors = []
+
+    def work(worker: int):
+        try:
+            for batch in range(batches):
+                embeddings.embed_documents(
+                    [f"chunk {worker} {batch} {i} about turn order"
+                     for i in range(20)])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(worker,))
+               for worker in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def test_retries_429s_until_accepted():
+    limits = FakeRateLimits(requests_per_min=3, period=PERIOD)
+    # No budgets of its own: every call past the limit is rejected first
+    scheduler = RateLimitScheduler(backoff=0.01)
+    embeddings = RateLimitedEmbeddings(FakeEmbeddings(dim=8, limits=limits),
+                                       scheduler, coalesce_ms=0)
+    vectors = [embeddings.embed_query(f"question {i}") for i in range(8)]
+    assert len(vectors) == 8
+    assert limits.accepted == 8
+    assert limits.rejected > 0
+    assert scheduler.rate_limited == limits.rejected
+    assert scheduler.retries == limits.rejected
+
+
+def test_gives_up_after_max_retries():
+    scheduler = RateLimitScheduler(max_retries=2, backoff=0.01)
+
+    def rejected():
+        raise FakeRateLimitError("Rate limit reached for requests", 0.01)
+
+    with pytest.raises(FakeRateLimitError):
+        scheduler.call(rejected)
+    assert scheduler.retries == 2
+    assert scheduler.rate_limited == 2
+
+
+def test_non_retryable_errors_are_raised_at_once():
+    scheduler = RateLimitScheduler(backoff=0.01)
+
+    def fail():
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        scheduler.call(fail)
+    assert scheduler.retries == 0
+
+
+def test_shared_budget_avoids_429s():
+    limits = FakeRateLimits(requests_per_min=10, tokens_per_min=5_000,
+                            period=PERIOD)
+    scheduler = RateLimitScheduler(requests_per_min=10, tokens_per_min=5_000,
+                                   period=PERIOD, backoff=0.01)
+    embeddings = RateLimitedEmbeddings(FakeEmbeddings(dim=8, limits=limits),
+                                       scheduler, priority=BULK,
+                                       coalesce_ms=0)
+    assert embed_concurrently(embeddings) == []
+    assert limits.accepted == 12
+    assert limits.rejected == 0
+    assert scheduler.rate_limited == 0
+
+
+def test_interactive_calls_go_before_bulk():
+    scheduler = RateLimitScheduler(requests_per_min=2, period=PERIOD)
+    scheduler.acquire(priority=BULK)
+    scheduler.acquire(priority=BULK)
+    order = []
+
+    def acquire(priority: int):
+        scheduler.acquire(priority=priority)
+        order.append(priority)
+
+    bulk = threading.Thread(target=acquire, args=(BULK,))
+    bulk.start()
+    time.sleep(0.02)
+    interactive = threading.Thread(target=acquire, args=(INTERACTIVE,))
+    interactive.start()
+    bulk.join()
+    interactive.join()
+    assert order == [INTERACTIVE, BULK]
+
+
+def test_queries_skip_the_coalescing_window():
+    embeddings = RateLimitedEmbeddings(FakeEmbeddings(dim=8),
+                                       RateLimitScheduler(), coalesce_ms=500)
+    start = time.perf_counter()
+    embeddings.embed_query("how does grappling work?")
+    asyncio.run(embeddings.aembed_query("how does grappling work?"))
+    assert time.perf_counter() - start < 0.25
+
+
+def test_small_document_requests_are_coalesced():
+    fake = FakeEmbeddings(dim=8)
+    embeddings = RateLimitedEmbeddings(fake, RateLimitScheduler(),
+                                       coalesce_ms=50)
+    results = {}
+
+    def embed(i: int):
+        results[i] = embeddings.embed_documents([f"chunk {i}"])
+
+    threads = [threading.Thread(target=embed, args=(i,)) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert fake.calls < 5
+    assert results[3] == fake.embed_documents(["chunk 3"])
+
+
+def test_chat_model_retries_and_settles_usage():
+    limits = FakeRateLimits(requests_per_min=2, period=PERIOD)
+    scheduler = RateLimitScheduler(requests_per_min=100,
+                                   tokens_per_min=100_000, period=PERIOD,
+                                   backoff=0.01)
+    llm = RateLimitedChatModel(llm=FakeChatModel(answer_words=5,
+                                                 limits=limits),
+                               scheduler=scheduler)
+    answers = [llm.invoke(f"Question {i}: how does grappling work?")
+               for i in range(4)]
+    assert all(answer.content for answer in answers)
+    assert limits.accepted == 4
+    assert scheduler.rate_limited == limits.rejected > 0
+    # Reserved output tokens that were not used are given back
+    assert scheduler.tokens.level > 100_000 - 4 * llm.max_output_tokens
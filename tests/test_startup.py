@@ -0,0 +1,45 @@
+import importlib.util
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_bench():
+    spec = importlib.util.spec_from_file_location(
+        "bench", os.path.join(ROOT, "scripts", "bench.py"))
+    bench = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bench)
+    return bench
+
+
+def loaded_modules(*modules):
+    """Top-level modules loaded by importing `modules` in a fresh process."""
+    probe = (f"import sys; import {', '.join(modules)}; "
+             "print('\\n'.join(sorted({m.split('.')[0] "
+             "for m in sys.modules})))")
+    env = {**os.environ,
+           "PYTHONPATH": os.pathsep.join([ROOT, os.path.join(ROOT, "src")])}
+    return set(subprocess.run([sys.executable, "-c", probe], cwd=ROOT,
+                              env=env, check=True, capture_output=True,
+                              text=True).stdout.split())
+
+
+def test_imports_load_no_backend():
+    lazy = set(load_bench().LAZY_MODULES)
+    assert not lazy & loaded_modules("main", "rag.pipeline")
+
+
+def test_usage_error_does_not_read_config(tmp_path):
+    # Run from a directory without config/keys.json
+    os.makedirs(tmp_path / "config")
+    with open(tmp_path / "config" / "supported_games.json", "w") as f:
+        f.write('{"Dungeons & Dragons": {"abbr": "dnd"}}')
+    result = subprocess.run(
+        [sys.executable, os.path.join(ROOT, "main.py"), "-n", "dnd"],
+        cwd=tmp_path, capture_output=True, text=True,
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(
+            [ROOT, os.path.join(ROOT, "src")])})
+    assert result.returncode == 2
+    assert "--question and --namespace are required" in result.stderr
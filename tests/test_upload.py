@@ -0,0 +1,100 @@
+import pytest
+from langchain_core.documents import Document
+
+from rag.fakes import FakeEmbeddings
+from rag.upload import InMemoryIndex, PineconeUploader, UploadCheckpoint
+
+
+class FailingIndex(InMemoryIndex):
+    """Fails every upsert from the `fail_at`-th one on, without retries."""
+
+    def __init__(self, fail_at: int):
+        super().__init__()
+        self.fail_at = fail_at
+
+    def upsert(self, vectors, namespace: str = ""):
+        if self.upsert_calls + 1 >= self.fail_at:
+            self.upsert_calls += 1
+            raise RuntimeError("simulated crash")
+        return super().upsert(vectors, namespace)
+
+
+def make_batches(count: int = 5, size: int = 4):
+    batches = []
+    for b in range(count):
+        ids = [f"doc-{b}-{i}" for i in range(size)]
+        docs = [Document(page_content=f"rule {b} {i}",
+                         metadata={"source": "rules.pdf"}) for i in ids]
+        batches.append((ids, docs))
+    return batches
+
+
+def make_uploader(index, checkpoint_path=None, **kwargs):
+    return PineconeUploader(index, FakeEmbeddings(dim=8), namespace="game",
+                            concurrency=1, backoff=0.0,
+                            checkpoint_path=checkpoint_path, **kwargs)
+
+
+def test_retries_transient_upsert_failures():
+    index = InMemoryIndex(transient_failures=2)
+    stats = make_uploader(index).upload(make_batches())
+    assert stats["retries"] == 2
+    assert stats["uploaded"] == 20
+    assert len(index.namespaces["game"]) == 20
+
+
+def test_gives_up_after_max_retries():
+    index = InMemoryIndex(transient_failures=10)
+    with pytest.raises(ConnectionError):
+        make_uploader(index, max_retries=2).upload(make_batches())
+
+
+def test_resumes_from_checkpoint(tmp_path):
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    with pytest.raises(RuntimeError):
+        make_uploader(FailingIndex(fail_at=3), checkpoint_path).upload(
+            make_batches())
+    # The first two batches were committed before the crash
+    assert len(UploadCheckpoint(checkpoint_path).committed) == 2
+
+    index = InMemoryIndex()
+    stats = make_uploader(index, checkpoint_path).upload(make_batches())
+    assert stats["skipped"] == 8
+    assert stats["uploaded"] == 12
+    assert index.upsert_calls == 3
+    assert UploadCheckpoint(checkpoint_path).committed == []
+
+
+def test_checkpoint_ignores_changed_batches(tmp_path):
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    with pytest.raises(RuntimeError):
+        make_uploader(FailingIndex(fail_at=3), checkpoint_path).upload(
+            make_batches())
+
+    index = InMemoryIndex()
+    stats = make_uploader(index, checkpoint_path).upload(
+        make_batches(size=3))
+    assert stats["skipped"] == 0
+    assert stats["uploaded"] == 15
+
+
+def test_rerun_is_idempotent():
+    index = InMemoryIndex()
+    make_uploader(index).upload(make_batches())
+    first = {_id: dict(record)
+             for _id, record in index.namespaces["game"].items()}
+    make_uploader(index).upload(make_batches())
+    assert index.namespaces["game"] == first
+    assert first["doc-0-0"]["metadata"]["text"] == "rule 0 doc-0-0"
+
+
+def test_precomputed_vectors_skip_embedding():
+    embeddings = FakeEmbeddings(dim=8)
+    index = InMemoryIndex()
+    uploader = PineconeUploader(index, embeddings, namespace="game",
+                                concurrency=1)
+    ids, docs = make_batches(count=1)[0]
+    vectors = [[float(i)] * 8 for i in range(len(ids))]
+    uploader.upload([(ids, docs, vectors)])
+    assert embeddings.calls == 0
+    assert index.namespaces["game"]["doc-0-1"]["values"] == [1.0] * 8